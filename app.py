@@ -4,20 +4,41 @@ import time
 import json
 import logging
 import threading
+import atexit
 import tempfile
 from pathlib import Path
 import shutil
 from datetime import datetime
-from flask import Flask, request, render_template, jsonify, flash, redirect, url_for, send_file, session
+from flask import Flask, request, render_template, jsonify, flash, redirect, url_for, send_from_directory, session, Response
 from flask_dropzone import Dropzone
 from werkzeug.utils import secure_filename
 import whisper
 import torch
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
 
 # 導入現有的功能
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
-from whisper_transcribe import check_gpu, select_model_size, format_timestamp
+from whisper_transcribe import check_gpu, select_model_size, format_timestamp, get_audio_duration, compute_file_hash, write_transcripts
+from model_loader import MODELS_FOLDER, load_whisper_model, ModelPool
+from model_store import get_model_store
+from execution_profiles import prepare_model, execution_context, uses_fp16
+from worker_pool import TranscriptionWorkerPool
+from progress import RTFStats, ProgressTracker
+from model_scheduler import choose_model, estimate_backlog_seconds
+from job_scheduler import JobScheduler
+from checkpoint import TranscriptCheckpoint, find_checkpoint_models
+import decode_engine
+from decode_engine import DecodeInterrupted
+from segment_postprocess import postprocess_segments
+from text_postprocess import build_pipeline
+from transcript_index import TranscriptIndex
+from zip_stream import stream_zip
+from streaming import StreamSession, SAMPLE_RATE
+from language_id import identify_language, group_by_language
+from diarization import diarize, assign_speakers
+from memory_admission import MemoryAdmission, is_out_of_memory
+import stub_backend
 
 # 設置日誌
 logging.basicConfig(
@@ -41,11 +62,75 @@ app.config.update(
     DROPZONE_MAX_FILE_SIZE=100,  # MB
     DROPZONE_MAX_FILES=10,
     SECRET_KEY=os.urandom(24),
-    UPLOAD_FOLDER=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads'),
-    OUTPUT_FOLDER=os.path.join(os.path.dirname(os.path.abspath(__file__)), '轉錄結果'),
-    MAX_CONTENT_LENGTH=100 * 1024 * 1024  # 100 MB
+    UPLOAD_FOLDER=os.environ.get('WHISPER_UPLOAD_FOLDER') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads'),
+    OUTPUT_FOLDER=os.environ.get('WHISPER_OUTPUT_FOLDER') or os.path.join(os.path.dirname(os.path.abspath(__file__)), '轉錄結果'),
+    MAX_CONTENT_LENGTH=100 * 1024 * 1024,  # 100 MB
+    # 執行模式：thread 在 Flask 行程內轉錄，process 交由獨立的工作程序池
+    WORKER_MODE=os.environ.get('WHISPER_WORKER_MODE', 'thread'),
+    WORKER_PROCESSES=int(os.environ.get('WHISPER_WORKER_PROCESSES', 2)),
+    WORKER_PRELOAD_MODEL=os.environ.get('WHISPER_WORKER_PRELOAD_MODEL', 'small'),
+    WORKER_HEARTBEAT_TIMEOUT=float(os.environ.get('WHISPER_WORKER_HEARTBEAT_TIMEOUT', 120)),
+    # 自動選擇模型（model=auto）時的完成期限：固定秒數，或音頻長度的倍數
+    TRANSCRIBE_DEADLINE_SECONDS=float(os.environ.get('WHISPER_DEADLINE_SECONDS', 3600)),
+    TRANSCRIBE_SLA_FACTOR=float(os.environ.get('WHISPER_SLA_FACTOR', 0)),
+    # 同時執行的轉錄任務數（0 表示 thread 模式 1 個、process 模式與工作程序數相同）
+    MAX_CONCURRENT_JOBS=int(os.environ.get('WHISPER_MAX_CONCURRENT_JOBS', 0)),
+    # 剩餘音頻超過此秒數的低優先權任務才會被搶佔
+    PREEMPT_MIN_REMAINING_SECONDS=float(os.environ.get('WHISPER_PREEMPT_MIN_REMAINING', 600)),
+    # 詞級時間戳（上傳時可用 word_timestamps 參數個別指定）
+    WORD_TIMESTAMPS=os.environ.get('WHISPER_WORD_TIMESTAMPS', 'false').lower() == 'true',
+    # 字幕每行的字數與秒數上限，0 表示不重新切分
+    SUBTITLE_MAX_CHARS=int(os.environ.get('WHISPER_SUBTITLE_MAX_CHARS', 0)),
+    SUBTITLE_MAX_SECONDS=float(os.environ.get('WHISPER_SUBTITLE_MAX_SECONDS', 0)),
+    # 低信心段落的過濾門檻，未設定時不過濾
+    MIN_AVG_LOGPROB=float(os.environ['WHISPER_MIN_AVG_LOGPROB']) if os.environ.get('WHISPER_MIN_AVG_LOGPROB') else None,
+    MAX_NO_SPEECH_PROB=float(os.environ['WHISPER_MAX_NO_SPEECH_PROB']) if os.environ.get('WHISPER_MAX_NO_SPEECH_PROB') else None,
+    # 推測解碼的常駐小模型（例如 tiny），留空表示不使用；上傳時可用 draft_model 參數個別指定
+    DRAFT_MODEL=os.environ.get('WHISPER_DRAFT_MODEL', ''),
+    DRAFT_TOKENS=int(os.environ.get('WHISPER_DRAFT_TOKENS', 4)),
+    # 即時串流轉錄：常駐模型、每次重新轉錄的間隔、無音頻自動結束的秒數
+    STREAM_MODEL=os.environ.get('WHISPER_STREAM_MODEL', 'base'),
+    STREAM_STEP_SECONDS=float(os.environ.get('WHISPER_STREAM_STEP_SECONDS', 1.0)),
+    STREAM_IDLE_TIMEOUT=float(os.environ.get('WHISPER_STREAM_IDLE_TIMEOUT', 60)),
+    # 轉錄語言，auto 表示轉錄前以小模型偵測一次（上傳時可用 language 參數個別指定）
+    LANGUAGE=os.environ.get('WHISPER_LANGUAGE', 'auto'),
+    LANGUAGE_ID_MODEL=os.environ.get('WHISPER_LANGUAGE_ID_MODEL', 'base'),
+    # 說話者分離（上傳時可用 diarize 與 num_speakers 參數個別指定），在 CPU 上與解碼同時進行
+    DIARIZATION=os.environ.get('WHISPER_DIARIZATION', 'false').lower() == 'true',
+    DIARIZATION_MAX_SPEAKERS=int(os.environ.get('WHISPER_DIARIZATION_MAX_SPEAKERS', 6)),
+    # 記憶體准入控制：預算為總記憶體的比例，或直接指定 GB（0 表示依比例）
+    MEMORY_FRACTION=float(os.environ.get('WHISPER_MEMORY_FRACTION', 0.85)),
+    RAM_BUDGET_GB=float(os.environ.get('WHISPER_RAM_BUDGET_GB', 0)),
+    VRAM_BUDGET_GB=float(os.environ.get('WHISPER_VRAM_BUDGET_GB', 0)),
+    # 等待記憶體配額超過此秒數時改用較小的模型或 CPU
+    ADMISSION_MAX_WAIT=float(os.environ.get('WHISPER_ADMISSION_MAX_WAIT', 600)),
+    # 記憶體不足（OOM）時自動重試的次數
+    OOM_RETRIES=int(os.environ.get('WHISPER_OOM_RETRIES', 2)),
+    # 文字後處理：簡繁轉換（s2t、s2tw、s2twp，留空不轉換）、標點還原、詞語表檔案路徑
+    SCRIPT_CONVERSION=os.environ.get('WHISPER_SCRIPT_CONVERSION', ''),
+    RESTORE_PUNCTUATION=os.environ.get('WHISPER_RESTORE_PUNCTUATION', 'false').lower() == 'true',
+    GLOSSARY=os.environ.get('WHISPER_GLOSSARY', ''),
+    # 執行設定檔（fp32、fp16、bf16、inference、compiled），auto 表示依模型清單的設定或設備預設
+    EXECUTION_PROFILE=os.environ.get('WHISPER_EXECUTION_PROFILE', 'auto'),
+    # 模型後端：whisper，或壓力測試用的 stub（不做推論，每秒音頻等待 STUB_SECONDS_PER_AUDIO_SECOND 秒）
+    BACKEND=os.environ.get('WHISPER_BACKEND', 'whisper'),
+    STUB_SECONDS_PER_AUDIO_SECOND=float(os.environ.get('WHISPER_STUB_RTF', 0.05)),
+    STUB_LOAD_SECONDS=float(os.environ.get('WHISPER_STUB_LOAD_SECONDS', 0))
 )
 
+# 轉錄使用的模型載入與解碼函數，stub 後端只支援 thread 模式
+if app.config['BACKEND'] == 'stub':
+    stub_backend.configure(app.config['STUB_SECONDS_PER_AUDIO_SECOND'], app.config['STUB_LOAD_SECONDS'])
+    load_transcription_model = stub_backend.load_model
+    decode_audio = stub_backend.transcribe
+    if app.config['WORKER_MODE'] == 'process':
+        logging.warning("stub 後端不支援 process 模式，改用 thread 模式")
+        app.config['WORKER_MODE'] = 'thread'
+    logging.info(f"使用 stub 模型後端，每秒音頻模擬解碼 {app.config['STUB_SECONDS_PER_AUDIO_SECOND']} 秒")
+else:
+    load_transcription_model = load_whisper_model
+    decode_audio = decode_engine.transcribe
+
 # 初始化 Dropzone
 dropzone = Dropzone(app)
 
@@ -58,10 +143,121 @@ tasks = {}  # 保存任務狀態的字典
 loaded_model = None  # 全局模型變量
 model_lock = threading.Lock()  # 模型載入鎖
 gpu_info = None  # GPU 信息
+worker_pool = None  # 工作程序池（僅 process 模式使用）
+worker_pool_lock = threading.Lock()  # 工作程序池建立鎖
+diarization_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='diarize')  # 說話者分離（CPU）
+rtf_stats = RTFStats()  # 各模型/設備的實測即時率
+resume_states = {}  # 暫停或被搶佔任務的解碼狀態，恢復時從中斷處繼續
+paused_checkpoints = {}  # 暫停或被搶佔任務的檢查點，取消時一併刪除
+memory_admission = MemoryAdmission.from_system(
+    fraction=app.config['MEMORY_FRACTION'],
+    ram_gb=app.config['RAM_BUDGET_GB'],
+    vram_gb=app.config['VRAM_BUDGET_GB'],
+    shared_weights=app.config['WORKER_MODE'] != 'process',  # process 模式每個工作程序各自載入模型
+    max_wait=app.config['ADMISSION_MAX_WAIT']
+)  # 依預估峰值記憶體放行轉錄任務
+
+draft_models = {}  # 推測解碼用的常駐小模型，依 (模型, 設備) 快取
+
+def get_draft_model(model_name, device):
+    """取得推測解碼用的小模型，首次使用時載入並常駐"""
+    with model_lock:
+        key = (model_name, device)
+        if key not in draft_models:
+            logging.info(f"載入推測解碼用的草稿模型 {model_name} ({device})")
+            draft_models[key] = load_transcription_model(model_name, device=device)
+        return draft_models[key]
+
+stream_sessions = {}  # 即時串流轉錄的工作階段
+resident_model_pool = ModelPool(max_instances=1)  # 串流轉錄與語言偵測共用的常駐模型
+
+def get_text_pipeline():
+    """依設定取得文字後處理流程，編譯好的字典樹在任務之間共用；詞語表讀取失敗時不處理"""
+    try:
+        return build_pipeline(app.config['SCRIPT_CONVERSION'], app.config['GLOSSARY'],
+                              app.config['RESTORE_PUNCTUATION'])
+    except (OSError, ValueError) as e:
+        logging.error(f"建立文字後處理流程失敗: {str(e)}")
+        return None
+
+def finish_stream(session):
+    """串流結束後以與檔案轉錄相同的流程過濾、切行並寫出結果"""
+    if not session.segments:
+        return
+    segments = postprocess_segments(
+        session.segments,
+        min_avg_logprob=app.config['MIN_AVG_LOGPROB'],
+        max_no_speech_prob=app.config['MAX_NO_SPEECH_PROB'],
+        max_chars=app.config['SUBTITLE_MAX_CHARS'],
+        max_seconds=app.config['SUBTITLE_MAX_SECONDS'],
+        text_pipeline=get_text_pipeline()
+    )
+    output_files = write_transcripts(segments, app.config['OUTPUT_FOLDER'], session.id, session.model_name)
+    session.output_files = {fmt: os.path.basename(path) for fmt, path in output_files.items()}
+    logging.info(f"串流 {session.id} 轉錄完成：{output_files['srt']}")
+
+def stream_status(session):
+    """串流狀態，段落附上與 SRT 相同格式的時間戳"""
+    status = session.snapshot(request.args.get('since', 0, type=int))
+    for segment in status['segments']:
+        segment['timestamp'] = f"{format_timestamp(segment['start'])} --> {format_timestamp(segment['end'])}"
+    return status
+
+def resolve_language(task_id, audio_path, device):
+    """
+    決定任務的轉錄語言：有指定時直接使用，auto 時偵測一次（依音頻雜湊快取）
+
+    偵測失敗時回傳 None，交由解碼器在第一個窗口自行偵測。
+    """
+    task = tasks[task_id]
+    language = task.get('language') or app.config['LANGUAGE']
+    if language != 'auto':
+        return language
+
+    task['message'] = '偵測語言中...'
+    try:
+        result = identify_language(audio_path, compute_file_hash(audio_path), resident_model_pool,
+                                   app.config['LANGUAGE_ID_MODEL'], device)
+    except Exception as e:
+        logging.warning(f"語言偵測失敗，改由解碼器偵測 {os.path.basename(audio_path)}: {str(e)}")
+        return None
+    task['language'] = result['language']
+    task['language_detection'] = {key: result[key] for key in ('probability', 'candidates', 'speech_start', 'cached')}
+    return result['language']
+
+def route_batch_by_language(batch_id, jobs, priority):
+    """先偵測批次中每個檔案的語言，再依語言分組依序排入排程器，讓同語言的檔案連續處理"""
+    for task_id, file_path, model_name, use_gpu in jobs:
+        device = "cuda" if use_gpu and torch.cuda.is_available() else "cpu"
+        if tasks.get(task_id, {}).get('status') == 'queued':
+            resolve_language(task_id, file_path, device)
+
+    groups = group_by_language(jobs, lambda job: tasks.get(job[0], {}).get('language') or 'auto')
+    tasks[batch_id]['languages'] = {language: [job[0] for job in group] for language, group in groups.items()}
+    logging.info(f"批次 {batch_id} 語言分組: " + ', '.join(f"{lang} {len(group)} 個" for lang, group in groups.items()))
 
-# 獲取模型資料夾路徑
-MODELS_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models')
-os.makedirs(MODELS_FOLDER, exist_ok=True)
+    for group in groups.values():
+        for task_id, file_path, model_name, use_gpu in group:
+            task = tasks.get(task_id)
+            if task is None or task['status'] != 'queued':
+                continue
+            task['message'] = '排隊中...'
+            job_scheduler.submit(task_id, (file_path, app.config['OUTPUT_FOLDER'], model_name, use_gpu), priority)
+
+def get_worker_pool():
+    """取得工作程序池，首次使用時才啟動子程序"""
+    global worker_pool
+    with worker_pool_lock:
+        if worker_pool is None:
+            device = "cuda" if torch.cuda.is_available() else "cpu"
+            worker_pool = TranscriptionWorkerPool(
+                num_workers=app.config['WORKER_PROCESSES'],
+                model_name=app.config['WORKER_PRELOAD_MODEL'],
+                device=device,
+                heartbeat_timeout=app.config['WORKER_HEARTBEAT_TIMEOUT']
+            )
+            atexit.register(worker_pool.close)
+        return worker_pool
 
 # 在應用啟動時檢查 GPU - 使用 before_request 代替 before_first_request
 @app.before_request
@@ -75,47 +271,92 @@ def check_resources():
 def inject_now():
     return {'now': datetime.now()}
 
-def load_local_model(model_name, device="cuda"):
-    """從本地加載模型"""
-    model_path = os.path.join(MODELS_FOLDER, f"{model_name}.pt")
-    if os.path.exists(model_path):
-        logging.info(f"從本地加載模型: {model_path}")
-        try:
-            model = whisper.load_model(model_name, device=device)
-            model.load_state_dict(torch.load(model_path))
-            logging.info(f"本地模型 {model_name} 載入成功")
-            return model
-        except Exception as e:
-            logging.error(f"載入本地模型失敗: {str(e)}")
-            return None
-    return None
-
-def load_whisper_model(model_name, device="cuda"):
-    """加載模型，優先使用本地模型"""
-    # 嘗試從本地加載
-    model = load_local_model(model_name, device)
-    if model is not None:
-        return model
-    
-    # 如果本地加載失敗，從網絡下載
-    logging.info(f"本地未找到模型 {model_name}，從網絡下載...")
-    model = whisper.load_model(model_name, device=device)
-    
-    # 保存到本地
-    try:
-        model_path = os.path.join(MODELS_FOLDER, f"{model_name}.pt")
-        torch.save(model.state_dict(), model_path)
-        logging.info(f"模型已保存到本地: {model_path}")
-    except Exception as e:
-        logging.warning(f"保存模型到本地時發生錯誤: {str(e)}")
+def select_model_for_task(task_id, audio_path, device):
+    """為 model=auto 的任務選擇模型，並把決策與理由記錄在任務中"""
+    task = tasks[task_id]
+    tasks[task_id]['message'] = '依目前工作量自動選擇模型...'
+    
+    audio_seconds = task.get('audio_duration') or get_audio_duration(audio_path)
+    task['audio_duration'] = round(audio_seconds, 1)
+    
+    # 期限從任務建立時開始計算，排隊時間也算在內
+    deadline = task.get('deadline') or app.config['TRANSCRIBE_DEADLINE_SECONDS']
+    if app.config['TRANSCRIBE_SLA_FACTOR'] > 0:
+        deadline = min(deadline, audio_seconds * app.config['TRANSCRIBE_SLA_FACTOR'])
+    deadline -= time.time() - task['start_time']
+    
+    backlog = estimate_backlog_seconds(tasks, device, rtf_stats, exclude=task_id)
+    parallelism = app.config['WORKER_PROCESSES'] if app.config['WORKER_MODE'] == 'process' else 1
+    model_name, decision = choose_model(audio_seconds, deadline, gpu_info or check_gpu(), device,
+                                        rtf_stats, backlog_seconds=backlog, parallelism=parallelism)
+    
+    task['model'] = model_name
+    task['model_decision'] = decision
+    return model_name
+
+def admit_task(task_id, audio_path, model_name, device):
+    """依預估峰值記憶體等待配額，回傳保留記錄；等待中被取消或暫停時拋出 DecodeInterrupted"""
+    task = tasks[task_id]
+    if not task.get('audio_duration'):
+        task['audio_duration'] = round(get_audio_duration(audio_path), 1)
+    
+    def on_wait(plan):
+        task['message'] = f"等待記憶體配額（{plan['model']}@{plan['device']}）..."
+    
+    reservation = memory_admission.admit(
+        task_id, model_name, device, task['audio_duration'],
+        allow_smaller=not task.get('force_model'),
+        exclude=[tuple(pair) for pair in task.get('oom_excluded', [])],
+        should_stop=lambda: job_scheduler.stop_requested(task_id),
+        on_wait=on_wait
+    )
+    if reservation is None:
+        raise DecodeInterrupted(job_scheduler.stop_requested(task_id), None)
+    task['memory_reservation'] = {key: round(reservation[key], 2) for key in ('weights_gb', 'ram_gb', 'vram_gb')}
+    task['memory_reservation']['waited_seconds'] = reservation['waited_seconds']
+    if [reservation['model'], reservation['device']] != [model_name, device]:
+        task['degraded'] = {'requested': f"{model_name}@{device}",
+                            'used': f"{reservation['model']}@{reservation['device']}"}
+    return reservation
+
+def retry_after_oom(task_id, reservation, error):
+    """記錄 OOM 事件並決定是否重試；單獨執行仍 OOM 的模型/設備組合之後不再使用"""
+    event = memory_admission.record_oom(reservation, error)
+    memory_admission.release(reservation)
+    task = tasks[task_id]
+    events = task.setdefault('oom_events', [])
+    events.append(event)
+    if event['alone']:
+        task.setdefault('oom_excluded', []).append([reservation['model'], reservation['device']])
+    if len(events) > app.config['OOM_RETRIES']:
+        return False
     
-    return model
+    task['message'] = f'記憶體不足，重新估算後重試（第 {len(events)} 次）...'
+    logging.warning(f"任務 {task_id} 記憶體不足，第 {len(events)} 次重試")
+    return True
+
+# OOM 後需要重試時 _transcribe_attempt() 的回傳值
+OOM_RETRY = object()
 
 # 轉錄文件函數
 def transcribe_file(file_path, output_dir, model_name="small", task_id=None, use_gpu=True):
-    """轉錄單個音頻文件的後台任務"""
+    """轉錄單個音頻文件的後台任務，記憶體不足時重試"""
+    shared = {}  # 各次嘗試共用的 PCM 與說話者分離
+    while True:
+        outcome = _transcribe_attempt(file_path, output_dir, model_name, task_id, use_gpu, shared)
+        if outcome is not OOM_RETRY:
+            return outcome
+        # 離開例外處理後失敗嘗試的框架與張量才會釋放，此時清空 CUDA 快取才有效；
+        # 有檢查點時從最後一個完成的窗口繼續
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+def _transcribe_attempt(file_path, output_dir, model_name, task_id, use_gpu, shared):
+    """一次轉錄嘗試，回傳 True/False，或需要重試時回傳 OOM_RETRY"""
     global loaded_model, tasks
     
+    reservation = None
+    checkpoint = None
     try:
         # 確保任務存在
         if task_id not in tasks:
@@ -143,102 +384,177 @@ def transcribe_file(file_path, output_dir, model_name="small", task_id=None, use
         device = "cuda" if use_gpu and torch.cuda.is_available() else "cpu"
         logging.info(f"使用設備: {device} 處理文件 {os.path.basename(audio_path)}")
         
-        tasks[task_id]['progress'] = 20
-        tasks[task_id]['message'] = f'載入 {model_name} 模型中...'
+        # 暫停或被搶佔的任務從中斷處繼續，並沿用當時選定的模型
+        resume_state = resume_states.pop(task_id, None)
+        paused_checkpoints.pop(task_id, None)
+        if resume_state is not None and tasks[task_id].get('model_decision'):
+            model_name = tasks[task_id]['model']
         
-        # 載入模型（使用模型鎖來確保線程安全）
-        with model_lock:
-            current_model = loaded_model['name'] if loaded_model else 'None'
-            logging.info(f"當前已載入的模型: {current_model}")
-            
-            if loaded_model is None or loaded_model['name'] != model_name:
-                logging.info(f"需要切換模型從 {current_model} 到 {model_name}")
-                
-                # 保存當前模型名稱
-                target_model = model_name
-                
-                # 清理 GPU 記憶體
-                if use_gpu and torch.cuda.is_available():
-                    torch.cuda.empty_cache()
-                    logging.info("已清理 GPU 記憶體")
-                
-                # 載入新模型
-                logging.info(f"開始載入 {target_model} 模型...")
-                model = load_whisper_model(target_model, device=device)
-                loaded_model = {'model': model, 'name': target_model}
-                logging.info(f"模型 {target_model} 載入成功")
+        # 未指定語言時轉錄前偵測一次，偵測結果記錄在任務中
+        language = resolve_language(task_id, audio_path, device)
+        
+        # 自動選擇模型：已有未完成的檢查點時沿用當時的模型，否則依實測即時率與目前工作量選擇
+        if model_name == 'auto':
+            existing = [m for m, lang in find_checkpoint_models(compute_file_hash(audio_path)) if lang == (language or 'auto')]
+            if existing:
+                model_name = existing[0]
+                tasks[task_id]['model'] = model_name
+                logging.info(f"找到 {model_name} 模型的未完成檢查點，沿用該模型")
             else:
-                model = loaded_model['model']
-                logging.info(f"使用已載入的 {model_name} 模型")
+                model_name = select_model_for_task(task_id, audio_path, device)
         
-        # 再次確認使用的模型是否正確
-        if loaded_model['name'] != model_name:
-            error_msg = f"模型載入錯誤！請求的模型是 {model_name}，但實際載入的是 {loaded_model['name']}"
-            logging.error(error_msg)
-            tasks[task_id]['status'] = 'error'
-            tasks[task_id]['message'] = error_msg
-            return False
-            
-        tasks[task_id]['progress'] = 40
-        tasks[task_id]['message'] = f'使用 {model_name} 模型開始轉錄...'
+        # 記憶體預算不足時等待，或改用較小的模型、CPU
+        reservation = admit_task(task_id, audio_path, model_name, device)
+        if reservation['model'] != model_name:
+            model_name = reservation['model']
+            tasks[task_id]['model'] = model_name
+            resume_state = None  # 暫停時的解碼狀態屬於原本的模型
+        if reservation['device'] != device:
+            device = reservation['device']
+            logging.info(f"改用設備: {device} 處理文件 {os.path.basename(audio_path)}")
+        
+        # 程式中斷後重新處理同一檔案時，從最後一個檢查點繼續
+        checkpoint = TranscriptCheckpoint(compute_file_hash(audio_path), model_name, language)
+        if resume_state is None:
+            resume_state = checkpoint.load()
+        if resume_state is not None:
+            tasks[task_id]['resumed_from'] = round(resume_state['offset'], 1)
         
         # 設置轉錄選項
         transcribe_options = {
-            "language": "zh",
+            "language": language,
             "task": "transcribe",
-            "fp16": use_gpu and torch.cuda.is_available()
+            "fp16": device == "cuda",
+            "word_timestamps": tasks[task_id].get('word_timestamps', app.config['WORD_TIMESTAMPS']),
+            "draft_tokens": app.config['DRAFT_TOKENS'],
+            "resume_state": resume_state
         }
+        draft_name = tasks[task_id].get('draft_model', app.config['DRAFT_MODEL'])
+        if draft_name == model_name:
+            draft_name = None
         
-        # 使用 autocast 進行混合精度計算
-        with torch.amp.autocast('cuda') if use_gpu and torch.cuda.is_available() else torch.no_grad():
-            logging.info(f"使用 {model_name} 模型開始轉錄檔案: {audio_path}")
-            result = model.transcribe(audio_path, **transcribe_options)
-        
-        tasks[task_id]['progress'] = 80
-        tasks[task_id]['message'] = '轉錄完成，保存結果...'
+        # 依解碼器的 seek 位置回報進度與預估剩餘時間
+        tracker = ProgressTracker(tasks[task_id], model_name, device, rtf_stats)
         
-        # 生成輸出文件名
-        base_name = os.path.splitext(os.path.basename(audio_path))[0]
-        txt_output_file = os.path.join(output_dir, f"{base_name}.txt")
-        srt_output_file = os.path.join(output_dir, f"{base_name}.srt")
+        # 說話者分離在另一個執行緒以 CPU 處理，與解碼同時進行；重試時沿用先前送出的工作
+        diarization = shared.get('diarization')
+        audio = shared.get('audio', audio_path)
+        if diarization is None and tasks[task_id].get('diarize', app.config['DIARIZATION']):
+            if app.config['WORKER_MODE'] != 'process':
+                # 只解碼一次音頻，解碼器與說話者分離共用同一份 PCM
+                audio = whisper.load_audio(audio_path)
+                diarization = diarization_executor.submit(diarize, audio, tasks[task_id].get('num_speakers'),
+                                                          app.config['DIARIZATION_MAX_SPEAKERS'])
+            else:
+                # 工作程序在另一個行程解碼，說話者分離自行載入 PCM
+                diarization = diarization_executor.submit(
+                    lambda: diarize(whisper.load_audio(audio_path), tasks[task_id].get('num_speakers'),
+                                    app.config['DIARIZATION_MAX_SPEAKERS']))
+            shared.update(diarization=diarization, audio=audio)
         
-        # 保存純文本結果
-        full_text = ""
-        with open(txt_output_file, "w", encoding="utf-8") as f:
-            # 在文件開頭添加使用的模型信息
-            f.write(f"# 使用模型: {model_name}\n\n")
-            for segment in result["segments"]:
-                text = segment["text"].strip()
-                full_text += text + "\n"
-                f.write(text + "\n")
+        if app.config['WORKER_MODE'] == 'process':
+            # 交由獨立的工作程序解碼，避免 GIL 爭用並隔離崩潰
+            tasks[task_id]['progress'] = 20
+            tasks[task_id]['message'] = f'交由工作程序使用 {model_name} 模型轉錄...'
+            logging.info(f"以工作程序模式轉錄檔案: {audio_path}，模型: {model_name}")
+            future = get_worker_pool().submit(audio_path, model_name, device,
+                                              dict(transcribe_options, draft_model=draft_name or None,
+                                                   execution_profile=app.config['EXECUTION_PROFILE']),
+                                              on_progress=tracker.update,
+                                              on_window=checkpoint.save_window,
+                                              should_stop=lambda: job_scheduler.stop_requested(task_id))
+            result = future.result()
+            tasks[task_id]['execution_profile'] = result.get('execution_profile')
+        else:
+            tasks[task_id]['progress'] = 20
+            tasks[task_id]['message'] = f'載入 {model_name} 模型中...'
         
-        # 保存 SRT 格式
-        with open(srt_output_file, "w", encoding="utf-8") as f:
-            # 在文件開頭添加使用的模型信息
-            f.write(f"1\n00:00:00,000 --> 00:00:01,000\n使用模型: {model_name}\n\n")
-            offset = 2
-            for i, segment in enumerate(result["segments"], offset):
-                start_time = format_timestamp(segment["start"]).replace(".", ",")
-                end_time = format_timestamp(segment["end"]).replace(".", ",")
-                text = segment["text"].strip()
+            # 載入模型（使用模型鎖來確保線程安全）
+            with model_lock:
+                current_model = loaded_model['name'] if loaded_model else 'None'
+                logging.info(f"當前已載入的模型: {current_model}")
+            
+                if loaded_model is None or loaded_model['name'] != model_name or loaded_model.get('device') != device:
+                    logging.info(f"需要切換模型從 {current_model} 到 {model_name}")
+                
+                    # 保存當前模型名稱
+                    target_model = model_name
+                
+                    # 清理 GPU 記憶體；舊模型在新模型載入後才替換，其他執行緒不會看到未載入的狀態
+                    if torch.cuda.is_available():
+                        torch.cuda.empty_cache()
+                        logging.info("已清理 GPU 記憶體")
                 
-                f.write(f"{i}\n")
-                f.write(f"{start_time} --> {end_time}\n")
-                f.write(f"{text}\n\n")
+                    # 載入新模型
+                    logging.info(f"開始載入 {target_model} 模型...")
+                    model = load_transcription_model(target_model, device=device)
+                    loaded_model = {'model': model, 'name': target_model, 'device': device}
+                    logging.info(f"模型 {target_model} 載入成功")
+                else:
+                    model = loaded_model['model']
+                    logging.info(f"使用已載入的 {model_name} 模型")
         
-        logging.info(f"使用 {model_name} 模型轉錄完成：{txt_output_file} 和 {srt_output_file}")
+            draft_model = get_draft_model(draft_name, device) if draft_name else None
+            
+            # 依執行設定檔決定精度與執行方式，編譯與暖機只在模型第一次使用該設定檔時進行
+            profile = prepare_model(model, model_name, device, app.config['EXECUTION_PROFILE'])
+            transcribe_options['fp16'] = uses_fp16(profile, device)
+            tasks[task_id]['execution_profile'] = profile
+            
+            tasks[task_id]['progress'] = 40
+            tasks[task_id]['message'] = f'使用 {model_name} 模型開始轉錄...'
+        
+            with execution_context(profile, device, model):
+                logging.info(f"使用 {model_name} 模型（{profile}）開始轉錄檔案: {audio_path}")
+                result = decode_audio(model, audio, draft_model=draft_model,
+                                      on_progress=tracker.update,
+                                      on_window=checkpoint.save_window,
+                                      should_stop=lambda: job_scheduler.stop_requested(task_id),
+                                      **transcribe_options)
+        
+        tracker.finish()
+        # 溫度回退次數與快取重用省下的時間
+        tasks[task_id]['decode_stats'] = result.get('decode_stats')
+        tasks[task_id]['progress'] = 95
+        tasks[task_id]['message'] = '轉錄完成，保存結果...'
+        
+        segments = result["segments"]
+        if diarization is not None:
+            tasks[task_id]['message'] = '轉錄完成，等待說話者分離...'
+            turns = diarization.result()
+            tasks[task_id]['speakers'] = len({turn['speaker'] for turn in turns})
+            segments = assign_speakers(segments, turns)
+        
+        # 過濾低信心段落並切分字幕行後，保存純文本與 SRT 結果
+        segments = postprocess_segments(
+            segments,
+            min_avg_logprob=app.config['MIN_AVG_LOGPROB'],
+            max_no_speech_prob=app.config['MAX_NO_SPEECH_PROB'],
+            max_chars=app.config['SUBTITLE_MAX_CHARS'],
+            max_seconds=app.config['SUBTITLE_MAX_SECONDS'],
+            text_pipeline=get_text_pipeline()
+        )
+        base_name = os.path.splitext(os.path.basename(audio_path))[0]
+        output_files = write_transcripts(segments, output_dir, base_name, model_name)
+        
+        logging.info(f"使用 {model_name} 模型轉錄完成：{output_files['txt']} 和 {output_files['srt']}")
+        checkpoint.remove()
         
         tasks[task_id]['status'] = 'completed'
         tasks[task_id]['progress'] = 100
         tasks[task_id]['message'] = f'使用 {model_name} 模型轉錄完成！'
-        tasks[task_id]['output_files'] = {
-            'txt': os.path.basename(txt_output_file),
-            'srt': os.path.basename(srt_output_file)
-        }
+        tasks[task_id]['output_files'] = {fmt: os.path.basename(path) for fmt, path in output_files.items()}
         
         return True
         
+    except DecodeInterrupted as e:
+        return handle_interruption(task_id, e, checkpoint)
+        
     except Exception as e:
+        if reservation is not None and is_out_of_memory(e) and retry_after_oom(task_id, reservation, e):
+            # 在例外處理之外重試，失敗嘗試的張量才能釋放
+            return OOM_RETRY
+        
         logging.error(f"轉錄音頻時發生錯誤: {str(e)}", exc_info=True)
         
         if task_id in tasks:
@@ -246,12 +562,78 @@ def transcribe_file(file_path, output_dir, model_name="small", task_id=None, use
             tasks[task_id]['message'] = f'轉錄過程中發生錯誤: {str(e)}'
         
         return False
+    
+    finally:
+        if reservation is not None:
+            memory_admission.release(reservation)
+
+def handle_interruption(task_id, interruption, checkpoint=None):
+    """處理在窗口邊界停止的任務：取消、暫停或被搶佔"""
+    job_scheduler.mark_stopped(task_id, interruption.reason)
+    task = tasks.get(task_id)
+    if task is None:
+        return False
+    
+    state = interruption.state
+    offset = state['offset'] if state else 0.0
+    position = format_timestamp(offset)
+    logging.info(f"任務 {task_id} 在 {position} 停止，原因: {interruption.reason}")
+    
+    if interruption.reason == 'cancel':
+        if checkpoint is not None:
+            checkpoint.remove()
+        task['status'] = 'cancelled'
+        task['message'] = f'已取消（停在 {position}）'
+        return False
+    
+    if state is not None:
+        resume_states[task_id] = state
+    if checkpoint is not None:
+        paused_checkpoints[task_id] = checkpoint
+    task['resume_offset'] = round(offset, 1)
+    if interruption.reason == 'pause':
+        task['status'] = 'paused'
+        task['message'] = f'已暫停於 {position}，可隨時繼續'
+    else:
+        task['status'] = 'queued'
+        task['message'] = f'被高優先權任務搶佔，稍後從 {position} 繼續'
+    return False
+
+def run_transcription_job(task_id, file_path, output_dir, model_name, use_gpu):
+    """排程器執行槽呼叫的任務入口，記錄開始與結束時間以計算排隊等待與總耗時"""
+    task = tasks.get(task_id)
+    if task is not None:
+        task.setdefault('started_at', time.time())
+    try:
+        return transcribe_file(file_path, output_dir, model_name, task_id, use_gpu)
+    finally:
+        if task is not None and task['status'] in ('completed', 'error', 'cancelled'):
+            task['finished_at'] = time.time()
+
+def remaining_audio_seconds(task_id):
+    """任務尚未解碼的音頻秒數，未知時回傳 None"""
+    task = tasks.get(task_id)
+    if not task or not task.get('audio_duration'):
+        return None
+    return task['audio_duration'] - task.get('decoded_seconds', 0.0)
+
+# 轉錄任務排程器
+job_scheduler = JobScheduler(
+    run_transcription_job,
+    max_concurrent=app.config['MAX_CONCURRENT_JOBS'] or (
+        app.config['WORKER_PROCESSES'] if app.config['WORKER_MODE'] == 'process' else 1),
+    preempt_min_remaining=app.config['PREEMPT_MIN_REMAINING_SECONDS'],
+    remaining_seconds=remaining_audio_seconds
+)
 
 # 首頁路由
 @app.route('/')
 def index():
     # 獲取可用模型
     models = ["tiny", "base", "small", "medium", "large-v3"]
+    # 上傳的自訂模型
+    models += sorted(name for name in get_model_store().entries() if name not in models)
+    models.append("auto")
     
     # 獲取系統資訊
     system_info = check_gpu()
@@ -299,6 +681,15 @@ def upload():
     model_name = request.form.get('model', current_model)
     use_gpu = request.form.get('use_gpu', 'true').lower() == 'true'
     force_model = request.form.get('force_model', 'false').lower() == 'true'
+    # model=auto 時可指定完成期限（秒）
+    deadline = request.form.get('deadline', type=float)
+    # 優先權越高越先處理，必要時可搶佔低優先權的長任務
+    priority = request.form.get('priority', 0, type=int)
+    word_timestamps = request.form.get('word_timestamps', str(app.config['WORD_TIMESTAMPS'])).lower() == 'true'
+    draft_model = request.form.get('draft_model', app.config['DRAFT_MODEL'])
+    language = request.form.get('language', app.config['LANGUAGE'])
+    diarize_speakers = request.form.get('diarize', str(app.config['DIARIZATION'])).lower() == 'true'
+    num_speakers = request.form.get('num_speakers', type=int)
     
     # 記錄收到的請求信息
     logging.info(f"收到上傳請求，選擇的模型: {model_name}，使用GPU: {use_gpu}，強制使用模型: {force_model}")
@@ -323,19 +714,23 @@ def upload():
         'message': '等待處理...',
         'model': model_name,
         'use_gpu': use_gpu,
-        'start_time': time.time()
+        'start_time': time.time(),
+        'deadline': deadline,
+        'priority': priority,
+        'word_timestamps': word_timestamps,
+        'draft_model': draft_model,
+        'language': language,
+        'diarize': diarize_speakers,
+        'num_speakers': num_speakers,
+        'force_model': force_model
     }
     
     # 保存上傳的文件
     upload_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
     file.save(upload_path)
     
-    # 在新線程中處理轉錄
-    thread = threading.Thread(
-        target=transcribe_file,
-        args=(upload_path, app.config['OUTPUT_FOLDER'], model_name, task_id, use_gpu)
-    )
-    thread.start()
+    # 交由排程器處理轉錄
+    job_scheduler.submit(task_id, (upload_path, app.config['OUTPUT_FOLDER'], model_name, use_gpu), priority)
     
     return jsonify({
         'success': True,
@@ -349,23 +744,213 @@ def get_task_status(task_id):
     if task_id not in tasks:
         return jsonify({'error': '找不到任務'}), 404
     
-    task = tasks[task_id]
+    # 轉錄執行緒會同時更新任務記錄，先複製一份再序列化
+    task = dict(tasks[task_id])
     # 計算運行時間
     if task['status'] != 'completed' and task['status'] != 'error':
         task['run_time'] = int(time.time() - task['start_time'])
     
     return jsonify(task)
 
+def control_targets(task_id):
+    """批次任務的控制操作套用到所有子任務"""
+    return tasks[task_id].get('subtasks') or [task_id]
+
+# 取消任務
+@app.route('/task/<task_id>/cancel', methods=['POST'])
+def cancel_task(task_id):
+    if task_id not in tasks:
+        return jsonify({'error': '找不到任務'}), 404
+    
+    affected = []
+    for target_id in control_targets(task_id):
+        outcome = job_scheduler.cancel(target_id)
+        target = tasks.get(target_id)
+        if outcome is None and target is not None and target['status'] == 'queued':
+            # 仍在偵測語言、尚未排入排程器的批次任務
+            outcome = 'removed'
+        if outcome is None or target is None:
+            continue
+        if outcome == 'running':
+            target['message'] = '取消中，將在目前的 30 秒窗口結束後停止...'
+        else:
+            resume_states.pop(target_id, None)
+            # 與執行中的任務被取消時相同，刪除暫停時留下的檢查點，之後重新上傳不會從這裡接續
+            checkpoint = paused_checkpoints.pop(target_id, None)
+            if checkpoint is not None:
+                checkpoint.remove()
+            target['status'] = 'cancelled'
+            target['message'] = '已取消'
+        affected.append(target_id)
+    
+    if not affected:
+        return jsonify({'error': '任務已結束，無法取消'}), 400
+    return jsonify({'success': True, 'tasks': affected})
+
+# 暫停任務
+@app.route('/task/<task_id>/pause', methods=['POST'])
+def pause_task(task_id):
+    if task_id not in tasks:
+        return jsonify({'error': '找不到任務'}), 404
+    
+    affected = []
+    for target_id in control_targets(task_id):
+        outcome = job_scheduler.pause(target_id)
+        target = tasks.get(target_id)
+        if outcome is None or target is None:
+            continue
+        if outcome == 'running':
+            target['message'] = '暫停中，將在目前的 30 秒窗口結束後停止...'
+        else:
+            target['status'] = 'paused'
+            target['message'] = '已暫停'
+        affected.append(target_id)
+    
+    if not affected:
+        return jsonify({'error': '任務無法暫停'}), 400
+    return jsonify({'success': True, 'tasks': affected})
+
+# 繼續暫停中的任務
+@app.route('/task/<task_id>/resume', methods=['POST'])
+def resume_task(task_id):
+    if task_id not in tasks:
+        return jsonify({'error': '找不到任務'}), 404
+    
+    affected = []
+    for target_id in control_targets(task_id):
+        if job_scheduler.resume(target_id):
+            tasks[target_id]['status'] = 'queued'
+            tasks[target_id]['message'] = '已恢復，排隊中...'
+            affected.append(target_id)
+    
+    if not affected:
+        return jsonify({'error': '沒有暫停中的任務'}), 400
+    return jsonify({'success': True, 'tasks': affected})
+
 # 獲取所有任務狀態
 @app.route('/tasks', methods=['GET'])
 def get_all_tasks():
-    return jsonify(tasks)
+    return jsonify({task_id: dict(task) for task_id, task in list(tasks.items())})
 
 # 下載文件
 @app.route('/download/<filename>', methods=['GET'])
 def download_file(filename):
-    return send_file(os.path.join(app.config['OUTPUT_FOLDER'], filename),
-                     as_attachment=True)
+    # send_from_directory 會拒絕跳出輸出資料夾的路徑，並支援 Range/條件式請求
+    return send_from_directory(app.config['OUTPUT_FOLDER'], filename, as_attachment=True)
+
+# 打包下載整批轉錄結果
+@app.route('/batch/<batch_id>/download', methods=['GET'])
+def download_batch(batch_id):
+    batch = tasks.get(batch_id)
+    if batch is None or 'subtasks' not in batch:
+        return jsonify({'error': '找不到批次'}), 404
+
+    level = request.args.get('level', 6, type=int)
+    if not 0 <= level <= 9:
+        return jsonify({'error': '壓縮等級必須介於 0 到 9'}), 400
+    formats = request.args.get('formats')
+    formats = set(formats.split(',')) if formats else None
+
+    # 先取出檔案清單，串流期間任務狀態變動不影響這次下載
+    output_dir = os.path.abspath(app.config['OUTPUT_FOLDER'])
+    entries = []
+    skipped = 0
+    for task_id in list(batch['subtasks']):
+        task = tasks.get(task_id, {})
+        output_files = task.get('output_files')
+        if task.get('status') != 'completed' or not output_files:
+            skipped += 1
+            continue
+        for fmt, filename in output_files.items():
+            if formats is None or fmt in formats:
+                entries.append((filename, os.path.join(output_dir, filename)))
+
+    if not entries:
+        return jsonify({'error': '此批次尚無已完成的轉錄結果'}), 404
+    if skipped:
+        logging.info(f"批次 {batch_id} 打包下載略過 {skipped} 個未完成的任務")
+
+    response = Response(stream_zip(entries, compresslevel=level), mimetype='application/zip')
+    response.headers.set('Content-Disposition', 'attachment', filename=f'{batch_id}.zip')
+    response.headers['X-Skipped-Tasks'] = str(skipped)
+    return response
+
+# 開始即時串流轉錄
+@app.route('/stream', methods=['POST'])
+def start_stream():
+    options = request.get_json(silent=True) or request.form
+    model_name = options.get('model') or app.config['STREAM_MODEL']
+    # auto 時由第一段有語音的轉錄結果決定語言，之後固定使用
+    language = options.get('language') or app.config['LANGUAGE']
+    if language == 'auto':
+        language = None
+    name = secure_filename(options.get('name', '')) or 'live'
+    stream_id = f"{name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    if stream_id in stream_sessions:
+        return jsonify({'error': '同名的串流已存在'}), 409
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    stream_sessions[stream_id] = StreamSession(
+        stream_id, resident_model_pool, model_name, device=device, language=language,
+        step_seconds=app.config['STREAM_STEP_SECONDS'],
+        idle_timeout=app.config['STREAM_IDLE_TIMEOUT'],
+        on_finish=finish_stream
+    )
+    logging.info(f"開始串流轉錄 {stream_id}（{model_name}@{device}）")
+    return jsonify({'stream_id': stream_id, 'sample_rate': SAMPLE_RATE, 'format': 's16le', 'channels': 1})
+
+# 送入串流音頻（16 kHz 單聲道 16-bit PCM，可分塊傳送）
+@app.route('/stream/<stream_id>/audio', methods=['POST'])
+def feed_stream(stream_id):
+    session = stream_sessions.get(stream_id)
+    if session is None:
+        return jsonify({'error': '找不到串流'}), 404
+    try:
+        while True:
+            chunk = request.stream.read(64 * 1024)
+            if not chunk:
+                break
+            session.feed(chunk)
+    except RuntimeError as e:
+        return jsonify({'error': str(e)}), 409
+    return jsonify(stream_status(session))
+
+# 串流目前的暫定文字與已定稿段落
+@app.route('/stream/<stream_id>', methods=['GET'])
+def get_stream(stream_id):
+    session = stream_sessions.get(stream_id)
+    if session is None:
+        return jsonify({'error': '找不到串流'}), 404
+    return jsonify(stream_status(session))
+
+# 結束串流並寫出轉錄結果
+@app.route('/stream/<stream_id>/stop', methods=['POST'])
+def stop_stream(stream_id):
+    session = stream_sessions.get(stream_id)
+    if session is None:
+        return jsonify({'error': '找不到串流'}), 404
+    session.stop(timeout=120)
+    return jsonify(stream_status(session))
+
+# 全文檢索轉錄結果
+@app.route('/search', methods=['GET'])
+def search_transcripts():
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': '請輸入搜尋關鍵字'}), 400
+    try:
+        limit = min(max(int(request.args.get('limit', 50)), 1), 200)
+        offset = max(int(request.args.get('offset', 0)), 0)
+    except ValueError:
+        return jsonify({'error': 'limit 與 offset 必須是整數'}), 400
+
+    started = time.perf_counter()
+    result = TranscriptIndex.for_folder(app.config['OUTPUT_FOLDER']).search(query, limit=limit, offset=offset)
+    result['query'] = query
+    result['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 2)
+    for item in result['results']:
+        item['download'] = url_for('download_file', filename=f"{item['file']}.srt")
+    return jsonify(result)
 
 # 批量處理路由
 @app.route('/batch', methods=['POST'])
@@ -373,6 +958,11 @@ def batch_process():
     files = request.json.get('files', [])
     model_name = request.json.get('model', 'small')
     use_gpu = request.json.get('use_gpu', True)
+    deadline = request.json.get('deadline')
+    priority = int(request.json.get('priority', 0))
+    language = request.json.get('language', app.config['LANGUAGE'])
+    diarize_speakers = bool(request.json.get('diarize', app.config['DIARIZATION']))
+    num_speakers = request.json.get('num_speakers')
     
     if not files:
         return jsonify({'error': '沒有選擇文件'}), 400
@@ -389,6 +979,7 @@ def batch_process():
     }
     
     # 創建並啟動子任務
+    jobs = []
     for file in files:
         file_path = os.path.join(app.config['UPLOAD_FOLDER'], secure_filename(file))
         if os.path.exists(file_path):
@@ -402,17 +993,19 @@ def batch_process():
                 'model': model_name,
                 'use_gpu': use_gpu,
                 'start_time': time.time(),
+                'deadline': deadline,
+                'priority': priority,
+                'language': language,
+                'diarize': diarize_speakers,
+                'num_speakers': num_speakers,
                 'batch_id': batch_id
             }
             tasks[batch_id]['subtasks'].append(task_id)
-            
-            # 啟動轉錄線程
-            thread = threading.Thread(
-                target=transcribe_file,
-                args=(file_path, app.config['OUTPUT_FOLDER'], model_name, task_id, use_gpu)
-            )
-            thread.daemon = True
-            thread.start()
+            jobs.append((task_id, file_path, model_name, use_gpu))
+    
+    # 偵測語言後依語言分組交由排程器處理
+    threading.Thread(target=route_batch_by_language, args=(batch_id, jobs, priority),
+                     name=f'route-{batch_id}', daemon=True).start()
     
     return jsonify({
         'batch_id': batch_id,
@@ -423,14 +1016,30 @@ def batch_process():
 @app.route('/system-info', methods=['GET'])
 def get_system_info():
     system_info = check_gpu()
+    system_info['rtf_stats'] = rtf_stats.snapshot()
+    system_info['memory_admission'] = memory_admission.snapshot()
     return jsonify(system_info)
 
+# 獲取工作程序池狀態
+@app.route('/workers', methods=['GET'])
+def get_workers_status():
+    if app.config['WORKER_MODE'] != 'process':
+        return jsonify({'mode': app.config['WORKER_MODE'], 'workers': []})
+    status = get_worker_pool().status()
+    status['mode'] = 'process'
+    return jsonify(status)
+
 # 處理 "訪談記錄" 資料夾中的文件
 @app.route('/process-interview', methods=['POST'])
 def process_interview():
     current_model = loaded_model['name'] if loaded_model else 'small'
     model_name = request.form.get('model', current_model)
     use_gpu = request.form.get('use_gpu', 'true').lower() == 'true'
+    deadline = request.form.get('deadline', type=float)
+    priority = request.form.get('priority', 0, type=int)
+    language = request.form.get('language', app.config['LANGUAGE'])
+    diarize_speakers = request.form.get('diarize', str(app.config['DIARIZATION'])).lower() == 'true'
+    num_speakers = request.form.get('num_speakers', type=int)
     
     # 獲取訪談記錄資料夾路徑
     interview_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "訪談記錄")
@@ -457,6 +1066,7 @@ def process_interview():
     }
     
     # 創建並啟動子任務
+    jobs = []
     for file in audio_files:
         file_path = os.path.join(interview_dir, file)
         if os.path.exists(file_path):
@@ -470,17 +1080,19 @@ def process_interview():
                 'model': model_name,
                 'use_gpu': use_gpu,
                 'start_time': time.time(),
+                'deadline': deadline,
+                'priority': priority,
+                'language': language,
+                'diarize': diarize_speakers,
+                'num_speakers': num_speakers,
                 'batch_id': batch_id
             }
             tasks[batch_id]['subtasks'].append(task_id)
-            
-            # 啟動轉錄線程
-            thread = threading.Thread(
-                target=transcribe_file,
-                args=(file_path, app.config['OUTPUT_FOLDER'], model_name, task_id, use_gpu)
-            )
-            thread.daemon = True
-            thread.start()
+            jobs.append((task_id, file_path, model_name, use_gpu))
+    
+    # 偵測語言後依語言分組交由排程器處理
+    threading.Thread(target=route_batch_by_language, args=(batch_id, jobs, priority),
+                     name=f'route-{batch_id}', daemon=True).start()
     
     return jsonify({
         'batch_id': batch_id,
@@ -504,12 +1116,13 @@ def clean_tasks():
     # 更新任務列表
     tasks = active_tasks
     
+    # 已結束的串流工作階段
+    for stream_id, session in list(stream_sessions.items()):
+        if session.status in ('completed', 'error') and current_time - session.started_at >= 86400:
+            del stream_sessions[stream_id]
+    
     return jsonify({'message': f'清理完成，保留 {len(tasks)} 個任務'})
 
-# 獲取模型資料夾路徑
-MODELS_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models')
-os.makedirs(MODELS_FOLDER, exist_ok=True)
-
 @app.route('/open_models_folder', methods=['POST'])
 def open_models_folder():
     try:
@@ -549,15 +1162,25 @@ def add_model():
         flash('不支援的文件格式', 'danger')
         return redirect(url_for('index'))
     
-    # 安全地保存文件
-    filename = secure_filename(f"{model_name}{file_ext}")
-    file_path = os.path.join(MODELS_FOLDER, filename)
+    model_name = secure_filename(model_name)
+    if not model_name:
+        flash('模型名稱不正確', 'danger')
+        return redirect(url_for('index'))
     
+    # 先存成暫存檔，驗證為 Whisper 模型並計算雜湊後才登錄到模型清單
+    fd, tmp_path = tempfile.mkstemp(dir=MODELS_FOLDER, prefix='.upload-', suffix=file_ext)
+    os.close(fd)
     try:
-        file.save(file_path)
-        flash('模型添加成功', 'success')
+        file.save(tmp_path)
+        entry = get_model_store().register(model_name, tmp_path, source='upload', model_type=model_type, move=True)
+        flash(f'模型添加成功（sha256 {entry["sha256"][:12]}…）', 'success')
+    except ValueError as e:
+        flash(f'無法使用此模型文件: {str(e)}', 'danger')
     except Exception as e:
         flash(f'保存文件時發生錯誤: {str(e)}', 'danger')
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
     
     return redirect(url_for('index'))
 
@@ -579,6 +1202,14 @@ def update_model():
             logging.error(error_msg)
             return jsonify({"success": False, "message": error_msg}), 400
         
+        if model_name == 'auto':
+            # 自動模式在每個任務開始時才決定模型，不需預先載入
+            return jsonify({
+                "success": True,
+                "message": "將依音頻長度與目前工作量自動選擇模型",
+                "current_model": model_name
+            })
+        
         global loaded_model
         with model_lock:
             current_model = loaded_model['name'] if loaded_model else 'None'
@@ -591,7 +1222,20 @@ def update_model():
                     "expected_model": model_name,
                     "matches": current_model == model_name
                 })
-            
+
+            if app.config['WORKER_MODE'] == 'process':
+                # 模型由工作程序持有，主行程只記錄選擇並通知預載
+                device = "cuda" if torch.cuda.is_available() else "cpu"
+                get_worker_pool().preload(model_name, device)
+                loaded_model = {'model': None, 'name': model_name}
+                logging.info(f"已通知工作程序預載 {model_name} 模型")
+                return jsonify({
+                    "success": True,
+                    "message": f"模型 {model_name} 已成功更新",
+                    "previous_model": current_model,
+                    "current_model": model_name
+                })
+
             if loaded_model is None or loaded_model['name'] != model_name or force_update:
                 # 清理 GPU 記憶體
                 if torch.cuda.is_available():
@@ -612,8 +1256,8 @@ def update_model():
                     logging.info(f"使用設備: {device}")
                     
                     # 使用新的加載函數
-                    model = load_whisper_model(model_name, device=device)
-                    loaded_model = {'model': model, 'name': model_name}
+                    model = load_transcription_model(model_name, device=device)
+                    loaded_model = {'model': model, 'name': model_name, 'device': device}
                     logging.info(f"模型 {model_name} 載入成功")
                     
                     # 驗證模型是否正確載入
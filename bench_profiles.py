@@ -0,0 +1,138 @@
+"""
+執行設定檔效能測試（CPU）
+
+對每個執行設定檔各載入一個新的模型實例，記錄一次性的準備成本（編譯與暖機），
+再重複執行編碼器統計每個 30 秒窗口的延遲；指定 --audio 時另外完整轉錄一次，
+比較解碼時間、即時率，以及與 fp32 結果的文字相似度。加速倍數皆相對於 fp32。
+
+用法:
+    python bench_profiles.py --model base --rounds 10 --audio 範例.wav
+"""
+import sys
+import json
+import time
+import difflib
+import argparse
+import statistics
+
+import torch
+import whisper
+from whisper.audio import N_SAMPLES, SAMPLE_RATE
+
+import decode_engine
+from model_loader import load_whisper_model
+from execution_profiles import PROFILES, prepare_model, execution_context, uses_fp16
+
+DEVICE = 'cpu'
+CPU_PROFILES = ['fp32', 'inference', 'bf16', 'compiled']
+
+
+def encoder_latencies(model, profile, mel, rounds):
+    """每次編碼一個窗口的延遲（毫秒）"""
+    latencies = []
+    with execution_context(profile, DEVICE, model):
+        for _ in range(rounds):
+            started = time.perf_counter()
+            model.encoder(mel)
+            latencies.append((time.perf_counter() - started) * 1000)
+    return latencies
+
+
+def bench_profile(model_name, profile, window, rounds, audio=None, language=None):
+    model = load_whisper_model(model_name, device=DEVICE)
+    started = time.perf_counter()
+    actual = prepare_model(model, model_name, DEVICE, profile)
+    prepare_seconds = time.perf_counter() - started
+
+    # 梅爾頻帶數依模型而定（large-v3 為 128）
+    mel = whisper.log_mel_spectrogram(window, n_mels=model.dims.n_mels).unsqueeze(0)
+
+    latencies = encoder_latencies(model, actual, mel, rounds)
+    item = {
+        'profile': actual,
+        'prepare_seconds': round(prepare_seconds, 2),
+        'encoder_p50_ms': round(statistics.median(latencies), 1),
+        'encoder_min_ms': round(min(latencies), 1),
+    }
+    if audio is not None:
+        started = time.perf_counter()
+        with execution_context(actual, DEVICE, model):
+            result = decode_engine.transcribe(model, audio, language=language, fp16=uses_fp16(actual, DEVICE))
+        decode_seconds = time.perf_counter() - started
+        item.update(decode_seconds=round(decode_seconds, 2),
+                    rtf=round(decode_seconds / (len(audio) / SAMPLE_RATE), 4),
+                    text=result['text'])
+    del model
+    return item
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='執行設定檔的 CPU 效能測試')
+    parser.add_argument('--model', default='base', help='測試的模型')
+    parser.add_argument('--profiles', default=','.join(CPU_PROFILES),
+                        help=f'以逗號分隔的設定檔（可用: {" ".join(PROFILES)}），fp32 一定會測試作為基準')
+    parser.add_argument('--rounds', type=int, default=10, help='每個設定檔執行編碼器的次數')
+    parser.add_argument('--audio', help='完整轉錄的音頻檔（未指定時只測編碼器）')
+    parser.add_argument('--language', default='zh', help='轉錄語言')
+    parser.add_argument('--threads', type=int, help='torch 使用的執行緒數')
+    parser.add_argument('--json', action='store_true', help='以 JSON 輸出結果')
+    args = parser.parse_args(argv)
+
+    profiles = [p.strip() for p in args.profiles.split(',') if p.strip()]
+    unknown = [p for p in profiles if p not in PROFILES]
+    if unknown:
+        parser.error(f"未知的執行設定檔: {', '.join(unknown)}")
+    profiles = ['fp32'] + [p for p in profiles if p != 'fp32']
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    audio = whisper.load_audio(args.audio) if args.audio else None
+    # 編碼器的運算量與內容無關，沒有音頻時以靜音窗口測試
+    window = whisper.pad_or_trim(audio[:N_SAMPLES] if audio is not None else torch.zeros(N_SAMPLES))
+
+    results = {}
+    for profile in profiles:
+        print(f"測試 {profile}...", file=sys.stderr)
+        results[profile] = bench_profile(args.model, profile, window, args.rounds, audio, args.language)
+
+    baseline = results['fp32']
+    for profile, item in results.items():
+        item['encoder_speedup'] = round(baseline['encoder_p50_ms'] / item['encoder_p50_ms'], 2)
+        saved_ms = baseline['encoder_p50_ms'] - item['encoder_p50_ms']
+        # 準備成本需要多少個窗口才能攤平
+        item['break_even_windows'] = (int(item['prepare_seconds'] * 1000 / saved_ms) + 1
+                                      if saved_ms > 0 and item['prepare_seconds'] else None)
+        if audio is not None:
+            item['decode_speedup'] = round(baseline['decode_seconds'] / item['decode_seconds'], 2)
+            item['text_similarity'] = round(
+                difflib.SequenceMatcher(None, baseline['text'], item['text']).ratio(), 3)
+            del item['text']
+
+    report = {
+        'model': args.model,
+        'device': DEVICE,
+        'threads': torch.get_num_threads(),
+        'audio_seconds': round(len(audio) / SAMPLE_RATE, 1) if audio is not None else None,
+        'profiles': results,
+    }
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        return 0
+
+    print(f"模型 {report['model']}@{DEVICE}，{report['threads']} 個執行緒"
+          + (f"，音頻 {report['audio_seconds']} 秒" if audio is not None else ""))
+    for requested, item in results.items():
+        label = requested if item['profile'] == requested else f"{requested}→{item['profile']}"
+        line = (f"  {label:20s} 準備 {item['prepare_seconds']:6.2f} 秒  "
+                f"編碼器 p50 {item['encoder_p50_ms']:8.1f} ms  加速 {item['encoder_speedup']:5.2f}x")
+        if item['break_even_windows']:
+            line += f"  {item['break_even_windows']} 個窗口攤平"
+        if audio is not None:
+            line += (f"  轉錄 {item['decode_seconds']:7.2f} 秒  RTF {item['rtf']:.3f}  "
+                     f"加速 {item['decode_speedup']:5.2f}x  相似度 {item['text_similarity']:.3f}")
+        print(line)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,132 @@
+"""
+全文檢索效能測試
+
+在暫存資料夾產生大量合成轉錄（預設 10000 份，每份 200 段），建立索引後
+以常見詞、罕見詞、多關鍵字與不存在的詞各查詢多次，統計延遲分布。
+
+用法:
+    python bench_search.py --transcripts 10000 --segments 200 --queries 200
+"""
+import os
+import sys
+import json
+import math
+import time
+import random
+import shutil
+import argparse
+import tempfile
+
+from transcript_index import TranscriptIndex
+
+# 合成用的詞彙：少數常見詞與大量罕見詞，接近實際訪談的詞頻分布
+COMMON_WORDS = ['我們', '因為', '所以', '然後', '這個', '就是', '其實', '時候', '覺得', '沒有',
+                '可以', '一個', '什麼', '他們', '現在', '知道', '問題', '工作', '那個', '應該']
+RARE_WORDS = ['研究計畫', '田野調查', '社區營造', '長期照顧', '數位轉型', '供應鏈', '碳排放',
+              '再生能源', '轉型正義', '原住民族', '農村再生', '海洋保育', '文化資產', '公共衛生',
+              'Whisper', 'GPU', 'podcast', 'interview', 'dataset', 'pipeline']
+
+
+def percentile(sorted_values, pct):
+    """最近秩法百分位數"""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(pct / 100.0 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def synthetic_segments(rng, count):
+    segments = []
+    start = 0.0
+    for _ in range(count):
+        words = rng.choices(COMMON_WORDS, k=rng.randint(4, 10))
+        if rng.random() < 0.1:
+            words.insert(rng.randrange(len(words)), rng.choice(RARE_WORDS))
+        duration = rng.uniform(1.5, 6.0)
+        segments.append({'start': round(start, 3), 'end': round(start + duration, 3), 'text': ''.join(words)})
+        start += duration
+    return segments
+
+
+def build_index(folder, transcripts, segments_per_file, seed):
+    rng = random.Random(seed)
+    index = TranscriptIndex(folder)
+    started = time.perf_counter()
+    for i in range(transcripts):
+        index.add_transcript(f"transcript_{i:05d}", synthetic_segments(rng, segments_per_file), 'synthetic')
+        if (i + 1) % 1000 == 0:
+            print(f"  已建立 {i + 1}/{transcripts} 份（{time.perf_counter() - started:.1f} 秒）", file=sys.stderr)
+    # 合成資料沒有對應的 SRT 檔，略過啟動時的資料夾同步
+    index._synced = True
+    return index, time.perf_counter() - started
+
+
+def run_queries(index, queries, rounds, limit):
+    report = {}
+    for label, query in queries:
+        latencies = []
+        total = 0
+        for _ in range(rounds):
+            started = time.perf_counter()
+            total = index.search(query, limit=limit)['total']
+            latencies.append((time.perf_counter() - started) * 1000)
+        latencies.sort()
+        report[label] = {
+            'query': query,
+            'matches': total,
+            'p50_ms': round(percentile(latencies, 50), 2),
+            'p95_ms': round(percentile(latencies, 95), 2),
+            'p99_ms': round(percentile(latencies, 99), 2),
+            'max_ms': round(latencies[-1], 2),
+        }
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='轉錄全文檢索效能測試')
+    parser.add_argument('--transcripts', type=int, default=10000, help='合成轉錄份數')
+    parser.add_argument('--segments', type=int, default=200, help='每份轉錄的段落數')
+    parser.add_argument('--queries', type=int, default=200, help='每種查詢的重複次數')
+    parser.add_argument('--limit', type=int, default=50, help='每次查詢回傳的段落數')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--keep', help='保留索引到指定資料夾（預設使用暫存資料夾並在結束後刪除）')
+    parser.add_argument('--json', action='store_true', help='以 JSON 輸出結果')
+    args = parser.parse_args(argv)
+
+    folder = args.keep or tempfile.mkdtemp(prefix='search_bench_')
+    os.makedirs(folder, exist_ok=True)
+    try:
+        index, build_seconds = build_index(folder, args.transcripts, args.segments, args.seed)
+        queries = [
+            ('common', '我們'),
+            ('rare', '社區營造'),
+            ('latin', 'whisper'),
+            ('multi', '工作 長期照顧'),
+            ('missing', '量子糾纏'),
+        ]
+        report = {
+            'transcripts': args.transcripts,
+            'segments': args.transcripts * args.segments,
+            'build_seconds': round(build_seconds, 1),
+            'index': index.stats(),
+            'queries': run_queries(index, queries, args.queries, args.limit),
+        }
+    finally:
+        if not args.keep:
+            shutil.rmtree(folder, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        return 0
+
+    print(f"轉錄 {report['transcripts']} 份，共 {report['segments']} 段；"
+          f"建立索引 {report['build_seconds']} 秒，索引大小 {report['index']['size_bytes'] / 1024 / 1024:.1f} MB")
+    for label, item in report['queries'].items():
+        print(f"  {label:8s} {item['query']!r:16s} 命中 {item['matches']:7d}  "
+              f"p50 {item['p50_ms']:7.2f} ms  p95 {item['p95_ms']:7.2f} ms  "
+              f"p99 {item['p99_ms']:7.2f} ms  max {item['max_ms']:7.2f} ms")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,98 @@
+"""
+轉錄檢查點
+
+每解碼完一個窗口，就把新增的段落、解碼器的 seek 位置與提示上下文追加到
+JSON Lines 檔案。程式中途結束後，同一個音頻以相同模型與語言重新轉錄時，
+會從最後一個檢查點繼續，只解碼剩下的音頻。
+"""
+import os
+import json
+import glob
+import logging
+import threading
+
+# 可用環境變數 WHISPER_CHECKPOINT_FOLDER 指定（例如壓力測試時與正式資料分開）
+CHECKPOINT_FOLDER = os.environ.get('WHISPER_CHECKPOINT_FOLDER') or \
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'checkpoints')
+
+
+class TranscriptCheckpoint:
+    """單一音頻/模型/語言組合的檢查點檔案"""
+
+    def __init__(self, audio_hash, model_name, language, folder=CHECKPOINT_FOLDER):
+        self.audio_hash = audio_hash
+        self.model_name = model_name
+        self.language = language or 'auto'
+        self.folder = folder
+        self.path = os.path.join(folder, f"{audio_hash[:32]}_{model_name}_{self.language}.jsonl")
+        self._lock = threading.Lock()
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def load(self):
+        """
+        讀取檢查點並組合成 decode_engine 可恢復的狀態，沒有檢查點時回傳 None
+
+        最後一行若因程式中斷而不完整會被忽略。
+        """
+        if not self.exists():
+            return None
+
+        segments = []
+        state = None
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    logging.warning(f"忽略不完整的檢查點紀錄: {self.path}")
+                    break
+                segments.extend(record['segments'])
+                state = record
+
+        if state is None:
+            return None
+        logging.info(f"從檢查點恢復: {self.path}，已解碼至 {state['offset']:.1f} 秒，共 {len(segments)} 段")
+        return {
+            'seek': state['seek'],
+            'offset': state['offset'],
+            'segments': segments,
+            'prompt_tokens': state['prompt_tokens'],
+            'language': state['language'],
+        }
+
+    def save_window(self, state, new_segments):
+        """追加一個窗口的結果並同步到磁碟"""
+        record = {
+            'seek': state['seek'],
+            'offset': state['offset'],
+            'prompt_tokens': state['prompt_tokens'],
+            'language': state['language'],
+            'segments': new_segments,
+        }
+        line = json.dumps(record, ensure_ascii=False) + '\n'
+        with self._lock:
+            os.makedirs(self.folder, exist_ok=True)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def remove(self):
+        """轉錄完成或取消後刪除檢查點"""
+        with self._lock:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+
+def find_checkpoint_models(audio_hash, folder=CHECKPOINT_FOLDER):
+    """列出此音頻已有檢查點的 (模型, 語言)"""
+    found = []
+    for path in glob.glob(os.path.join(folder, f"{audio_hash[:32]}_*.jsonl")):
+        name = os.path.basename(path)[len(audio_hash[:32]) + 1:-len('.jsonl')]
+        model_name, _, language = name.rpartition('_')
+        found.append((model_name, language))
+    return found
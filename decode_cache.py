@@ -0,0 +1,129 @@
+"""
+窗口內的解碼快取
+
+溫度回退會以同樣的音頻與提示重新解碼同一個 30 秒窗口。whisper 的
+model.decode() 每次都會重新執行編碼器、重新計算交叉注意力的 key/value，
+並重新前向整段提示前綴；beam search 或 best_of 的每個候選也各算一次前綴。
+
+WindowCache 讓同一窗口的所有解碼嘗試共用：
+- 編碼器輸出（只計算一次）
+- 交叉注意力與提示前綴的 kv-cache 及前綴的 logits（第一次嘗試時記下，
+  之後的嘗試直接載入；同一批次的多個候選也只計算一列再展開）
+"""
+import time
+
+import torch
+from whisper.decoding import DecodingTask, PyTorchInference
+
+
+def new_stats():
+    """解碼統計：窗口數、解碼次數、回退次數、快取命中次數與估計省下的秒數"""
+    return {
+        'windows': 0,
+        'decodes': 0,
+        'fallbacks': 0,
+        'encoder_reused': 0,
+        'prefix_reused': 0,
+        'saved_seconds': 0.0,
+    }
+
+
+class WindowCache:
+    """單一窗口的編碼器輸出與前綴快取"""
+
+    def __init__(self, model, mel_segment, stats):
+        self.model = model
+        self.mel = mel_segment
+        self.stats = stats
+        self.stats['windows'] += 1
+        self._audio_features = None
+        self._encoder_seconds = 0.0
+        self._prefix = None
+
+    def audio_features(self):
+        """回傳 [1, n_audio_ctx, n_audio_state] 的編碼器輸出，第一次呼叫時才計算"""
+        if self._audio_features is None:
+            started = time.perf_counter()
+            with torch.no_grad():
+                # bf16 autocast 下編碼器輸出為 bfloat16，DecodingTask 只接受與梅爾頻譜相同的 float16/float32
+                self._audio_features = self.model.embed_audio(self.mel.unsqueeze(0)).to(self.mel.dtype)
+            self._encoder_seconds = time.perf_counter() - started
+        else:
+            self.stats['encoder_reused'] += 1
+            self.stats['saved_seconds'] += self._encoder_seconds
+        return self._audio_features
+
+    def lookup_prefix(self, tokens):
+        prefix = self._prefix
+        if prefix is None or prefix['tokens'] != tuple(tokens.tolist()):
+            return None
+        self.stats['prefix_reused'] += 1
+        self.stats['saved_seconds'] += prefix['seconds']
+        return prefix
+
+    def store_prefix(self, prefix):
+        self._prefix = prefix
+
+    @torch.no_grad()
+    def decode(self, options):
+        """與 model.decode(mel, options) 相同，但共用此窗口的快取"""
+        self.stats['decodes'] += 1
+        task = DecodingTask(self.model, options)
+        task.inference = _CachedInference(self.model, len(task.initial_tokens), self, task.sot_index)
+        # 傳入編碼器輸出時，DecodingTask 會略過編碼器
+        return task.run(self.audio_features())[0]
+
+
+class _CachedInference(PyTorchInference):
+    """第一次前向（整段提示前綴）改由 WindowCache 提供或記錄"""
+
+    def __init__(self, model, initial_token_length, window_cache, sot_index):
+        super().__init__(model, initial_token_length)
+        self.window_cache = window_cache
+        self.sot_index = sot_index
+        self.self_attn_modules = [m for block in model.decoder.blocks for m in (block.attn.key, block.attn.value)]
+
+    def logits(self, tokens, audio_features):
+        if self.kv_cache:
+            return super().logits(tokens, audio_features)
+        return self._prefix_logits(tokens, audio_features)
+
+    def _prefix_logits(self, tokens, audio_features):
+        n_batch = tokens.shape[0]
+        self.kv_cache, self.hooks = self.model.install_kv_cache_hooks()
+
+        logits = None
+        prefix = self.window_cache.lookup_prefix(tokens[0])
+        if prefix is None:
+            # 批次中每一列的前綴與音頻都相同，只計算第一列
+            started = time.perf_counter()
+            logits = self.model.decoder(tokens[:1], audio_features[:1], kv_cache=self.kv_cache)
+            prefix = {
+                'tokens': tuple(tokens[0].tolist()),
+                'kv': dict(self.kv_cache),
+                'sot_row': logits[0, self.sot_index],
+                'last_row': logits[0, -1],
+                'seconds': time.perf_counter() - started,
+            }
+            self.window_cache.store_prefix(prefix)
+        else:
+            self.kv_cache.update(prefix['kv'])
+
+        # 展開成批次大小；之後的自注意力快取會接上新的 token 而成為獨立的張量
+        for module, value in list(self.kv_cache.items()):
+            self.kv_cache[module] = value.expand(n_batch, -1, -1)
+
+        if logits is not None and n_batch == 1:
+            return logits
+        # DecodingTask 只會讀取 SOT 位置（無語音機率）與最後一個位置的 logits
+        row = prefix['last_row']
+        output = row.new_empty((n_batch, tokens.shape[1], row.shape[-1]))
+        output[:, self.sot_index] = prefix['sot_row']
+        output[:, -1] = row
+        return output
+
+    def rearrange_kv_cache(self, source_indices):
+        # 交叉注意力的快取在各候選間相同，只需重排自注意力
+        if source_indices != list(range(len(source_indices))):
+            for module in self.self_attn_modules:
+                self.kv_cache[module] = self.kv_cache[module][source_indices].detach()
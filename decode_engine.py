@@ -0,0 +1,320 @@
+"""
+逐窗解碼引擎
+
+與 whisper.transcribe() 相同的 30 秒滑動窗口解碼流程，但在每個窗口完成後
+回報解碼器的 seek 位置，讓呼叫端可以得知實際的解碼進度。
+"""
+import logging
+
+import torch
+import whisper
+from whisper.audio import (
+    FRAMES_PER_SECOND, HOP_LENGTH, N_FRAMES, N_SAMPLES, SAMPLE_RATE,
+    log_mel_spectrogram, pad_or_trim
+)
+from whisper.decoding import DecodingOptions
+from whisper.timing import add_word_timestamps
+from whisper.tokenizer import get_tokenizer
+from whisper.utils import exact_div
+
+import speculative
+from decode_cache import WindowCache, new_stats
+from segment_store import SegmentStore
+
+# 與 whisper 預設一致的溫度回退序列
+DEFAULT_TEMPERATURES = (0.0, 0.2, 0.4, 0.6, 0.8, 1.0)
+
+
+class DecodeInterrupted(Exception):
+    """解碼在窗口邊界被要求停止，state 可交給 transcribe(resume_state=...) 繼續"""
+
+    def __init__(self, reason, state):
+        super().__init__(reason)
+        self.reason = reason
+        self.state = state
+
+
+def transcribe(model, audio, *, language="zh", task="transcribe",
+               temperature=DEFAULT_TEMPERATURES,
+               compression_ratio_threshold=2.4, logprob_threshold=-1.0,
+               no_speech_threshold=0.6, condition_on_previous_text=True,
+               initial_prompt=None, word_timestamps=False,
+               draft_model=None, draft_tokens=speculative.DEFAULT_DRAFT_TOKENS,
+               prepend_punctuations="\"'“¿([{-", append_punctuations="\"'.。,，!！?？:：”)]}、",
+               on_progress=None, on_window=None, should_stop=None,
+               resume_state=None, **decode_options):
+    """
+    轉錄音頻並在每個窗口解碼後呼叫 on_progress(decoded_seconds, total_seconds)
+
+    audio 可以是檔案路徑或 16kHz 單聲道 float32 PCM 陣列，
+    回傳格式與 whisper 的 model.transcribe() 相同。
+
+    on_window(state, new_segments) 在每個窗口完成後收到可恢復的狀態與新增的段落，
+    可用於逐窗口保存檢查點。should_stop() 在每個窗口開始前被呼叫，回傳非空的原因時拋出 DecodeInterrupted；
+    resume_state 為先前中斷時的狀態，會從當時的 seek 位置與提示上下文繼續解碼。
+
+    word_timestamps 為 True 時，以解碼器的交叉注意力對齊每個窗口的文字，
+    在段落中加入 words（每個詞的 start/end/probability）；只需對已解碼的 token
+    多做一次解碼器前向運算，不會重新解碼音頻。
+
+    draft_model 為常駐的小模型時，溫度 0 的窗口改用推測解碼：小模型每輪猜
+    draft_tokens 個 token，由 model 一次驗證，輸出與 model 單獨解碼相同。
+    """
+    if isinstance(audio, str):
+        audio = whisper.load_audio(audio)
+
+    dtype = torch.float16 if decode_options.get("fp16", False) else torch.float32
+    if model.device == torch.device("cpu") and dtype == torch.float16:
+        dtype = torch.float32
+    decode_options["fp16"] = dtype == torch.float16
+
+    # 在音頻尾端補 30 秒靜音以便切窗
+    mel = log_mel_spectrogram(audio, model.dims.n_mels, padding=N_SAMPLES)
+    content_frames = mel.shape[-1] - N_FRAMES
+    total_seconds = float(content_frames * HOP_LENGTH / SAMPLE_RATE)
+
+    if resume_state is not None:
+        language = resume_state.get('language', language)
+
+    if language is None:
+        mel_segment = pad_or_trim(mel, N_FRAMES).to(model.device).to(dtype)
+        _, probs = model.detect_language(mel_segment)
+        language = max(probs, key=probs.get)
+
+    tokenizer = get_tokenizer(
+        model.is_multilingual, num_languages=model.num_languages, language=language, task=task
+    )
+
+    temperatures = [temperature] if isinstance(temperature, (int, float)) else list(temperature)
+
+    if draft_model is not None and not speculative.is_compatible(model, draft_model):
+        logging.warning("草稿模型與目前模型的詞彙表、梅爾頻帶或設備不同，不使用推測解碼")
+        draft_model = None
+    stats = new_stats()
+
+    def decode_with_fallback(segment):
+        # 同一窗口的各次溫度回退共用編碼器輸出與提示前綴的 kv-cache
+        window_cache = WindowCache(model, segment, stats)
+        result = None
+        for attempt, t in enumerate(temperatures):
+            if attempt > 0:
+                stats['fallbacks'] += 1
+            kwargs = {**decode_options}
+            if t > 0:
+                kwargs.pop("beam_size", None)
+                kwargs.pop("patience", None)
+            else:
+                kwargs.pop("best_of", None)
+            options = DecodingOptions(**kwargs, language=language, task=task, temperature=t)
+            if draft_model is not None and speculative.supports_options(options):
+                stats['decodes'] += 1
+                result = speculative.decode(model, draft_model, segment, options, draft_tokens, stats=stats,
+                                            audio_features=window_cache.audio_features())
+            else:
+                result = window_cache.decode(options)
+
+            needs_fallback = False
+            if compression_ratio_threshold is not None and result.compression_ratio > compression_ratio_threshold:
+                needs_fallback = True  # 重複太多
+            if logprob_threshold is not None and result.avg_logprob < logprob_threshold:
+                needs_fallback = True  # 信心不足
+            if no_speech_threshold is not None and result.no_speech_prob > no_speech_threshold:
+                needs_fallback = False  # 靜音
+            if not needs_fallback:
+                break
+        return result
+
+    input_stride = exact_div(N_FRAMES, model.dims.n_audio_ctx)  # 每個輸出 token 對應的 mel 幀數
+    time_precision = input_stride * HOP_LENGTH / SAMPLE_RATE  # 每個輸出 token 的秒數
+
+    seek = 0
+    all_tokens = []
+    all_segments = SegmentStore()
+    prompt_reset_since = 0
+    last_speech_timestamp = 0.0
+
+    if resume_state is not None:
+        # 從中斷處繼續：沿用已完成的段落與當時的提示上下文
+        seek = resume_state['seek']
+        all_segments = SegmentStore.from_segments(resume_state['segments'])
+        all_tokens = list(resume_state['prompt_tokens'])
+        last_speech_timestamp = _last_word_end(all_segments) or 0.0
+    elif initial_prompt is not None:
+        all_tokens.extend(tokenizer.encode(" " + initial_prompt.strip()))
+
+    def current_state():
+        # 解碼器只會使用最後 n_text_ctx // 2 個 token 作為提示，更早的上下文不必保存
+        prompt_start = max(prompt_reset_since, len(all_tokens) - model.dims.n_text_ctx // 2)
+        return {
+            'seek': seek,
+            'offset': seek / FRAMES_PER_SECOND,
+            'segments': all_segments,
+            'prompt_tokens': all_tokens[prompt_start:],
+            'language': language,
+        }
+
+    def new_segment(*, start, end, tokens, result):
+        tokens = tokens.tolist()
+        text_tokens = [token for token in tokens if token < tokenizer.eot]
+        return {
+            "seek": seek,
+            "start": start,
+            "end": end,
+            "text": tokenizer.decode(text_tokens),
+            "tokens": tokens,
+            "temperature": result.temperature,
+            "avg_logprob": result.avg_logprob,
+            "compression_ratio": result.compression_ratio,
+            "no_speech_prob": result.no_speech_prob,
+        }
+
+    _report(on_progress, seek, content_frames, total_seconds)
+    while seek < content_frames:
+        if should_stop is not None:
+            reason = should_stop()
+            if reason:
+                raise DecodeInterrupted(reason, current_state())
+
+        previous_seek = seek
+        time_offset = float(seek * HOP_LENGTH / SAMPLE_RATE)
+        segment_size = min(N_FRAMES, content_frames - seek)
+        mel_segment = mel[:, seek:seek + segment_size]
+        segment_duration = segment_size * HOP_LENGTH / SAMPLE_RATE
+        mel_segment = pad_or_trim(mel_segment, N_FRAMES).to(model.device).to(dtype)
+
+        decode_options["prompt"] = all_tokens[prompt_reset_since:]
+        result = decode_with_fallback(mel_segment)
+        tokens = torch.tensor(result.tokens)
+
+        if no_speech_threshold is not None:
+            # 無語音且信心不足時跳過整個窗口
+            should_skip = result.no_speech_prob > no_speech_threshold
+            if logprob_threshold is not None and result.avg_logprob > logprob_threshold:
+                should_skip = False
+            if should_skip:
+                seek += segment_size
+                if on_window is not None:
+                    on_window(current_state(), [])
+                _report(on_progress, seek, content_frames, total_seconds)
+                continue
+
+        current_segments = []
+        timestamp_tokens = tokens.ge(tokenizer.timestamp_begin)
+        single_timestamp_ending = timestamp_tokens[-2:].tolist() == [False, True]
+
+        consecutive = torch.where(timestamp_tokens[:-1] & timestamp_tokens[1:])[0]
+        consecutive.add_(1)
+        if len(consecutive) > 0:
+            # 依成對的時間戳 token 切分段落
+            slices = consecutive.tolist()
+            if single_timestamp_ending:
+                slices.append(len(tokens))
+
+            last_slice = 0
+            for current_slice in slices:
+                sliced_tokens = tokens[last_slice:current_slice]
+                start_timestamp_pos = sliced_tokens[0].item() - tokenizer.timestamp_begin
+                end_timestamp_pos = sliced_tokens[-1].item() - tokenizer.timestamp_begin
+                current_segments.append(new_segment(
+                    start=time_offset + start_timestamp_pos * time_precision,
+                    end=time_offset + end_timestamp_pos * time_precision,
+                    tokens=sliced_tokens,
+                    result=result,
+                ))
+                last_slice = current_slice
+
+            if single_timestamp_ending:
+                seek += segment_size
+            else:
+                # 從最後一個完整段落的結束時間繼續
+                last_timestamp_pos = tokens[last_slice - 1].item() - tokenizer.timestamp_begin
+                seek += last_timestamp_pos * input_stride
+        else:
+            duration = segment_duration
+            timestamps = tokens[timestamp_tokens.nonzero().flatten()]
+            if len(timestamps) > 0 and timestamps[-1].item() != tokenizer.timestamp_begin:
+                last_timestamp_pos = timestamps[-1].item() - tokenizer.timestamp_begin
+                duration = last_timestamp_pos * time_precision
+
+            current_segments.append(new_segment(
+                start=time_offset,
+                end=time_offset + duration,
+                tokens=tokens,
+                result=result,
+            ))
+            seek += segment_size
+
+        if word_timestamps:
+            add_word_timestamps(
+                segments=current_segments,
+                model=model,
+                tokenizer=tokenizer,
+                mel=mel_segment,
+                num_frames=segment_size,
+                prepend_punctuations=prepend_punctuations,
+                append_punctuations=append_punctuations,
+                last_speech_timestamp=last_speech_timestamp,
+            )
+            last_word_end = _last_word_end(current_segments)
+            if last_word_end is not None:
+                last_speech_timestamp = last_word_end
+                if not single_timestamp_ending:
+                    # 以最後一個詞的結束時間作為下一個窗口的起點，比時間戳 token 更精確
+                    seek_shift = round((last_word_end - time_offset) * FRAMES_PER_SECOND)
+                    if seek_shift > 0:
+                        seek = previous_seek + seek_shift
+
+        # 清除瞬間或沒有文字的段落
+        for segment in current_segments:
+            if segment["start"] == segment["end"] or segment["text"].strip() == "":
+                segment["text"] = ""
+                segment["tokens"] = []
+                if word_timestamps:
+                    segment["words"] = []
+
+        new_segments = [
+            {"id": i, **segment} for i, segment in enumerate(current_segments, start=len(all_segments))
+        ]
+        all_segments.extend(new_segments)
+        all_tokens.extend(token for segment in current_segments for token in segment["tokens"])
+
+        if not condition_on_previous_text or result.temperature > 0.5:
+            # 高溫度輸出容易失控，不再作為後續窗口的提示
+            prompt_reset_since = len(all_tokens)
+
+        # 解碼器最多只用最後 n_text_ctx // 2 個 token 作為提示，更早的 token 不必一直保留
+        excess = len(all_tokens) - model.dims.n_text_ctx
+        if excess > 0:
+            del all_tokens[:excess]
+            prompt_reset_since = max(0, prompt_reset_since - excess)
+
+        if on_window is not None:
+            on_window(current_state(), new_segments)
+        _report(on_progress, seek, content_frames, total_seconds)
+
+    if stats['fallbacks']:
+        logging.info(f"溫度回退 {stats['fallbacks']} 次（{stats['windows']} 個窗口），重用編碼器輸出 "
+                     f"{stats['encoder_reused']} 次、提示前綴 {stats['prefix_reused']} 次，"
+                     f"估計省下 {stats['saved_seconds']:.1f} 秒")
+    if stats.get('drafted'):
+        logging.info(f"推測解碼接受率 {stats['accepted'] / stats['drafted']:.1%}，"
+                     f"大模型前向 {stats['target_forwards']} 次")
+
+    return {
+        "text": all_segments.text(),
+        "segments": all_segments,
+        "language": language,
+        "duration": total_seconds,
+        "decode_stats": dict(stats, saved_seconds=round(stats['saved_seconds'], 3)),
+    }
+
+
+def _last_word_end(segments):
+    ends = [word["end"] for segment in segments for word in segment.get("words", [])]
+    return ends[-1] if ends else None
+
+
+def _report(on_progress, seek, content_frames, total_seconds):
+    if on_progress is not None:
+        decoded_seconds = min(seek, content_frames) / FRAMES_PER_SECOND
+        on_progress(decoded_seconds, total_seconds)
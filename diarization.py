@@ -0,0 +1,233 @@
+"""
+說話者分離（diarization）
+
+只用 CPU 與 numpy，在 whisper 解碼的同時以另一個執行緒處理同一份 PCM：
+
+1. 以 25 ms 窗、10 ms 位移計算對數梅爾頻譜與 MFCC，並以能量式 VAD 標記語音幀
+2. 在語音區域上每 0.75 秒取一個 1.5 秒的窗口，以 MFCC 的平均與標準差作為
+   該窗口的聲音特徵向量（整份錄音標準化後取單位長度）
+3. 以球面 k-means 分群；未指定人數時在 1 到 max_speakers 人之間依輪廓係數
+   （silhouette）選擇最適合的人數
+4. 平滑標籤後合併成說話輪次，再依時間重疊把說話者標到轉錄段落上
+
+手工特徵無法與神經網路的說話者嵌入相比，但對兩三人、各自使用麥克風的訪談
+已足以區分，而且不需要額外的模型或網路連線。
+"""
+import logging
+import time
+
+import numpy as np
+from whisper.audio import SAMPLE_RATE, N_FFT, HOP_LENGTH, mel_filters
+
+from language_id import energy_vad
+
+N_MELS = 80
+N_MFCC = 20
+WINDOW_SECONDS = 1.5
+HOP_SECONDS = 0.75
+# 每次計算頻譜的音頻長度，控制暫存記憶體
+BLOCK_SECONDS = 60
+# 計算輪廓係數時最多抽樣的窗口數
+SILHOUETTE_SAMPLES = 1500
+# 最佳輪廓係數低於此值時視為只有一位說話者
+MIN_SILHOUETTE = 0.1
+
+FRAMES_PER_SECOND = SAMPLE_RATE // HOP_LENGTH
+
+
+def speaker_label(index):
+    return f"說話者 {index + 1}"
+
+
+def _dct_matrix(n_in, n_out):
+    """正交化的 DCT-II 矩陣，形狀 [n_out, n_in]"""
+    n = np.arange(n_in)
+    k = np.arange(n_out)[:, None]
+    matrix = np.cos(np.pi / n_in * (n + 0.5) * k) * np.sqrt(2.0 / n_in)
+    matrix[0] /= np.sqrt(2.0)
+    return matrix.astype(np.float32)
+
+
+def frame_features(audio):
+    """
+    回傳 (mfcc [幀數, N_MFCC-1], energy_db [幀數])，每 10 ms 一幀
+
+    分塊計算 STFT，長錄音也只需保留 MFCC 與能量。
+    """
+    filters = mel_filters("cpu", N_MELS).numpy()
+    dct = _dct_matrix(N_MELS, N_MFCC)
+    window = np.hanning(N_FFT + 1)[:-1].astype(np.float32)
+
+    n_frames = max(0, (len(audio) - N_FFT) // HOP_LENGTH + 1)
+    block = BLOCK_SECONDS * FRAMES_PER_SECOND
+    mfcc = np.empty((n_frames, N_MFCC - 1), dtype=np.float32)
+    energy_db = np.empty(n_frames, dtype=np.float32)
+    for first in range(0, n_frames, block):
+        last = min(n_frames, first + block)
+        samples = audio[first * HOP_LENGTH:(last - 1) * HOP_LENGTH + N_FFT]
+        frames = np.lib.stride_tricks.sliding_window_view(samples, N_FFT)[::HOP_LENGTH]
+        power = np.abs(np.fft.rfft(frames * window, axis=1)) ** 2
+        log_mel = np.log10(np.maximum(power @ filters.T, 1e-10))
+        mfcc[first:last] = (log_mel @ dct.T)[:, 1:]  # 略過代表音量的 c0
+        energy_db[first:last] = 10 * np.log10(np.mean(frames ** 2, axis=1) + 1e-10)
+    return mfcc, energy_db
+
+
+def window_embeddings(mfcc, voiced):
+    """在語音區域上取窗口並計算特徵向量，回傳 (起始幀 [n], 特徵 [n, dim])"""
+    size = int(WINDOW_SECONDS * FRAMES_PER_SECOND)
+    hop = int(HOP_SECONDS * FRAMES_PER_SECOND)
+    starts = []
+    vectors = []
+    for start in range(0, max(0, len(mfcc) - size + 1), hop):
+        mask = voiced[start:start + size]
+        if mask.mean() < 0.5:
+            continue
+        frames = mfcc[start:start + size][mask]
+        starts.append(start)
+        vectors.append(np.concatenate([frames.mean(axis=0), frames.std(axis=0)]))
+    if not vectors:
+        return np.zeros(0, dtype=np.int64), np.zeros((0, 2 * (N_MFCC - 1)), dtype=np.float32)
+
+    vectors = np.asarray(vectors, dtype=np.float32)
+    vectors = (vectors - vectors.mean(axis=0)) / (vectors.std(axis=0) + 1e-6)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True) + 1e-9
+    return np.asarray(starts), vectors
+
+
+def spherical_kmeans(vectors, k, rng, iterations=50):
+    """以餘弦相似度分群（kmeans++ 初始化），回傳 (標籤, 中心)"""
+    centers = [vectors[rng.integers(len(vectors))]]
+    for _ in range(1, k):
+        distance = 1.0 - np.max(vectors @ np.asarray(centers).T, axis=1)
+        distance = np.maximum(distance, 0.0)
+        total = distance.sum()
+        index = rng.choice(len(vectors), p=distance / total) if total > 0 else rng.integers(len(vectors))
+        centers.append(vectors[index])
+    centers = np.asarray(centers)
+
+    labels = None
+    for _ in range(iterations):
+        new_labels = np.argmax(vectors @ centers.T, axis=1)
+        if labels is not None and np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+        for c in range(k):
+            members = vectors[labels == c]
+            if len(members):
+                center = members.sum(axis=0)
+                centers[c] = center / (np.linalg.norm(center) + 1e-9)
+    return labels, centers
+
+
+def silhouette(vectors, labels):
+    """以餘弦距離計算的平均輪廓係數"""
+    clusters = np.unique(labels)
+    if len(clusters) < 2:
+        return -1.0
+    distance = 1.0 - vectors @ vectors.T
+    scores = np.zeros(len(vectors))
+    for i in range(len(vectors)):
+        own = labels == labels[i]
+        if own.sum() <= 1:
+            continue
+        a = distance[i, own].sum() / (own.sum() - 1)
+        b = min(distance[i, labels == c].mean() for c in clusters if c != labels[i])
+        scores[i] = (b - a) / max(a, b, 1e-9)
+    return float(scores.mean())
+
+
+def cluster(vectors, num_speakers=None, max_speakers=6, seed=0):
+    """分群並回傳標籤；未指定人數時依輪廓係數選擇"""
+    rng = np.random.default_rng(seed)
+    if len(vectors) < 2:
+        return np.zeros(len(vectors), dtype=np.int64)
+    if num_speakers:
+        return spherical_kmeans(vectors, min(num_speakers, len(vectors)), rng)[0]
+
+    sample = vectors
+    if len(vectors) > SILHOUETTE_SAMPLES:
+        sample = vectors[rng.choice(len(vectors), SILHOUETTE_SAMPLES, replace=False)]
+    best_k, best_score = 1, MIN_SILHOUETTE
+    for k in range(2, min(max_speakers, len(sample) - 1) + 1):
+        labels, centers = spherical_kmeans(sample, k, rng)
+        score = silhouette(sample, labels)
+        logging.debug(f"說話者分群 k={k} 輪廓係數 {score:.3f}")
+        if score > best_score:
+            best_k, best_score = k, score
+    if best_k == 1:
+        return np.zeros(len(vectors), dtype=np.int64)
+    return spherical_kmeans(vectors, best_k, rng)[0]
+
+
+def _smooth(labels, width=5):
+    """以多數決平滑標籤，去除零星的單一窗口切換"""
+    if len(labels) < width:
+        return labels
+    half = width // 2
+    padded = np.pad(labels, half, mode='edge')
+    windows = np.lib.stride_tricks.sliding_window_view(padded, width)
+    return np.array([np.bincount(w).argmax() for w in windows])
+
+
+def diarize(audio, num_speakers=None, max_speakers=6):
+    """
+    對 16 kHz 單聲道 float32 PCM 做說話者分離
+
+    回傳依時間排序的說話輪次 [{'start', 'end', 'speaker'}]，說話者依第一次出現的順序編號。
+    """
+    started = time.time()
+    mfcc, energy_db = frame_features(audio)
+    voiced = energy_vad(energy_db)
+    starts, vectors = window_embeddings(mfcc, voiced)
+    if len(vectors) == 0:
+        return []
+
+    labels = _smooth(cluster(vectors, num_speakers, max_speakers))
+    # 依第一次出現的順序重新編號
+    order = {}
+    for label in labels:
+        order.setdefault(int(label), len(order))
+
+    # 每個窗口代表其中央 HOP_SECONDS 的時間，相鄰且同一說話者的窗口合併成一個輪次
+    turns = []
+    margin = (WINDOW_SECONDS - HOP_SECONDS) / 2
+    for start, label in zip(starts, labels):
+        begin = start / FRAMES_PER_SECOND + margin
+        end = begin + HOP_SECONDS
+        speaker = speaker_label(order[int(label)])
+        # 中間最多隔一個非語音窗口時仍視為同一輪次
+        if turns and turns[-1]['speaker'] == speaker and begin - turns[-1]['end'] <= HOP_SECONDS + 0.01:
+            turns[-1]['end'] = round(end, 2)
+        else:
+            turns.append({'start': round(begin, 2), 'end': round(end, 2), 'speaker': speaker})
+
+    logging.info(f"說話者分離完成：{len(order)} 位說話者、{len(turns)} 個輪次，"
+                 f"耗時 {time.time() - started:.1f} 秒")
+    return turns
+
+
+def assign_speakers(segments, turns):
+    """
+    依時間重疊把說話者標到段落上，逐一產生加上 speaker 欄位的段落
+
+    與任何輪次都沒有重疊的段落使用時間最接近的輪次。
+    """
+    if not turns:
+        yield from segments
+        return
+    starts = np.array([turn['start'] for turn in turns])
+    for segment in segments:
+        # 只需檢查開始時間在段落結束之前、且可能重疊的輪次
+        last = int(np.searchsorted(starts, segment["end"]))
+        overlap = {}
+        for turn in turns[max(0, last - 64):last]:
+            seconds = min(segment["end"], turn['end']) - max(segment["start"], turn['start'])
+            if seconds > 0:
+                overlap[turn['speaker']] = overlap.get(turn['speaker'], 0.0) + seconds
+        if overlap:
+            speaker = max(overlap, key=overlap.get)
+        else:
+            middle = (segment["start"] + segment["end"]) / 2
+            speaker = min(turns, key=lambda t: min(abs(t['start'] - middle), abs(t['end'] - middle)))['speaker']
+        yield dict(segment, speaker=speaker)
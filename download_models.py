@@ -1,46 +1,108 @@
-import os
 import sys
-import torch
-import whisper
-from tqdm import tqdm
-
-def download_models():
-    # 確保模型目錄存在
-    models_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models')
-    os.makedirs(models_dir, exist_ok=True)
-    
-    # 要下載的模型列表
-    model_names = ["tiny", "base", "small", "medium", "large-v3"]
-    
+import argparse
+import logging
+
+from model_store import MODELS_FOLDER, get_model_store
+from execution_profiles import PROFILES
+
+# 預設下載的模型列表
+DEFAULT_MODELS = ["tiny", "base", "small", "medium", "large-v3"]
+
+
+def download_models(model_names=DEFAULT_MODELS):
+    """
+    取得官方模型並登錄到模型清單
+
+    whisper 的下載快取已有完好的檔案時直接連結或複製，不會重新下載，
+    也不會把模型載入記憶體。
+    """
+    store = get_model_store()
     print("開始下載 Whisper 模型...")
-    print(f"模型將被保存在: {models_dir}")
+    print(f"模型將被保存在: {MODELS_FOLDER}")
     print("=" * 50)
-    
+
+    failed = []
     for model_name in model_names:
         print(f"\n下載模型: {model_name}")
         try:
-            # 下載並載入模型
-            model = whisper.load_model(model_name)
-            
-            # 獲取模型文件路徑
-            model_path = os.path.join(models_dir, f"{model_name}.pt")
-            
-            # 保存模型
-            torch.save(model.state_dict(), model_path)
-            print(f"模型 {model_name} 已保存到: {model_path}")
-            
-            # 清理 GPU 記憶體
-            del model
-            if torch.cuda.is_available():
-                torch.cuda.empty_cache()
-            
+            entry = store.fetch(model_name)
+            print(f"模型 {model_name} 已保存到: {store.path(entry)}（{entry['size'] / 1024 / 1024:.0f} MB）")
         except Exception as e:
             print(f"下載模型 {model_name} 時發生錯誤: {str(e)}")
-            continue
-    
+            failed.append(model_name)
+
     print("\n" + "=" * 50)
-    print("所有模型下載完成！")
-    print(f"模型文件位置: {models_dir}")
+    if failed:
+        print(f"以下模型下載失敗: {', '.join(failed)}")
+    else:
+        print("所有模型下載完成！")
+    print(f"模型文件位置: {MODELS_FOLDER}")
+    return not failed
+
+
+def verify_models():
+    """重新計算所有已登錄模型的雜湊並與清單比對"""
+    store = get_model_store()
+    failed = []
+    for model_name in sorted(store.entries()):
+        ok = store.check(model_name, full=True)
+        print(f"{'通過' if ok else '失敗'}  {model_name}")
+        if not ok:
+            failed.append(model_name)
+    return not failed
+
+
+def list_models():
+    for model_name, entry in sorted(get_model_store().entries().items()):
+        dims = entry['dims']
+        print(f"{model_name:20s} {entry['size'] / 1024 / 1024:8.0f} MB  "
+              f"{dims['n_audio_layer']}+{dims['n_text_layer']} 層  {dims['n_mels']} 頻帶  "
+              f"{'官方' if entry.get('official') else entry.get('source', '')}  "
+              f"執行設定檔 {entry.get('profile') or '預設'}  sha256 {entry['sha256'][:12]}…")
+
+
+def set_profiles(assignments):
+    """依「模型=設定檔」指定模型的執行設定檔，設定檔為 auto 時恢復設備預設"""
+    store = get_model_store()
+    ok = True
+    for assignment in assignments:
+        model_name, _, profile = assignment.partition('=')
+        if profile != 'auto' and profile not in PROFILES:
+            print(f"未知的執行設定檔 {profile}（可用: auto {' '.join(PROFILES)}）")
+            ok = False
+        elif not store.set_profile(model_name, None if profile == 'auto' else profile):
+            print(f"模型 {model_name} 尚未登錄")
+            ok = False
+        else:
+            print(f"{model_name} 的執行設定檔: {profile}")
+    return ok
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='下載並管理本地 Whisper 模型庫')
+    parser.add_argument('models', nargs='*', help=f'要下載的模型（預設: {" ".join(DEFAULT_MODELS)}）')
+    parser.add_argument('--verify', action='store_true', help='重新計算所有已登錄模型的雜湊並比對')
+    parser.add_argument('--scan', action='store_true', help='登錄 models 資料夾中尚未登錄的 .pt 檔')
+    parser.add_argument('--list', action='store_true', help='列出已登錄的模型')
+    parser.add_argument('--profile', action='append', metavar='模型=設定檔',
+                        help=f'指定模型的執行設定檔（auto {" ".join(PROFILES)}），可重複指定')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s - %(message)s')
+
+    if args.scan:
+        added = get_model_store().scan()
+        print(f"新登錄 {len(added)} 個模型: {', '.join(added)}" if added else "沒有新的模型檔")
+        return 0
+    if args.profile:
+        return 0 if set_profiles(args.profile) else 1
+    if args.verify:
+        return 0 if verify_models() else 1
+    if args.list:
+        list_models()
+        return 0
+    return 0 if download_models(args.models or DEFAULT_MODELS) else 1
+
 
 if __name__ == "__main__":
-    download_models() 
\ No newline at end of file
+    sys.exit(main())
@@ -0,0 +1,162 @@
+"""
+執行設定檔（execution profile）
+
+解碼時的精度與執行方式依名稱選擇，取代各處自行包的 autocast / no_grad：
+
+- fp32：float32 + torch.no_grad()（CPU 預設）
+- fp16：CUDA 的 float16 autocast（GPU 預設，與先前的行為相同）
+- bf16：bfloat16 autocast + inference_mode，CPU 需支援 AVX512-BF16 或 AMX 才會變快
+- inference：torch.inference_mode()，省去 autograd 的版本計數；GPU 上仍使用 float16
+- compiled：以 torch.compile 編譯編碼器（輸入固定為 30 秒梅爾頻譜，形狀不變），
+  其餘同 inference；編譯後的編碼器另外存放，只在 execution_context('compiled') 內替換，
+  同一個模型實例上其他設定檔的任務仍使用原本的編碼器
+
+使用的設定檔依序取自：明確指定的值、模型清單中該模型的設定
+（python download_models.py --profile 模型=設定檔）、設備預設值。
+編譯與暖機在模型實例第一次以該設定檔使用時進行一次並記在實例上，
+常駐的模型（ModelPool、已載入的模型、工作程序）之後的任務不再付出這個成本。
+暖機失敗（例如缺少編譯器、設備不支援 bfloat16）時記錄警告並退回較保守的設定檔。
+"""
+import time
+import logging
+import threading
+from contextlib import contextmanager, nullcontext
+
+import torch
+from whisper.audio import N_FRAMES
+from whisper.decoding import DecodingOptions
+
+from decode_cache import WindowCache, new_stats
+from model_store import get_model_store
+
+PROFILES = {
+    'fp32': 'float32 + no_grad',
+    'fp16': 'CUDA float16 autocast + no_grad',
+    'bf16': 'bfloat16 autocast + inference_mode',
+    'inference': 'inference_mode（GPU 上使用 float16 autocast）',
+    'compiled': 'torch.compile 編碼器 + inference_mode',
+}
+# 暖機失敗時改用的設定檔
+FALLBACKS = {'compiled': 'inference', 'bf16': 'fp32', 'inference': 'fp32'}
+
+# 暖機時會在持有鎖的情況下進入 execution_context
+_lock = threading.RLock()
+
+
+def default_profile(device):
+    return 'fp16' if device == 'cuda' else 'fp32'
+
+
+def resolve_profile(model_name, device, requested=None):
+    """決定模型在該設備上使用的設定檔，requested 為 None、空字串或 auto 時依模型清單與設備"""
+    profile = requested if requested and requested != 'auto' else None
+    if profile is None:
+        profile = (get_model_store().get(model_name) or {}).get('profile') or default_profile(device)
+    if profile not in PROFILES:
+        logging.warning(f"未知的執行設定檔 {profile}，改用 {default_profile(device)}")
+        return default_profile(device)
+    if profile == 'fp16' and device != 'cuda':
+        return 'fp32'
+    return profile
+
+
+def uses_fp16(profile, device):
+    """解碼選項的 fp16：梅爾頻譜以 float16 輸入（只有 GPU 上的 float16 設定檔）"""
+    return device == 'cuda' and profile in ('fp16', 'inference', 'compiled')
+
+
+@contextmanager
+def _compiled_encoder(model):
+    """在區塊內以編譯過的編碼器取代模型的編碼器，最後一個使用者離開時換回原本的編碼器"""
+    state = model.__dict__ if model is not None else {}
+    if state.get('_compiled_encoder_module') is None:
+        yield
+        return
+    with _lock:
+        state['_compiled_users'] = state.get('_compiled_users', 0) + 1
+        if state['_compiled_users'] == 1:
+            state['_eager_encoder'] = model.encoder
+            model.encoder = state['_compiled_encoder_module']
+    try:
+        yield
+    finally:
+        with _lock:
+            state['_compiled_users'] -= 1
+            if state['_compiled_users'] == 0:
+                model.encoder = state.pop('_eager_encoder')
+
+
+@contextmanager
+def execution_context(profile, device, model=None):
+    """設定檔對應的精度與梯度設定，解碼呼叫包在其中；compiled 需傳入 model 才會使用編譯過的編碼器"""
+    if profile == 'fp32':
+        with torch.no_grad():
+            yield
+    elif profile == 'fp16':
+        with torch.autocast('cuda'), torch.no_grad():
+            yield
+    elif profile == 'bf16':
+        with torch.autocast(device, dtype=torch.bfloat16), torch.inference_mode():
+            yield
+    elif profile == 'compiled':
+        with torch.autocast('cuda') if device == 'cuda' else nullcontext(), torch.inference_mode(), \
+                _compiled_encoder(model):
+            yield
+    else:
+        with torch.autocast('cuda') if device == 'cuda' else nullcontext(), torch.inference_mode():
+            yield
+
+
+def _warm_up(model, profile, device):
+    """
+    以一個 30 秒的靜音窗口實際解碼一個 token，觸發編譯並確認設定檔可用
+
+    與任務一樣經過 WindowCache 與 DecodingTask，精度不相容等問題在這裡就會失敗並退回。
+    """
+    fp16 = uses_fp16(profile, device)
+    mel = torch.zeros(model.dims.n_mels, N_FRAMES, dtype=torch.float16 if fp16 else torch.float32,
+                      device=model.device)
+    options = DecodingOptions(language='en', without_timestamps=True, sample_len=1, fp16=fp16)
+    with execution_context(profile, device, model):
+        WindowCache(model, mel, new_stats()).decode(options)
+
+
+def prepare_model(model, model_name, device, requested=None):
+    """
+    依設定檔準備模型並回傳實際使用的設定檔
+
+    compiled 第一次使用時編譯編碼器（存放在模型實例上，不替換 model.encoder）；
+    每個設定檔第一次使用時暖機一次，結果記在模型實例上。
+    """
+    profile = resolve_profile(model_name, device, requested)
+    if not isinstance(model, torch.nn.Module):
+        # stub 後端等非 torch 模型
+        return profile
+
+    with _lock:
+        prepared = model.__dict__.setdefault('_execution_profiles', {})
+        while prepared.get(profile) != profile:
+            if profile in prepared:
+                profile = prepared[profile]
+                continue
+            if profile not in FALLBACKS:
+                # fp32 與 fp16 即先前的行為，不需要暖機
+                prepared[profile] = profile
+                continue
+
+            started = time.time()
+            try:
+                if profile == 'compiled' and model.__dict__.get('_compiled_encoder_module') is None:
+                    # 直接寫入 __dict__，不註冊為子模組（不會出現在 state_dict 中）
+                    model.__dict__['_compiled_encoder_module'] = torch.compile(model.encoder, dynamic=False)
+                _warm_up(model, profile, device)
+                prepared[profile] = profile
+                logging.info(f"模型 {model_name}@{device} 的執行設定檔 {profile} 暖機完成，"
+                             f"耗時 {time.time() - started:.1f} 秒")
+            except Exception as e:
+                if profile == 'compiled':
+                    model.__dict__.pop('_compiled_encoder_module', None)
+                logging.warning(f"模型 {model_name}@{device} 無法使用執行設定檔 {profile}，"
+                                f"改用 {FALLBACKS[profile]}: {str(e)}")
+                prepared[profile] = FALLBACKS[profile]
+        return profile
@@ -0,0 +1,161 @@
+"""
+轉錄任務排程器
+
+以固定數量的執行槽依優先權處理任務。執行中的任務可以被取消、暫停或
+被更高優先權的任務搶佔；停止請求會在解碼器的下一個 30 秒窗口邊界生效。
+"""
+import heapq
+import logging
+import itertools
+import threading
+
+# 停止原因
+STOP_CANCEL = 'cancel'
+STOP_PAUSE = 'pause'
+STOP_PREEMPT = 'preempt'
+
+
+class JobScheduler:
+    """有限執行槽的優先權排程器（數字越大優先權越高）"""
+
+    def __init__(self, run_job, max_concurrent=1, preempt_min_remaining=600.0, remaining_seconds=None):
+        self._run_job = run_job
+        self.max_concurrent = max(1, int(max_concurrent))
+        self.preempt_min_remaining = preempt_min_remaining
+        self._remaining_seconds = remaining_seconds or (lambda task_id: None)
+
+        self._cond = threading.Condition()
+        self._queue = []  # (-priority, seq, task_id)
+        self._jobs = {}
+        self._running = set()
+        self._seq = itertools.count()
+
+        for slot in range(self.max_concurrent):
+            threading.Thread(target=self._slot_loop, name=f'transcribe-slot-{slot}', daemon=True).start()
+
+    # ---- 公開介面 ----
+
+    def submit(self, task_id, args, priority=0):
+        """排入新任務；若執行槽已滿，可能搶佔一個低優先權的長任務"""
+        with self._cond:
+            job = {'args': args, 'priority': priority, 'seq': next(self._seq),
+                   'state': 'queued', 'stop': None, 'stopped': None}
+            self._jobs[task_id] = job
+            heapq.heappush(self._queue, (-priority, job['seq'], task_id))
+            self._maybe_preempt(task_id, priority)
+            self._cond.notify()
+
+    def resume(self, task_id):
+        """把暫停中的任務重新排入佇列，保留原本的排隊順序"""
+        with self._cond:
+            job = self._jobs.get(task_id)
+            if job is None or job['state'] != 'paused':
+                return False
+            job['state'] = 'queued'
+            heapq.heappush(self._queue, (-job['priority'], job['seq'], task_id))
+            self._maybe_preempt(task_id, job['priority'])
+            self._cond.notify()
+            return True
+
+    def cancel(self, task_id):
+        """
+        取消任務
+
+        回傳 'running'（已要求在下一個窗口邊界停止）、'removed'（尚未執行，已移除）或 None。
+        """
+        return self._stop(task_id, STOP_CANCEL)
+
+    def pause(self, task_id):
+        """暫停任務，回傳值同 cancel()"""
+        return self._stop(task_id, STOP_PAUSE)
+
+    def stop_requested(self, task_id):
+        """解碼器在每個窗口邊界呼叫，回傳停止原因或 None"""
+        job = self._jobs.get(task_id)
+        return job['stop'] if job is not None else None
+
+    def mark_stopped(self, task_id, reason):
+        """解碼器確實在窗口邊界停止後，由執行端回報"""
+        with self._cond:
+            job = self._jobs.get(task_id)
+            if job is not None:
+                job['stopped'] = reason
+
+    def state(self, task_id):
+        job = self._jobs.get(task_id)
+        return job['state'] if job is not None else None
+
+    # ---- 內部實作 ----
+
+    def _stop(self, task_id, reason):
+        with self._cond:
+            job = self._jobs.get(task_id)
+            if job is None:
+                return None
+            if job['state'] == 'running':
+                job['stop'] = reason
+                return 'running'
+            if reason == STOP_PAUSE:
+                if job['state'] == 'queued':
+                    # 佇列中的舊項目會在取出時被略過
+                    job['state'] = 'paused'
+                    return 'removed'
+                return None
+            del self._jobs[task_id]
+            return 'removed'
+
+    def _maybe_preempt(self, task_id, priority):
+        if len(self._running) < self.max_concurrent:
+            return
+        # 已經有任務正在讓出執行槽時不再重複搶佔
+        if any(self._jobs[t]['stop'] is not None for t in self._running):
+            return
+
+        candidates = []
+        for running_id in self._running:
+            job = self._jobs[running_id]
+            if job['priority'] >= priority:
+                continue
+            remaining = self._remaining_seconds(running_id)
+            if remaining is None or remaining < self.preempt_min_remaining:
+                continue
+            candidates.append((job['priority'], -remaining, running_id))
+
+        if candidates:
+            _, _, victim = min(candidates)
+            self._jobs[victim]['stop'] = STOP_PREEMPT
+            logging.info(f"任務 {task_id} (優先權 {priority}) 搶佔執行中的任務 {victim}")
+
+    def _slot_loop(self):
+        while True:
+            with self._cond:
+                while True:
+                    while not self._queue:
+                        self._cond.wait()
+                    _, seq, task_id = heapq.heappop(self._queue)
+                    job = self._jobs.get(task_id)
+                    if job is not None and job['state'] == 'queued' and job['seq'] == seq:
+                        break
+                job['state'] = 'running'
+                job['stop'] = None
+                job['stopped'] = None
+                self._running.add(task_id)
+
+            try:
+                self._run_job(task_id, *job['args'])
+            except Exception as e:
+                logging.error(f"執行任務 {task_id} 時發生錯誤: {str(e)}", exc_info=True)
+            finally:
+                with self._cond:
+                    self._running.discard(task_id)
+                    stopped = job['stopped']
+                    job['stop'] = None
+                    if stopped == STOP_PREEMPT:
+                        # 被搶佔的任務以原本的順序重新排隊，稍後從中斷處恢復
+                        job['state'] = 'queued'
+                        heapq.heappush(self._queue, (-job['priority'], job['seq'], task_id))
+                        self._cond.notify()
+                    elif stopped == STOP_PAUSE:
+                        job['state'] = 'paused'
+                    else:
+                        self._jobs.pop(task_id, None)
@@ -0,0 +1,164 @@
+"""
+轉錄前的語言偵測
+
+每個檔案只偵測一次：先解碼開頭幾分鐘，以能量式語音活動偵測（VAD）找到第一段
+持續的語音，從該處取 30 秒交給 whisper 的語言偵測（只跑一次編碼器與一個解碼
+步驟），結果依音頻內容的 SHA-256 存在 checkpoints/language_cache.json，同一個
+檔案再次轉錄時不必重新偵測。偵測到的語言直接傳給解碼器，不會在轉錄時再偵測。
+"""
+import os
+import json
+import logging
+import tempfile
+import threading
+from datetime import datetime
+
+import ffmpeg
+import numpy as np
+import whisper
+
+from checkpoint import CHECKPOINT_FOLDER
+
+SAMPLE_RATE = whisper.audio.SAMPLE_RATE
+CACHE_PATH = os.path.join(CHECKPOINT_FOLDER, 'language_cache.json')
+
+# 只解碼開頭這麼多秒來尋找語音
+SCAN_SECONDS = 300
+# VAD 參數：30 ms 一幀，至少連續 1 秒、其中過半為語音才算語音開始
+FRAME_SECONDS = 0.03
+MIN_SPEECH_SECONDS = 1.0
+# 語音開始前保留的秒數
+PRE_ROLL_SECONDS = 0.2
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def load_head(audio_path, seconds=SCAN_SECONDS):
+    """以 ffmpeg 只解碼開頭 seconds 秒，回傳 16 kHz 單聲道 float32 陣列"""
+    try:
+        out, _ = (
+            ffmpeg.input(str(audio_path), threads=0, t=seconds)
+            .output('-', format='s16le', acodec='pcm_s16le', ac=1, ar=SAMPLE_RATE)
+            .run(cmd=['ffmpeg', '-nostdin'], capture_stdout=True, capture_stderr=True)
+        )
+    except ffmpeg.Error as e:
+        raise RuntimeError(f"無法解碼音頻: {e.stderr.decode(errors='ignore')}") from e
+    return np.frombuffer(out, np.int16).flatten().astype(np.float32) / 32768.0
+
+
+def energy_vad(energy_db, threshold_db=15.0, floor_dbfs=-50.0):
+    """每幀的能量（dBFS）高於噪音底（第 10 百分位）threshold_db 且高於 floor_dbfs 即視為語音"""
+    if len(energy_db) == 0:
+        return np.zeros(0, dtype=bool)
+    threshold = max(np.percentile(energy_db, 10) + threshold_db, floor_dbfs)
+    return energy_db > threshold
+
+
+def find_speech_start(audio):
+    """回傳第一段持續語音的起始秒數，找不到時回傳 None"""
+    frame = int(FRAME_SECONDS * SAMPLE_RATE)
+    n_frames = len(audio) // frame
+    if n_frames == 0:
+        return None
+    frames = audio[:n_frames * frame].reshape(n_frames, frame)
+    energy_db = 10 * np.log10(np.mean(frames ** 2, axis=1) + 1e-10)
+    voiced = energy_vad(energy_db).astype(np.float32)
+
+    window = max(1, int(MIN_SPEECH_SECONDS / FRAME_SECONDS))
+    if n_frames < window:
+        return 0.0 if voiced.mean() > 0.5 else None
+    # 每個 1 秒窗口中語音幀的比例
+    ratio = np.convolve(voiced, np.ones(window) / window, mode='valid')
+    candidates = np.nonzero(ratio > 0.5)[0]
+    if len(candidates) == 0:
+        return None
+    return max(0.0, float(candidates[0]) * FRAME_SECONDS - PRE_ROLL_SECONDS)
+
+
+def detect_audio_language(model, audio):
+    """對 30 秒音頻執行 whisper 的語言偵測，回傳依機率排序的 [(語言, 機率)]"""
+    if not model.is_multilingual:
+        return [('en', 1.0)]
+    mel = whisper.log_mel_spectrogram(whisper.pad_or_trim(audio), n_mels=model.dims.n_mels).to(model.device)
+    _, probs = model.detect_language(mel)
+    return sorted(probs.items(), key=lambda item: item[1], reverse=True)
+
+
+# ---- 快取 ----
+
+def _load_cache():
+    global _cache
+    if _cache is None:
+        _cache = {}
+        if os.path.exists(CACHE_PATH):
+            try:
+                with open(CACHE_PATH, 'r', encoding='utf-8') as f:
+                    _cache = json.load(f)
+            except (OSError, ValueError) as e:
+                logging.warning(f"無法讀取語言偵測快取，將重新建立: {str(e)}")
+    return _cache
+
+
+def cached_language(audio_hash):
+    with _cache_lock:
+        entry = _load_cache().get(audio_hash)
+        return dict(entry) if entry else None
+
+
+def _store(audio_hash, entry):
+    with _cache_lock:
+        cache = _load_cache()
+        cache[audio_hash] = entry
+        os.makedirs(CHECKPOINT_FOLDER, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=CHECKPOINT_FOLDER, prefix='.language-', suffix='.json')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(cache, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, CACHE_PATH)
+
+
+def identify_language(audio_path, audio_hash, model_pool=None, model_name="base", device="cuda", model=None):
+    """
+    偵測檔案的語言，回傳 {'language', 'probability', 'candidates', 'speech_start', 'model', 'cached'}
+
+    已偵測過的音頻（依內容雜湊）直接回傳快取結果。有傳入 model 時直接使用該模型，
+    否則從 model_pool 取出 model_name 模型。model_name 會記錄在快取中。
+    """
+    entry = cached_language(audio_hash)
+    if entry is not None:
+        entry['cached'] = True
+        return entry
+
+    audio = load_head(audio_path)
+    speech_start = find_speech_start(audio)
+    start = int((speech_start or 0.0) * SAMPLE_RATE)
+    window = audio[start:start + whisper.audio.N_SAMPLES]
+
+    if model is not None:
+        ranked = detect_audio_language(model, window)
+    else:
+        with model_pool.acquire(model_name, device) as pooled:
+            ranked = detect_audio_language(pooled, window)
+
+    language, probability = ranked[0]
+    entry = {
+        'language': language,
+        'probability': round(float(probability), 4),
+        'candidates': [[lang, round(float(p), 4)] for lang, p in ranked[:3]],
+        'speech_start': round(speech_start, 2) if speech_start is not None else None,
+        'model': model_name,
+        'detected_at': datetime.now().isoformat(timespec='seconds'),
+    }
+    _store(audio_hash, entry)
+    logging.info(f"偵測語言 {os.path.basename(str(audio_path))}: {language}（{probability:.2f}），"
+                 f"語音起點 {entry['speech_start']} 秒")
+    entry['cached'] = False
+    return entry
+
+
+def group_by_language(items, language_of):
+    """把項目依語言分組並保留原本順序，回傳 {語言: [項目]}（依第一次出現的順序）"""
+    groups = {}
+    for item in items:
+        groups.setdefault(language_of(item), []).append(item)
+    return groups
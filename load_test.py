@@ -0,0 +1,480 @@
+"""
+網頁 API 負載測試
+
+以多個並行上傳端送出轉錄任務，同時以多個查詢端持續呼叫 /task/<id> 與 /tasks，
+統計上傳與查詢延遲、排隊等待（上傳到開始轉錄）與端到端耗時（上傳到完成）的
+分布，並取樣服務行程的 CPU 與記憶體用量。
+
+加上 --spawn 時會以 stub 模型後端（不做推論，每秒音頻固定等待 --stub-rtf 秒）
+在暫存資料夾啟動一個服務，不需要 GPU 或模型檔，同樣的參數與 --seed 每次產生
+相同的音頻與負載，可用來比較排程器與快取調整前後的差異。
+
+用法:
+    python load_test.py --spawn --jobs 40 --uploaders 8 --clients 20 --audio-seconds 120 \\
+        --server-env WHISPER_MAX_CONCURRENT_JOBS=4 --json result.json
+    python serve.py                # 另開一個終端機啟動服務，測試實際模型
+    python load_test.py --audio 訪談記錄/sample.wav --jobs 2 --clients 20 --duration 30
+"""
+import io
+import os
+import sys
+import json
+import math
+import time
+import wave
+import array
+import random
+import shutil
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+
+import psutil
+import requests
+
+SAMPLE_RATE = 16000
+# 視為結束的任務狀態
+FINISHED_STATUSES = ('completed', 'error', 'cancelled')
+
+
+def percentile(sorted_values, pct):
+    """最近秩法百分位數"""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(pct / 100.0 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def distribution(values, scale=1.0, digits=2):
+    """p50/p90/p99/最大值，values 為秒數"""
+    values = sorted(values)
+    pick = lambda value: round(value * scale, digits) if value is not None else None
+    return {
+        'count': len(values),
+        'p50': pick(percentile(values, 50)),
+        'p90': pick(percentile(values, 90)),
+        'p99': pick(percentile(values, 99)),
+        'max': pick(values[-1] if values else None),
+    }
+
+
+# ---- 合成音頻 ----
+
+def _tone_palette(count=16, seed=0):
+    """預先產生 count 個一秒長的短音（音高不同、加少量雜訊），合成音頻時重複取用"""
+    rng = random.Random(seed)
+    palette = []
+    for _ in range(count):
+        step = 2 * math.pi * rng.uniform(120, 400) / SAMPLE_RATE
+        tone = int(SAMPLE_RATE * 0.6)
+        samples = array.array('h', (int(8000 * math.sin(step * i)) + rng.randint(-200, 200) for i in range(tone)))
+        samples.extend(rng.randint(-200, 200) for _ in range(SAMPLE_RATE - tone))
+        palette.append(samples.tobytes())
+    return palette
+
+
+_palette = None
+
+
+def synthetic_wav(seconds, seed):
+    """
+    產生 16 kHz 單聲道 WAV：每秒從預先產生的短音中依 seed 隨機選一個
+
+    同一個 seed 產生相同的內容；每個任務使用不同的 seed，
+    避免內容雜湊相同而共用語言快取與檢查點。
+    """
+    global _palette
+    if _palette is None:
+        _palette = _tone_palette()
+    rng = random.Random(seed)
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(SAMPLE_RATE)
+        w.writeframes(b''.join(rng.choice(_palette) for _ in range(int(seconds))))
+    return buffer.getvalue()
+
+
+# ---- 以 stub 後端啟動服務 ----
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def spawn_server(stub_rtf, extra_env, workdir, threads):
+    """在暫存資料夾啟動使用 stub 後端的服務，回傳 (process, base_url)"""
+    port = free_port()
+    env = dict(os.environ,
+               WHISPER_BACKEND='stub',
+               WHISPER_STUB_RTF=str(stub_rtf),
+               WHISPER_LANGUAGE='zh',
+               WHISPER_UPLOAD_FOLDER=os.path.join(workdir, 'uploads'),
+               WHISPER_OUTPUT_FOLDER=os.path.join(workdir, 'outputs'),
+               # 檢查點也放在暫存資料夾，逾時未完成的任務不會在下一次執行時接續
+               WHISPER_CHECKPOINT_FOLDER=os.path.join(workdir, 'checkpoints'),
+               # stub 的即時率不能寫進正式的統計（會影響 model=auto 的選擇與剩餘時間估計）
+               WHISPER_RTF_STATS=os.path.join(workdir, 'rtf_stats.json'))
+    env.update(extra_env)
+    log = open(os.path.join(workdir, 'server.log'), 'wb')
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'serve.py'),
+         '--host', '127.0.0.1', '--port', str(port), '--threads', str(threads)],
+        env=env, stdout=log, stderr=subprocess.STDOUT
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 120
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"服務啟動失敗，請查看 {log.name}")
+        try:
+            requests.get(f"{base_url}/tasks", timeout=2)
+            return process, base_url
+        except requests.RequestException:
+            time.sleep(0.5)
+    process.terminate()
+    raise RuntimeError(f"服務在 120 秒內沒有回應，請查看 {log.name}")
+
+
+class ResourceSampler(threading.Thread):
+    """定期取樣服務行程（含子程序）的 CPU 與常駐記憶體"""
+
+    def __init__(self, pid, interval=0.5):
+        super().__init__(daemon=True)
+        self.process = psutil.Process(pid)
+        self.interval = interval
+        # 同一個 Process 物件才會記住上一次的 CPU 時間，子程序依 pid 沿用
+        self._children = {}
+        self.cpu = []
+        self.rss = []
+        self._stop_event = threading.Event()
+
+    def _processes(self):
+        try:
+            children = self.process.children(recursive=True)
+        except psutil.NoSuchProcess:
+            return []
+        current = {}
+        for child in children:
+            cached = self._children.get(child.pid)
+            if cached is None or cached != child:
+                # 新出現（或 pid 被重用）的子程序第一次取樣只建立基準，不計入 CPU
+                try:
+                    child.cpu_percent(None)
+                except psutil.NoSuchProcess:
+                    continue
+                cached = child
+            current[child.pid] = cached
+        self._children = current
+        return [self.process] + list(current.values())
+
+    def run(self):
+        for p in self._processes():
+            p.cpu_percent(None)
+        while not self._stop_event.wait(self.interval):
+            cpu = rss = 0.0
+            for p in self._processes():
+                try:
+                    cpu += p.cpu_percent(None)
+                    rss += p.memory_info().rss
+                except psutil.NoSuchProcess:
+                    continue
+            self.cpu.append(cpu)
+            self.rss.append(rss / 1024 ** 2)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def report(self):
+        if not self.cpu:
+            return None
+        return {
+            'samples': len(self.cpu),
+            'cpu_percent_mean': round(sum(self.cpu) / len(self.cpu), 1),
+            'cpu_percent_max': round(max(self.cpu), 1),
+            'rss_mb_start': round(self.rss[0], 1),
+            'rss_mb_max': round(max(self.rss), 1),
+            'rss_mb_end': round(self.rss[-1], 1),
+        }
+
+
+# ---- 負載 ----
+
+class LoadRun:
+    """一次負載測試的共用狀態"""
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.lock = threading.Lock()
+        self.task_ids = []
+        self.upload_latencies = []
+        self.upload_errors = 0
+        self.poll_latencies = {'task': [], 'tasks': []}
+        self.poll_errors = 0
+        self.uploads_done = threading.Event()
+
+    def add_task(self, task_id, latency):
+        with self.lock:
+            self.task_ids.append(task_id)
+            self.upload_latencies.append(latency)
+
+    def task_ids_snapshot(self):
+        with self.lock:
+            return list(self.task_ids)
+
+
+def upload_worker(run, queue, model, use_gpu, make_file):
+    session = requests.Session()
+    while True:
+        with run.lock:
+            if not queue:
+                return
+            index = queue.pop(0)
+        filename, content = make_file(index)
+        started = time.perf_counter()
+        try:
+            response = session.post(
+                f"{run.base_url}/upload",
+                files={'file': (filename, content)},
+                data={'model': model, 'use_gpu': 'true' if use_gpu else 'false', 'force_model': 'true'},
+                timeout=600
+            )
+            response.raise_for_status()
+            run.add_task(response.json()['task_id'], time.perf_counter() - started)
+        except (requests.RequestException, ValueError, KeyError) as e:
+            print(f"上傳 {filename} 失敗: {str(e)}", file=sys.stderr)
+            with run.lock:
+                run.upload_errors += 1
+
+
+def poll_worker(run, deadline, done, tasks_ratio, seed):
+    """以固定比例混合查詢單一任務與 /tasks"""
+    session = requests.Session()
+    rng = random.Random(seed)
+    i = 0
+    while time.time() < deadline and not done.is_set():
+        task_ids = run.task_ids_snapshot()
+        if not task_ids:
+            time.sleep(0.1)
+            continue
+        if rng.random() < tasks_ratio:
+            kind, url = 'tasks', f"{run.base_url}/tasks"
+        else:
+            kind, url = 'task', f"{run.base_url}/task/{task_ids[i % len(task_ids)]}"
+            i += 1
+        started = time.perf_counter()
+        try:
+            ok = session.get(url, timeout=30).status_code == 200
+        except requests.RequestException:
+            ok = False
+        elapsed = time.perf_counter() - started
+        with run.lock:
+            if ok:
+                run.poll_latencies[kind].append(elapsed)
+            else:
+                run.poll_errors += 1
+
+
+def fetch_tasks(base_url, task_ids):
+    """取得任務的完整狀態"""
+    try:
+        all_tasks = requests.get(f"{base_url}/tasks", timeout=60).json()
+    except (requests.RequestException, ValueError):
+        return {}
+    return {task_id: all_tasks.get(task_id) for task_id in task_ids}
+
+
+def wait_for_tasks(run, deadline, interval):
+    """等到所有任務結束或超過期限，回傳最後一次取得的任務狀態"""
+    tasks = {}
+    while time.time() < deadline:
+        task_ids = run.task_ids_snapshot()
+        tasks = fetch_tasks(run.base_url, task_ids)
+        finished = all(task and task.get('status') in FINISHED_STATUSES for task in tasks.values())
+        if run.uploads_done.is_set() and finished:
+            break
+        time.sleep(interval)
+    return tasks
+
+
+def summarize_tasks(tasks):
+    """依伺服器記錄的時間計算排隊等待與端到端耗時"""
+    queue_wait, end_to_end, admission_wait = [], [], []
+    statuses = {}
+    audio_seconds = 0.0
+    for task in tasks.values():
+        if not task:
+            continue
+        statuses[task['status']] = statuses.get(task['status'], 0) + 1
+        if task.get('started_at'):
+            queue_wait.append(task['started_at'] - task['start_time'])
+        if task.get('finished_at') and task['status'] == 'completed':
+            end_to_end.append(task['finished_at'] - task['start_time'])
+            audio_seconds += task.get('audio_duration') or 0.0
+        reservation = task.get('memory_reservation')
+        if reservation:
+            admission_wait.append(reservation.get('waited_seconds', 0.0))
+    return {
+        'statuses': statuses,
+        'audio_seconds': round(audio_seconds, 1),
+        'queue_wait_s': distribution(queue_wait),
+        'admission_wait_s': distribution(admission_wait),
+        'end_to_end_s': distribution(end_to_end),
+    }
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="網頁 API 負載測試（上傳、任務查詢、排隊與端到端延遲）")
+    parser.add_argument("--url", default="http://127.0.0.1:3000", help="服務位址（使用 --spawn 時忽略）")
+    parser.add_argument("--spawn", action="store_true", help="以 stub 模型後端在暫存資料夾啟動服務")
+    parser.add_argument("--stub-rtf", type=float, default=0.05, help="stub 後端每秒音頻的模擬解碼秒數")
+    parser.add_argument("--server-env", action="append", default=[], metavar="KEY=VALUE",
+                        help="啟動服務時額外設定的環境變數，可重複指定")
+    parser.add_argument("--server-threads", type=int, default=8, help="啟動服務的請求執行緒數")
+    parser.add_argument("--server-pid", type=int, help="未使用 --spawn 時要取樣 CPU/記憶體的服務行程")
+    parser.add_argument("--audio", help="要上傳的音頻檔；省略時產生合成音頻")
+    parser.add_argument("--audio-seconds", type=float, default=60.0, help="合成音頻的長度（秒）")
+    parser.add_argument("--jobs", type=int, default=10, help="上傳的轉錄任務數")
+    parser.add_argument("--uploaders", type=int, default=4, help="並行上傳的客戶端數")
+    parser.add_argument("--model", default="tiny", help="轉錄使用的模型")
+    parser.add_argument("--cpu", action="store_true", help="轉錄不使用 GPU")
+    parser.add_argument("--task-id", action="append", default=[], help="要一併查詢的既有任務 ID，可重複指定")
+    parser.add_argument("--clients", type=int, default=20, help="並行查詢的客戶端數")
+    parser.add_argument("--tasks-ratio", type=float, default=0.1, help="查詢中呼叫 /tasks 的比例")
+    parser.add_argument("--duration", type=float, help="只查詢這麼多秒，不等待任務完成")
+    parser.add_argument("--timeout", type=float, default=1800.0, help="等待所有任務完成的秒數上限")
+    parser.add_argument("--seed", type=int, default=0, help="合成音頻與查詢順序的亂數種子")
+    parser.add_argument("--keep", action="store_true", help="保留 --spawn 的暫存資料夾與服務日誌")
+    parser.add_argument("--json", dest="json_path", help="將結果寫成 JSON 檔，- 表示標準輸出")
+    return parser
+
+
+def main(argv=None):
+    parser = build_arg_parser()
+    args = parser.parse_args(argv)
+    extra_env = {}
+    for item in args.server_env:
+        key, sep, value = item.partition('=')
+        if not sep:
+            parser.error(f"--server-env 格式應為 KEY=VALUE: {item}")
+        extra_env[key] = value
+
+    process = None
+    workdir = None
+    base_url = args.url.rstrip('/')
+    if args.spawn:
+        workdir = tempfile.mkdtemp(prefix='whisper-load-')
+        process, base_url = spawn_server(args.stub_rtf, extra_env, workdir, args.server_threads)
+        print(f"已以 stub 後端啟動服務 {base_url}（資料夾 {workdir}）", file=sys.stderr)
+    sampler = None
+    if process is not None or args.server_pid:
+        sampler = ResourceSampler(process.pid if process is not None else args.server_pid)
+        sampler.start()
+
+    try:
+        if args.audio:
+            name, ext = os.path.splitext(os.path.basename(args.audio))
+            with open(args.audio, 'rb') as f:
+                content = f.read()
+            make_file = lambda i: (f"{name}_load{i:04d}{ext}", content)
+        else:
+            make_file = lambda i: (f"load_{args.seed}_{i:04d}.wav", synthetic_wav(args.audio_seconds, f"{args.seed}:{i}"))
+
+        run = LoadRun(base_url)
+        run.task_ids.extend(args.task_id)
+
+        started = time.time()
+        queue = list(range(args.jobs))
+        uploaders = [threading.Thread(target=upload_worker, args=(run, queue, args.model, not args.cpu, make_file),
+                                      daemon=True) for _ in range(max(1, args.uploaders))]
+        for thread in uploaders:
+            thread.start()
+
+        def mark_uploads_done():
+            for thread in uploaders:
+                thread.join()
+            run.uploads_done.set()
+        threading.Thread(target=mark_uploads_done, daemon=True).start()
+
+        done = threading.Event()
+        deadline = started + (args.duration if args.duration else args.timeout)
+        pollers = [threading.Thread(target=poll_worker, args=(run, deadline, done, args.tasks_ratio, args.seed + n),
+                                    daemon=True) for n in range(args.clients)]
+        for thread in pollers:
+            thread.start()
+
+        if args.duration:
+            while time.time() < deadline:
+                time.sleep(0.5)
+            tasks = fetch_tasks(base_url, run.task_ids_snapshot())
+        else:
+            tasks = wait_for_tasks(run, deadline, interval=1.0)
+        done.set()
+        for thread in pollers:
+            thread.join()
+        elapsed = time.time() - started
+    finally:
+        if sampler is not None:
+            sampler.stop()
+        if process is not None:
+            process.terminate()
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        if workdir and args.keep:
+            print(f"已保留暫存資料夾 {workdir}", file=sys.stderr)
+        elif workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    poll_count = sum(len(values) for values in run.poll_latencies.values())
+    task_summary = summarize_tasks(tasks)
+    result = {
+        'url': base_url,
+        'backend': 'stub' if args.spawn else 'server',
+        'stub_rtf': args.stub_rtf if args.spawn else None,
+        'server_env': extra_env,
+        'seed': args.seed,
+        'jobs': args.jobs,
+        'uploaders': args.uploaders,
+        'clients': args.clients,
+        'elapsed_seconds': round(elapsed, 2),
+        'uploads': {'errors': run.upload_errors, 'latency_ms': distribution(run.upload_latencies, 1000)},
+        'polls': {
+            'requests': poll_count + run.poll_errors,
+            'errors': run.poll_errors,
+            'requests_per_second': round((poll_count + run.poll_errors) / elapsed, 1) if elapsed > 0 else None,
+            'task_latency_ms': distribution(run.poll_latencies['task'], 1000),
+            'tasks_latency_ms': distribution(run.poll_latencies['tasks'], 1000),
+        },
+        'tasks': task_summary,
+        'throughput_audio_seconds_per_second': round(task_summary['audio_seconds'] / elapsed, 2) if elapsed > 0 else None,
+        'server_resources': sampler.report() if sampler is not None else None,
+    }
+
+    print(f"任務 {task_summary['statuses']}，耗時 {result['elapsed_seconds']} 秒", file=sys.stderr)
+    print("排隊等待 (s): " + ", ".join(f"{k}={v}" for k, v in task_summary['queue_wait_s'].items()), file=sys.stderr)
+    print("端到端 (s): " + ", ".join(f"{k}={v}" for k, v in task_summary['end_to_end_s'].items()), file=sys.stderr)
+    print("/task 延遲 (ms): " + ", ".join(f"{k}={v}" for k, v in result['polls']['task_latency_ms'].items()),
+          file=sys.stderr)
+    if result['server_resources']:
+        resources = result['server_resources']
+        print(f"服務 CPU 平均 {resources['cpu_percent_mean']}%（最高 {resources['cpu_percent_max']}%），"
+              f"記憶體最高 {resources['rss_mb_max']} MB", file=sys.stderr)
+
+    if args.json_path == '-':
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+    elif args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    failed = run.upload_errors or run.poll_errors or task_summary['statuses'].get('error')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
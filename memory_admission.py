@@ -0,0 +1,260 @@
+"""
+記憶體准入控制
+
+select_model_size() 只在選擇模型時看一次可用記憶體，同時執行的多個任務仍可能
+讓主機開始使用分頁檔或讓 CUDA 記憶體不足。這裡在任務開始解碼前估算它的峰值
+記憶體（模型權重 + 解碼一個窗口的運算 + 整段音頻的 PCM 與梅爾頻譜），在預算內才放行：
+
+- 執行中任務保留的記憶體總和不超過預算，RAM 與 VRAM 分開計算
+- 預算不足時等待其他任務結束；單獨執行也放不下，或等待超過 max_wait 秒時，
+  改用較小的模型或改用 CPU
+- 發生記憶體不足（OOM）時記錄事件，並提高該模型/設備的估計值，重試時保留更多記憶體
+
+thread 模式下同一個模型的權重由所有任務共用，只計算一次。
+"""
+import time
+import logging
+import threading
+import itertools
+from collections import deque
+from datetime import datetime
+
+import psutil
+import torch
+
+from model_scheduler import MODEL_ORDER
+from model_store import get_model_store
+
+GB = 1024 ** 3
+
+# 各模型的參數量（十億）；whisper 的權重在 GPU 上也保持 float32，每個參數 4 位元組
+MODEL_PARAMS_B = {'tiny': 0.039, 'base': 0.074, 'small': 0.244, 'medium': 0.769, 'large-v3': 1.55}
+# 解碼一個 30 秒窗口的運算記憶體（GB，含 kv-cache 與溫度回退的多個候選），依官方建議的顯示卡記憶體扣除權重
+WORKING_GB = {'tiny': 0.7, 'base': 0.7, 'small': 1.0, 'medium': 1.9, 'large-v3': 3.8}
+# 整段音頻的 PCM、STFT 與梅爾頻譜在主機記憶體中的峰值（每秒音頻的位元組數）
+AUDIO_BYTES_PER_SECOND = 350_000
+# 每個任務在主機上的其他額外記憶體（GB）
+HOST_OVERHEAD_GB = 0.3
+# 每次 OOM 後估計值乘上的倍數與上限
+OOM_GROWTH = 1.5
+MAX_CORRECTION = 4.0
+
+OOM_MESSAGES = ('out of memory', "can't allocate memory", 'defaultcpuallocator')
+
+
+def is_out_of_memory(error):
+    """CUDA OOM、CPU 配置失敗，或工作程序轉傳的同類錯誤訊息"""
+    return isinstance(error, MemoryError) or any(m in str(error).lower() for m in OOM_MESSAGES)
+
+
+def _model_size(model_name):
+    """回傳 (參數量（十億）, 運算記憶體 GB)；自訂模型依清單中的維度推算"""
+    if model_name in MODEL_PARAMS_B:
+        return MODEL_PARAMS_B[model_name], WORKING_GB[model_name]
+    entry = get_model_store().get(model_name)
+    dims = (entry or {}).get('dims')
+    if not dims:
+        return MODEL_PARAMS_B['large-v3'], WORKING_GB['large-v3']
+    d = dims['n_text_state']
+    params = (12 * d * d * dims['n_audio_layer'] + 16 * d * d * dims['n_text_layer'] + dims['n_vocab'] * d) / 1e9
+    # 運算記憶體沿用參數量不小於它的最小官方模型
+    reference = next((name for name in reversed(MODEL_ORDER) if MODEL_PARAMS_B[name] >= params), 'large-v3')
+    return params, WORKING_GB[reference]
+
+
+def estimate_job_memory(model_name, device, audio_seconds, correction=1.0):
+    """
+    估算任務的峰值記憶體（GB）
+
+    回傳 {'weights_gb', 'ram_gb', 'vram_gb'}，權重另列以便共用模型時只計算一次，
+    ram_gb 與 vram_gb 不含權重。correction 為 OOM 後累積的修正倍數。
+    """
+    params, working = _model_size(model_name)
+    audio = (audio_seconds or 0.0) * AUDIO_BYTES_PER_SECOND / GB
+    host = HOST_OVERHEAD_GB + audio * correction
+    if device == 'cuda':
+        return {'weights_gb': params * 4, 'ram_gb': host, 'vram_gb': working * correction}
+    return {'weights_gb': params * 4, 'ram_gb': host + working * correction, 'vram_gb': 0.0}
+
+
+def free_memory_gb():
+    """目前實際可用的 (RAM, VRAM)；torch 快取中未使用的部分也算可用"""
+    ram = psutil.virtual_memory().available / GB
+    vram = 0.0
+    if torch.cuda.is_available():
+        free, _ = torch.cuda.mem_get_info()
+        vram = (free + torch.cuda.memory_reserved() - torch.cuda.memory_allocated()) / GB
+    return ram, vram
+
+
+class MemoryAdmission:
+    """依預估峰值記憶體放行任務的准入控制器"""
+
+    def __init__(self, ram_budget_gb, vram_budget_gb, shared_weights=True, max_wait=600.0, poll_interval=5.0):
+        self.ram_budget_gb = ram_budget_gb
+        self.vram_budget_gb = vram_budget_gb
+        self.shared_weights = shared_weights
+        self.max_wait = max_wait
+        self.poll_interval = poll_interval
+
+        self._cond = threading.Condition()
+        self._active = {}
+        self._ids = itertools.count(1)
+        self._corrections = {}  # (模型, 設備) -> OOM 後的修正倍數
+        self.events = deque(maxlen=100)
+
+    @classmethod
+    def from_system(cls, fraction=0.85, ram_gb=0.0, vram_gb=0.0, **kwargs):
+        """預算未指定時取總記憶體的 fraction（VRAM 以第一張顯示卡計算）"""
+        if not ram_gb:
+            ram_gb = psutil.virtual_memory().total / GB * fraction
+        if not vram_gb and torch.cuda.is_available():
+            vram_gb = torch.cuda.get_device_properties(0).total_memory / GB * fraction
+        logging.info(f"記憶體准入預算: RAM {ram_gb:.1f} GB，VRAM {vram_gb or 0.0:.1f} GB")
+        return cls(ram_gb, vram_gb or 0.0, **kwargs)
+
+    # ---- 估算 ----
+
+    def plan(self, model_name, device, audio_seconds):
+        correction = self._corrections.get((model_name, device), 1.0)
+        plan = estimate_job_memory(model_name, device, audio_seconds, correction)
+        plan.update(model=model_name, device=device, audio_seconds=audio_seconds, correction=correction)
+        return plan
+
+    def candidates(self, model_name, device, allow_smaller=True, exclude=()):
+        """依偏好順序列出可用的 (模型, 設備)：原本的組合、同設備的較小模型，最後改用 CPU"""
+        models = [model_name]
+        if allow_smaller and model_name in MODEL_ORDER:
+            models += MODEL_ORDER[MODEL_ORDER.index(model_name) + 1:]
+        devices = [device] + (['cpu'] if device == 'cuda' else [])
+        return [(m, d) for d in devices for m in models if (m, d) not in exclude]
+
+    def _usage(self, plans):
+        """多個任務合計的 (RAM, VRAM)"""
+        ram = vram = 0.0
+        weights = {}
+        for plan in plans:
+            ram += plan['ram_gb']
+            vram += plan['vram_gb']
+            key = (plan['model'], plan['device']) if self.shared_weights else id(plan)
+            weights[key] = (plan['device'], plan['weights_gb'])
+        for device, gb in weights.values():
+            if device == 'cuda':
+                vram += gb
+            else:
+                ram += gb
+        return ram, vram
+
+    def _fits(self, plan, alone=False):
+        active = [] if alone else list(self._active.values())
+        if plan.get('over_budget'):
+            return not active
+        before_ram, before_vram = self._usage(active)
+        ram, vram = self._usage(active + [plan])
+        if ram > self.ram_budget_gb or vram > self.vram_budget_gb:
+            return False
+        if active:
+            # 已有任務執行時再確認實際可用的記憶體，避免估計值偏低時超用
+            free_ram, free_vram = free_memory_gb()
+            if ram - before_ram > free_ram or vram - before_vram > free_vram:
+                return False
+        return True
+
+    # ---- 准入 ----
+
+    def admit(self, task_id, model_name, device, audio_seconds, allow_smaller=True, exclude=(),
+              should_stop=None, on_wait=None):
+        """
+        等待記憶體預算並保留，回傳保留記錄（model、device 為實際使用的組合）
+
+        單獨執行也超過預算的組合直接略過；等待超過 max_wait 秒後改用目前放得下的
+        較小模型或 CPU。等待期間 should_stop() 回傳非空值時回傳 None。
+        """
+        options = [self.plan(m, d, audio_seconds) for m, d in self.candidates(model_name, device, allow_smaller, exclude)]
+        if not options:
+            raise MemoryError(f"{model_name}@{device} 與所有替代組合都曾發生記憶體不足")
+
+        started = time.time()
+        waiting = False
+        with self._cond:
+            feasible = [plan for plan in options if self._fits(plan, alone=True)]
+            if not feasible:
+                # 全部超過預算時仍以最小的組合單獨執行，交由 OOM 重試處理
+                smallest = min(options, key=lambda p: p['weights_gb'] + p['ram_gb'] + p['vram_gb'])
+                feasible = [dict(smallest, over_budget=True)]
+                logging.warning(f"任務 {task_id} 的所有模型/設備組合都超過記憶體預算，"
+                                f"將以 {smallest['model']}@{smallest['device']} 單獨執行")
+            preferred = feasible[0]
+
+            while True:
+                if self._fits(preferred):
+                    chosen = preferred
+                    break
+                if time.time() - started > self.max_wait:
+                    chosen = next((plan for plan in feasible[1:] if self._fits(plan)), None)
+                    if chosen is not None:
+                        break
+                if should_stop is not None and should_stop():
+                    return None
+                if not waiting:
+                    waiting = True
+                    logging.info(f"任務 {task_id} 等待記憶體配額（{preferred['model']}@{preferred['device']}）")
+                    if on_wait is not None:
+                        on_wait(preferred)
+                self._cond.wait(self.poll_interval)
+
+            reservation = dict(chosen, id=next(self._ids), task_id=task_id,
+                               requested=[model_name, device], waited_seconds=round(time.time() - started, 1))
+            self._active[reservation['id']] = reservation
+
+        if (chosen['model'], chosen['device']) != (model_name, device):
+            logging.warning(f"任務 {task_id} 記憶體不足以使用 {model_name}@{device}，"
+                            f"改用 {chosen['model']}@{chosen['device']}")
+        return reservation
+
+    def release(self, reservation):
+        """歸還保留的記憶體；重複呼叫不會有影響"""
+        with self._cond:
+            if self._active.pop(reservation['id'], None) is not None:
+                self._cond.notify_all()
+
+    def record_oom(self, reservation, error):
+        """記錄 OOM 事件並提高該模型/設備的估計值，回傳事件記錄"""
+        key = (reservation['model'], reservation['device'])
+        with self._cond:
+            concurrent = sum(1 for r in self._active.values() if r['id'] != reservation['id'])
+            correction = min(MAX_CORRECTION, self._corrections.get(key, 1.0) * OOM_GROWTH)
+            self._corrections[key] = correction
+            event = {
+                'time': datetime.now().isoformat(timespec='seconds'),
+                'task_id': reservation['task_id'],
+                'model': reservation['model'],
+                'device': reservation['device'],
+                'audio_seconds': reservation['audio_seconds'],
+                'estimate_gb': round(reservation['weights_gb'] + reservation['ram_gb'] + reservation['vram_gb'], 2),
+                'concurrent': concurrent,
+                'alone': concurrent == 0,
+                'correction': round(correction, 2),
+                'error': str(error)[:200]
+            }
+            self.events.append(event)
+        logging.warning(f"任務 {event['task_id']} 在 {key[0]}@{key[1]} 記憶體不足（同時執行 {concurrent} 個其他任務），"
+                        f"估計值修正為 {correction:.2f} 倍")
+        return event
+
+    def snapshot(self):
+        """預算、目前保留量、執行中的保留記錄與最近的 OOM 事件"""
+        with self._cond:
+            active = list(self._active.values())
+            ram, vram = self._usage(active)
+            return {
+                'ram_budget_gb': round(self.ram_budget_gb, 2),
+                'vram_budget_gb': round(self.vram_budget_gb, 2),
+                'ram_reserved_gb': round(ram, 2),
+                'vram_reserved_gb': round(vram, 2),
+                'active': [{'task_id': r['task_id'], 'model': r['model'], 'device': r['device'],
+                            'weights_gb': round(r['weights_gb'], 2), 'ram_gb': round(r['ram_gb'], 2),
+                            'vram_gb': round(r['vram_gb'], 2)} for r in active],
+                'corrections': {f"{m}@{d}": round(c, 2) for (m, d), c in self._corrections.items()},
+                'oom_events': list(self.events)
+            }
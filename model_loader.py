@@ -0,0 +1,101 @@
+import os
+import logging
+import threading
+from contextlib import contextmanager
+import whisper
+import torch
+
+from model_store import MODELS_FOLDER, get_model_store
+
+os.makedirs(MODELS_FOLDER, exist_ok=True)
+
+def load_local_model(model_name, device="cuda"):
+    """依模型清單從本地載入模型，未登錄或驗證失敗時回傳 None"""
+    store = get_model_store()
+    if store.get(model_name) is None:
+        if os.path.exists(os.path.join(MODELS_FOLDER, f"{model_name}.pt")):
+            logging.warning(f"models/{model_name}.pt 未登錄在模型清單中，不會直接載入；"
+                            f"請執行 python download_models.py --scan 登錄")
+        return None
+    try:
+        model = store.load(model_name, device=device)
+        if model is not None:
+            logging.info(f"本地模型 {model_name} 載入成功")
+        return model
+    except Exception as e:
+        logging.error(f"載入本地模型失敗: {str(e)}")
+        return None
+
+def load_whisper_model(model_name, device="cuda"):
+    """加載模型，優先使用本地模型庫"""
+    model = load_local_model(model_name, device)
+    if model is not None:
+        return model
+
+    if model_name not in whisper._MODELS:
+        raise ValueError(f"找不到模型 {model_name}：不是官方模型，也沒有已登錄且完好的本地模型檔")
+
+    # 從 whisper 下載快取取得官方模型（必要時下載），登錄後再載入
+    logging.info(f"本地未找到可用的模型 {model_name}，從下載快取取得...")
+    get_model_store().fetch(model_name)
+    model = get_model_store().load(model_name, device=device)
+    if model is None:
+        raise RuntimeError(f"模型 {model_name} 驗證失敗")
+    return model
+
+
+class ModelPool:
+    """
+    依 (模型, 設備) 保存已載入的模型實例，供多個執行緒共用
+
+    Whisper 的解碼器會在模型上掛 kv-cache 鉤子，同一個實例不能同時解碼兩個檔案，
+    因此每次 acquire() 都獨佔一個實例；同一組合最多載入 max_instances 個，
+    超過時等待其他執行緒歸還。
+    """
+
+    def __init__(self, max_instances=1):
+        self.max_instances = max(1, int(max_instances))
+        self._cond = threading.Condition()
+        self._idle = {}
+        self._loaded = {}
+
+    @contextmanager
+    def acquire(self, model_name, device="cuda"):
+        key = (model_name, device)
+        model = None
+        with self._cond:
+            while True:
+                idle = self._idle.setdefault(key, [])
+                if idle:
+                    model = idle.pop()
+                    break
+                if self._loaded.get(key, 0) < self.max_instances:
+                    self._loaded[key] = self._loaded.get(key, 0) + 1
+                    break
+                self._cond.wait()
+
+        if model is None:
+            try:
+                model = load_whisper_model(model_name, device=device)
+            except Exception:
+                with self._cond:
+                    self._loaded[key] -= 1
+                    self._cond.notify_all()
+                raise
+            logging.info(f"模型池已載入 {model_name}@{device}（第 {self._loaded[key]} 個實例）")
+
+        try:
+            yield model
+        finally:
+            with self._cond:
+                self._idle[key].append(model)
+                self._cond.notify_all()
+
+    def clear(self):
+        """釋放所有閒置的模型實例"""
+        with self._cond:
+            for key, idle in self._idle.items():
+                self._loaded[key] -= len(idle)
+                idle.clear()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
@@ -0,0 +1,101 @@
+"""
+依實測吞吐量選擇模型
+
+select_model_size() 只依可用記憶體決定模型上限；這裡再結合音頻長度、
+目前待處理的工作量與各模型/設備的實測即時率，選出在期限內能完成的最大模型。
+"""
+import time
+import logging
+
+from whisper_transcribe import select_model_size
+
+# 由大到小排列的候選模型
+MODEL_ORDER = ["large-v3", "medium", "small", "base", "tiny"]
+
+# 尚無實測資料時使用的保守即時率估計（解碼秒數 / 音頻秒數）
+DEFAULT_RTF = {
+    'cuda': {'large-v3': 0.25, 'medium': 0.15, 'small': 0.08, 'base': 0.04, 'tiny': 0.03},
+    'cpu': {'large-v3': 3.0, 'medium': 1.5, 'small': 0.6, 'base': 0.25, 'tiny': 0.12},
+}
+
+# 仍在佔用轉錄資源的任務狀態
+ACTIVE_STATUSES = ('queued', 'processing')
+
+
+def estimate_rtf(model_name, device, rtf_stats):
+    """回傳 (即時率, 來源)，優先使用實測值"""
+    measured = rtf_stats.get(model_name, device)
+    if measured is not None:
+        return measured, 'measured'
+    return DEFAULT_RTF.get(device, DEFAULT_RTF['cpu']).get(model_name, 1.0), 'default'
+
+
+def estimate_backlog_seconds(tasks, device, rtf_stats, exclude=None):
+    """估算排在前面的任務還需要多少秒才能處理完"""
+    backlog = 0.0
+    for task_id, task in list(tasks.items()):
+        if task_id == exclude or task.get('status') not in ACTIVE_STATUSES:
+            continue
+        if task.get('eta_seconds') is not None and task.get('status') == 'processing':
+            backlog += task['eta_seconds']
+            continue
+        duration = task.get('audio_duration')
+        model_name = task.get('model')
+        if not duration or model_name not in MODEL_ORDER:
+            continue
+        remaining = max(0.0, duration - task.get('decoded_seconds', 0.0))
+        rtf, _ = estimate_rtf(model_name, device, rtf_stats)
+        backlog += remaining * rtf
+    return backlog
+
+
+def choose_model(audio_seconds, deadline_seconds, system_info, device, rtf_stats,
+                 backlog_seconds=0.0, parallelism=1):
+    """
+    選擇在期限內能完成的最大模型
+
+    回傳 (模型名稱, 決策記錄)。若沒有任何模型能在期限內完成，
+    則選擇預估完成時間最短的模型。
+    """
+    if device == 'cpu':
+        system_info = dict(system_info, cuda_available=False)
+    memory_cap = select_model_size(system_info)
+    candidates = MODEL_ORDER[MODEL_ORDER.index(memory_cap):]
+
+    wait_seconds = backlog_seconds / max(1, parallelism)
+    evaluations = []
+    for model_name in candidates:
+        rtf, source = estimate_rtf(model_name, device, rtf_stats)
+        projected = wait_seconds + audio_seconds * rtf
+        evaluations.append({
+            'model': model_name,
+            'rtf': round(rtf, 3),
+            'rtf_source': source,
+            'projected_seconds': round(projected, 1),
+            'meets_deadline': projected <= deadline_seconds
+        })
+
+    chosen = next((e for e in evaluations if e['meets_deadline']), None)
+    if chosen is not None:
+        reason = (f"{chosen['model']} 預估 {chosen['projected_seconds']:.0f} 秒完成"
+                  f"（含排隊 {wait_seconds:.0f} 秒），在期限 {deadline_seconds:.0f} 秒內")
+    else:
+        chosen = min(evaluations, key=lambda e: e['projected_seconds'])
+        reason = (f"沒有模型能在期限 {deadline_seconds:.0f} 秒內完成，"
+                  f"改用預估最快的 {chosen['model']}（{chosen['projected_seconds']:.0f} 秒）")
+    if memory_cap != MODEL_ORDER[0]:
+        reason += f"；可用記憶體僅允許到 {memory_cap}"
+
+    decision = {
+        'model': chosen['model'],
+        'reason': reason,
+        'device': device,
+        'audio_seconds': round(audio_seconds, 1),
+        'deadline_seconds': round(deadline_seconds, 1),
+        'backlog_seconds': round(backlog_seconds, 1),
+        'memory_cap': memory_cap,
+        'candidates': evaluations,
+        'decided_at': time.time()
+    }
+    logging.info(f"自動選擇模型: {reason}")
+    return chosen['model'], decision
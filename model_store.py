@@ -0,0 +1,323 @@
+"""
+本地模型庫
+
+models/ 資料夾中的每個模型檔都登錄在 manifest.json，記錄檔案的 SHA-256、
+大小、修改時間、格式與模型維度（dims）。載入時直接依清單建立對應維度的
+模型並載入權重，不需要先試著載入官方模型；檔案大小或修改時間與清單不符時
+會重新計算雜湊，內容被更動過的檔案不會被載入。
+
+官方模型透過 whisper 的下載快取取得（下載時已依官方雜湊驗證），再以硬連結
+或複製放進 models/，不需要把模型實際載入記憶體再重新儲存。權重一律以
+weights_only 讀取，上傳的檔案即使夾帶其他 Python 物件也不會被執行。
+"""
+import os
+import json
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+from datetime import datetime
+
+import torch
+import whisper
+from whisper.model import ModelDimensions, Whisper
+
+MODELS_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models')
+MANIFEST_FILENAME = 'manifest.json'
+# whisper 預設的下載快取位置
+WHISPER_CACHE = os.path.join(os.getenv("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache")), "whisper")
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def sha256_file(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def official_sha256(model_name):
+    """官方模型的 SHA-256（whisper 的下載網址中即包含雜湊值）"""
+    url = whisper._MODELS.get(model_name)
+    return url.split("/")[-2] if url else None
+
+
+def _load_weights(path):
+    # mmap 讓權重在建立模型時才逐一讀入，不會先把整個檔案複製到記憶體
+    return torch.load(path, map_location='cpu', mmap=True, weights_only=True)
+
+
+def _infer_dims(state_dict):
+    """由僅含 state_dict 的舊格式檔案推算模型維度（whisper 每個注意力頭皆為 64 維）"""
+    conv1 = state_dict["encoder.conv1.weight"]
+    token_embedding = state_dict["decoder.token_embedding.weight"]
+
+    def layers(prefix):
+        return len({key.split(".")[2] for key in state_dict if key.startswith(prefix)})
+
+    return {
+        "n_mels": conv1.shape[1],
+        "n_audio_ctx": state_dict["encoder.positional_embedding"].shape[0],
+        "n_audio_state": conv1.shape[0],
+        "n_audio_head": conv1.shape[0] // 64,
+        "n_audio_layer": layers("encoder.blocks."),
+        "n_vocab": token_embedding.shape[0],
+        "n_text_ctx": state_dict["decoder.positional_embedding"].shape[0],
+        "n_text_state": token_embedding.shape[1],
+        "n_text_head": token_embedding.shape[1] // 64,
+        "n_text_layer": layers("decoder.blocks."),
+    }
+
+
+def read_checkpoint_info(path):
+    """
+    讀取模型檔的格式與維度，回傳 (format, dims)
+
+    format 為 'whisper'（官方格式，含 dims 與 model_state_dict）或 'state_dict'
+    （舊版 download_models.py 儲存的格式）。不是 Whisper 模型時拋出 ValueError。
+    """
+    try:
+        checkpoint = _load_weights(path)
+    except Exception as e:
+        raise ValueError(f"無法以安全模式讀取模型檔: {str(e)}")
+
+    if isinstance(checkpoint, dict) and "dims" in checkpoint and "model_state_dict" in checkpoint:
+        fmt, dims, state_dict = 'whisper', dict(checkpoint["dims"]), checkpoint["model_state_dict"]
+    elif isinstance(checkpoint, dict) and "encoder.conv1.weight" in checkpoint:
+        fmt, state_dict = 'state_dict', checkpoint
+        dims = _infer_dims(state_dict)
+    else:
+        raise ValueError("不是 Whisper 模型檔")
+
+    try:
+        ModelDimensions(**dims)
+    except TypeError as e:
+        raise ValueError(f"模型維度不正確: {str(e)}")
+    if "decoder.token_embedding.weight" not in state_dict:
+        raise ValueError("模型檔缺少解碼器權重")
+    return fmt, {key: int(value) for key, value in dims.items()}
+
+
+class ModelStore:
+    """models/ 資料夾與其清單"""
+
+    def __init__(self, folder=MODELS_FOLDER):
+        self.folder = folder
+        self.manifest_path = os.path.join(folder, MANIFEST_FILENAME)
+        self._lock = threading.RLock()
+        self._manifest = None
+        os.makedirs(folder, exist_ok=True)
+
+    # ---- 清單 ----
+
+    def _entries(self):
+        if self._manifest is None:
+            self._manifest = {}
+            if os.path.exists(self.manifest_path):
+                try:
+                    with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                        self._manifest = json.load(f).get('models', {})
+                except (OSError, ValueError) as e:
+                    logging.warning(f"無法讀取模型清單，將重新建立: {str(e)}")
+        return self._manifest
+
+    def _save(self):
+        fd, tmp_path = tempfile.mkstemp(dir=self.folder, prefix='.manifest-', suffix='.json')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump({'version': 1, 'models': self._manifest}, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+    def entries(self):
+        with self._lock:
+            return {name: dict(entry) for name, entry in self._entries().items()}
+
+    def get(self, model_name):
+        with self._lock:
+            entry = self._entries().get(model_name)
+            return dict(entry) if entry else None
+
+    def path(self, entry):
+        return os.path.join(self.folder, entry['file'])
+
+    # ---- 驗證 ----
+
+    def check(self, model_name, full=False):
+        """
+        確認模型檔與清單相符；大小與修改時間都未變時不重新計算雜湊（full=True 時一律重算）
+        """
+        with self._lock:
+            entry = self._entries().get(model_name)
+            if entry is None:
+                return False
+            path = self.path(entry)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                logging.error(f"模型檔不存在: {path}")
+                return False
+            if stat.st_size != entry['size']:
+                logging.error(f"模型檔大小與清單不符，拒絕載入: {path}")
+                return False
+            if not full and stat.st_mtime == entry['mtime']:
+                return True
+
+            if sha256_file(path) != entry['sha256']:
+                logging.error(f"模型檔雜湊與清單不符，拒絕載入: {path}")
+                return False
+            entry['mtime'] = stat.st_mtime
+            self._save()
+            return True
+
+    # ---- 登錄 ----
+
+    def register(self, model_name, source_path, source='local', model_type='whisper', move=False, sha256=None):
+        """
+        驗證模型檔並登錄到清單，檔案以 models/<模型名稱>.pt 保存
+
+        move=True 時直接移入（上傳的暫存檔），否則優先建立硬連結，無法連結時才複製。
+        sha256 為已知的雜湊值（例如下載時已驗證）時不再重新計算。
+        """
+        fmt, dims = read_checkpoint_info(source_path)
+        filename = f"{model_name}.pt"
+        target_path = os.path.join(self.folder, filename)
+
+        with self._lock:
+            if os.path.abspath(source_path) != os.path.abspath(target_path):
+                sha256 = self._place(source_path, target_path, move, sha256)
+            if sha256 is None:
+                sha256 = sha256_file(target_path)
+
+            stat = os.stat(target_path)
+            entry = {
+                'file': filename,
+                'sha256': sha256,
+                'size': stat.st_size,
+                'mtime': stat.st_mtime,
+                'format': fmt,
+                'dims': dims,
+                'type': model_type,
+                'official': model_name if sha256 == official_sha256(model_name) else None,
+                'source': source,
+                'added': datetime.now().isoformat(timespec='seconds'),
+            }
+            # 重新登錄時保留原本指定的執行設定檔
+            previous = self._entries().get(model_name)
+            if previous and previous.get('profile'):
+                entry['profile'] = previous['profile']
+            self._entries()[model_name] = entry
+            self._save()
+
+        logging.info(f"已登錄模型 {model_name}（{fmt}，{stat.st_size / 1024 / 1024:.0f} MB，sha256 {sha256[:12]}…）")
+        return dict(entry)
+
+    def _place(self, source_path, target_path, move, sha256):
+        """把檔案放進模型資料夾，複製時順便計算雜湊並回傳"""
+        tmp_path = target_path + '.tmp'
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+        if move:
+            os.replace(source_path, target_path)
+            return sha256
+        try:
+            os.link(source_path, tmp_path)
+        except OSError:
+            # 跨磁碟或檔案系統不支援硬連結時複製
+            digest = hashlib.sha256()
+            with open(source_path, 'rb') as src, open(tmp_path, 'wb') as dst:
+                for chunk in iter(lambda: src.read(HASH_CHUNK_SIZE), b''):
+                    digest.update(chunk)
+                    dst.write(chunk)
+            shutil.copystat(source_path, tmp_path)
+            sha256 = digest.hexdigest()
+        os.replace(tmp_path, target_path)
+        return sha256
+
+    def set_profile(self, model_name, profile):
+        """指定模型預設的執行設定檔（見 execution_profiles），None 表示依設備預設"""
+        with self._lock:
+            entry = self._entries().get(model_name)
+            if entry is None:
+                return False
+            if profile:
+                entry['profile'] = profile
+            else:
+                entry.pop('profile', None)
+            self._save()
+            return True
+
+    def remove(self, model_name):
+        with self._lock:
+            entry = self._entries().pop(model_name, None)
+            if entry is None:
+                return False
+            self._save()
+        try:
+            os.remove(self.path(entry))
+        except OSError:
+            pass
+        return True
+
+    def fetch(self, model_name, download_root=WHISPER_CACHE):
+        """
+        取得官方模型並登錄：已登錄且檔案完好時直接回傳，否則由 whisper 下載快取
+        （不存在時下載，並依官方雜湊驗證）連結或複製到模型資料夾
+        """
+        if model_name not in whisper._MODELS:
+            raise ValueError(f"不是官方模型: {model_name}")
+        entry = self.get(model_name)
+        if entry is not None and entry['sha256'] == official_sha256(model_name) and self.check(model_name):
+            return entry
+
+        logging.info(f"取得官方模型 {model_name}...")
+        cached_path = whisper._download(whisper._MODELS[model_name], download_root, in_memory=False)
+        return self.register(model_name, cached_path, source='download', sha256=official_sha256(model_name))
+
+    def scan(self):
+        """登錄資料夾中尚未登錄的 .pt 檔（例如手動複製或舊版程式保存的檔案），回傳新登錄的模型名稱"""
+        added = []
+        known = {entry['file'] for entry in self.entries().values()}
+        for filename in sorted(os.listdir(self.folder)):
+            if not filename.endswith('.pt') or filename in known:
+                continue
+            model_name = filename[:-3]
+            try:
+                self.register(model_name, os.path.join(self.folder, filename), source='scan')
+                added.append(model_name)
+            except ValueError as e:
+                logging.warning(f"略過無法辨識的模型檔 {filename}: {str(e)}")
+        return added
+
+    # ---- 載入 ----
+
+    def load(self, model_name, device="cuda"):
+        """依清單建立模型並載入權重；未登錄或驗證失敗時回傳 None"""
+        entry = self.get(model_name)
+        if entry is None or not self.check(model_name):
+            return None
+
+        checkpoint = _load_weights(self.path(entry))
+        state_dict = checkpoint["model_state_dict"] if entry['format'] == 'whisper' else checkpoint
+        model = Whisper(ModelDimensions(**entry['dims']))
+        model.load_state_dict(state_dict)
+        del checkpoint, state_dict
+
+        # 詞級時間戳使用的注意力頭只適用於未修改的官方權重
+        if entry.get('official') in whisper._ALIGNMENT_HEADS:
+            model.set_alignment_heads(whisper._ALIGNMENT_HEADS[entry['official']])
+        return model.to(device)
+
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+
+def get_model_store():
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            _default_store = ModelStore()
+        return _default_store
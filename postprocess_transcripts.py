@@ -0,0 +1,107 @@
+"""
+既有轉錄的批次文字後處理
+
+對輸出資料夾中已完成的轉錄套用文字後處理（簡繁轉換、詞語表、標點還原），
+以原本存在的格式重新寫出並更新搜尋索引。有 JSON 時以 JSON 為來源（保留詞級
+時間戳與說話者），否則讀取 SRT；只有 TXT 的轉錄沒有時間資訊，會略過。
+
+用法:
+    python postprocess_transcripts.py 轉錄結果 --script s2twp --punctuate --glossary 詞語表.txt
+    python postprocess_transcripts.py 轉錄結果 --script s2twp --dry-run
+"""
+import os
+import sys
+import json
+import time
+import fnmatch
+import logging
+import argparse
+
+from text_postprocess import CONVERSIONS, build_pipeline
+from transcript_index import parse_srt
+from whisper_transcribe import OUTPUT_FORMATS, write_transcripts
+
+DEFAULT_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), '轉錄結果')
+
+
+def find_transcripts(folder, pattern='*'):
+    """回傳 {轉錄名稱: 存在的格式}"""
+    transcripts = {}
+    for filename in sorted(os.listdir(folder)):
+        name, ext = os.path.splitext(filename)
+        fmt = ext[1:].lower()
+        if fmt in OUTPUT_FORMATS and fnmatch.fnmatch(name, pattern):
+            transcripts.setdefault(name, []).append(fmt)
+    return transcripts
+
+
+def load_transcript(folder, name, formats):
+    """讀取轉錄段落，回傳 (模型名稱, 段落列表)；沒有 JSON 或 SRT 時回傳 (None, None)"""
+    if 'json' in formats:
+        with open(os.path.join(folder, f"{name}.json"), 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return data.get('model'), data['segments']
+    if 'srt' in formats:
+        # parse_srt 已把說話者標籤移到 speaker 欄位
+        return parse_srt(os.path.join(folder, f"{name}.srt"))
+    return None, None
+
+
+def postprocess_folder(folder, pipeline, pattern='*', dry_run=False):
+    """處理資料夾中符合 pattern 的轉錄，回傳統計"""
+    stats = {'transcripts': 0, 'changed': 0, 'skipped': 0, 'failed': 0, 'segments': 0, 'changed_segments': 0}
+    started = time.perf_counter()
+    for name, formats in find_transcripts(folder, pattern).items():
+        try:
+            model_name, segments = load_transcript(folder, name, formats)
+            if segments is None:
+                logging.warning(f"{name} 只有 TXT，沒有時間資訊，略過")
+                stats['skipped'] += 1
+                continue
+            processed = list(pipeline(segments))
+            changed = sum(1 for before, after in zip(segments, processed)
+                          if before['text'].strip() != after['text'].strip())
+            stats['transcripts'] += 1
+            stats['segments'] += len(segments)
+            stats['changed_segments'] += changed
+            if changed:
+                stats['changed'] += 1
+                if not dry_run:
+                    write_transcripts(processed, folder, name, model_name or '未知', formats)
+                logging.info(f"{name}: {changed}/{len(segments)} 段有變更" + ("（未寫入）" if dry_run else ""))
+        except Exception as e:
+            logging.error(f"處理 {name} 失敗: {str(e)}")
+            stats['failed'] += 1
+    elapsed = time.perf_counter() - started
+    stats['seconds'] = round(elapsed, 2)
+    stats['segments_per_second'] = round(stats['segments'] / elapsed) if elapsed > 0 else None
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='對既有的轉錄批次套用文字後處理')
+    parser.add_argument('folder', nargs='?', default=DEFAULT_FOLDER, help='轉錄結果資料夾')
+    parser.add_argument('--script', choices=list(CONVERSIONS), help='簡繁轉換')
+    parser.add_argument('--punctuate', action='store_true', help='補上句中與句尾的全形標點')
+    parser.add_argument('--glossary', metavar='PATH', help='詞語表（每行「錯誤寫法=正確寫法」或 JSON 對照表）')
+    parser.add_argument('--pattern', default='*', help='只處理名稱符合的轉錄（例如 訪談_*）')
+    parser.add_argument('--dry-run', action='store_true', help='只統計會變更的段落，不寫入檔案')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s - %(message)s', force=True)
+    try:
+        pipeline = build_pipeline(args.script, args.glossary, args.punctuate)
+    except (OSError, ValueError) as e:
+        parser.error(f"無法讀取詞語表: {str(e)}")
+    if pipeline is None:
+        parser.error("請至少指定 --script、--punctuate 或 --glossary 其中一項")
+
+    stats = postprocess_folder(args.folder, pipeline, args.pattern, args.dry_run)
+    print(f"處理 {stats['transcripts']} 份轉錄（{stats['segments']} 段，{stats['seconds']} 秒，"
+          f"每秒 {stats['segments_per_second'] or 0} 段）：{stats['changed']} 份、{stats['changed_segments']} 段有變更，"
+          f"略過 {stats['skipped']} 份，失敗 {stats['failed']} 份")
+    return 1 if stats['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,153 @@
+"""
+轉錄進度追蹤
+
+把解碼器回報的 seek 位置換算成任務進度百分比，並依照各模型/設備
+實測的即時率 (RTF，解碼耗時 / 音頻長度) 估算剩餘時間。
+"""
+import os
+import json
+import time
+import logging
+import threading
+
+# 可用環境變數 WHISPER_RTF_STATS 指定（例如壓力測試時與正式的統計分開）
+RTF_STATS_FILE = os.environ.get('WHISPER_RTF_STATS') or \
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rtf_stats.json')
+
+
+class RTFStats:
+    """保存每個模型/設備組合的實測即時率（指數移動平均）"""
+
+    def __init__(self, path=RTF_STATS_FILE, smoothing=0.3):
+        self.path = path
+        self.smoothing = smoothing
+        self._lock = threading.Lock()
+        self._data = self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self):
+        tmp_path = self.path + '.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._data, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logging.warning(f"保存即時率統計時發生錯誤: {str(e)}")
+
+    @staticmethod
+    def _key(model_name, device):
+        return f"{model_name}@{device}"
+
+    def get(self, model_name, device):
+        """回傳實測即時率，尚無紀錄時回傳 None"""
+        with self._lock:
+            entry = self._data.get(self._key(model_name, device))
+            return entry['rtf'] if entry else None
+
+    def record(self, model_name, device, audio_seconds, wall_seconds):
+        """加入一次完整轉錄的量測結果"""
+        if audio_seconds < 1 or wall_seconds <= 0:
+            return
+        rtf = wall_seconds / audio_seconds
+        with self._lock:
+            key = self._key(model_name, device)
+            entry = self._data.get(key)
+            if entry:
+                entry['rtf'] = (1 - self.smoothing) * entry['rtf'] + self.smoothing * rtf
+                entry['samples'] += 1
+            else:
+                entry = {'rtf': rtf, 'samples': 1}
+                self._data[key] = entry
+            entry['updated'] = time.time()
+            self._save()
+        logging.info(f"{model_name}@{device} 本次即時率 {rtf:.3f}，平均 {entry['rtf']:.3f}")
+
+    def snapshot(self):
+        with self._lock:
+            return {key: dict(entry) for key, entry in self._data.items()}
+
+
+def format_duration(seconds):
+    """將秒數轉換為易讀的剩餘時間"""
+    seconds = int(round(seconds))
+    if seconds >= 3600:
+        return f"{seconds // 3600} 小時 {seconds % 3600 // 60} 分"
+    if seconds >= 60:
+        return f"{seconds // 60} 分 {seconds % 60} 秒"
+    return f"{seconds} 秒"
+
+
+class ProgressTracker:
+    """接收解碼進度回呼並更新任務記錄中的進度、即時率與預估剩餘時間"""
+
+    # 已解碼音頻達到此秒數後，完全採用本次任務的即時率
+    LIVE_RTF_WARMUP = 60.0
+
+    def __init__(self, task, model_name, device, rtf_stats, start_progress=40, end_progress=95):
+        self.task = task
+        self.model_name = model_name
+        self.device = device
+        self.rtf_stats = rtf_stats
+        self.start_progress = start_progress
+        self.end_progress = end_progress
+        self.started = None
+        self.start_seconds = 0.0
+        self.total_seconds = 0.0
+        self.decoded_seconds = 0.0
+
+    def update(self, decoded_seconds, total_seconds):
+        """解碼器每完成一個窗口後呼叫"""
+        now = time.time()
+        if self.started is None:
+            # 從中斷處恢復時，第一次回報的位置不是 0
+            self.started = now
+            self.start_seconds = decoded_seconds
+        self.total_seconds = total_seconds
+        self.decoded_seconds = decoded_seconds
+
+        fraction = decoded_seconds / total_seconds if total_seconds > 0 else 1.0
+        rtf = self.estimate_rtf(now)
+        remaining = max(0.0, total_seconds - decoded_seconds)
+        eta = remaining * rtf if rtf is not None else None
+
+        self.task['progress'] = int(self.start_progress + (self.end_progress - self.start_progress) * fraction)
+        self.task['audio_duration'] = round(total_seconds, 1)
+        self.task['decoded_seconds'] = round(decoded_seconds, 1)
+        self.task['rtf'] = round(rtf, 3) if rtf is not None else None
+        self.task['eta_seconds'] = int(eta) if eta is not None else None
+
+        message = f'已解碼 {format_duration(decoded_seconds)} / {format_duration(total_seconds)}'
+        if eta is not None:
+            message += f'，預估剩餘 {format_duration(eta)}'
+        self.task['message'] = message
+
+    def estimate_rtf(self, now=None):
+        """綜合歷史即時率與本次任務的即時率"""
+        expected = self.rtf_stats.get(self.model_name, self.device)
+        decoded = self.decoded_seconds - self.start_seconds
+        if self.started is None or decoded <= 0:
+            return expected
+
+        live = ((now or time.time()) - self.started) / decoded
+        if expected is None:
+            return live
+        weight = min(1.0, decoded / self.LIVE_RTF_WARMUP)
+        return weight * live + (1 - weight) * expected
+
+    def finish(self):
+        """轉錄完成後記錄本次的即時率"""
+        if self.started is None:
+            return
+        elapsed = time.time() - self.started
+        decoded = self.total_seconds - self.start_seconds
+        self.rtf_stats.record(self.model_name, self.device, decoded, elapsed)
+        if decoded > 0:
+            self.task['rtf'] = round(elapsed / decoded, 3)
+        self.task['decoded_seconds'] = round(self.total_seconds, 1)
+        self.task['eta_seconds'] = 0
@@ -0,0 +1,151 @@
+"""
+轉錄段落後處理
+
+在寫出字幕之前：
+1. 依 avg_logprob、no_speech_prob 與詞機率丟棄低信心段落（多半是幻覺或靜音）
+2. 套用文字後處理流程（簡繁轉換、詞語表、標點還原，見 text_postprocess）
+3. 把過長的段落依字數與秒數重新切成字幕行
+
+有詞級時間戳時直接依詞的時間切分；沒有時依字數比例在段落的時間範圍內
+內插時間，不需要重新解碼。
+"""
+import logging
+
+from segment_store import SegmentStore
+
+# 優先在這些標點後斷行
+BREAK_PUNCTUATIONS = "。！？；，、.!?;,"
+
+
+def filter_segments(segments, min_avg_logprob=None, max_no_speech_prob=None,
+                    max_compression_ratio=None, min_word_probability=None):
+    """
+    逐一產生保留的段落，丟棄沒有文字或信心不足的段落；門檻為 None 時不檢查該項
+
+    avg_logprob、no_speech_prob、compression_ratio 是整個 30 秒窗口的數值；
+    有詞級時間戳時，min_word_probability 以段落內詞機率的平均值判斷。
+    """
+    dropped = {}
+    for segment in segments:
+        reason = None
+        if not segment["text"].strip():
+            reason = 'empty'
+        elif min_avg_logprob is not None and segment.get("avg_logprob", 0.0) < min_avg_logprob:
+            reason = 'avg_logprob'
+        elif max_no_speech_prob is not None and segment.get("no_speech_prob", 0.0) > max_no_speech_prob:
+            reason = 'no_speech_prob'
+        elif max_compression_ratio is not None and segment.get("compression_ratio", 0.0) > max_compression_ratio:
+            reason = 'compression_ratio'
+        elif min_word_probability is not None and segment.get("words"):
+            probability = sum(w["probability"] for w in segment["words"]) / len(segment["words"])
+            if probability < min_word_probability:
+                reason = 'word_probability'
+
+        if reason is None:
+            yield segment
+        else:
+            dropped[reason] = dropped.get(reason, 0) + 1
+
+    low_confidence = {k: v for k, v in dropped.items() if k != 'empty'}
+    if low_confidence:
+        logging.info(f"丟棄低信心段落: {low_confidence}")
+
+
+def _line(start, end, text, source, words=None):
+    line = {key: value for key, value in source.items() if key not in ("id", "words")}
+    line.update(start=start, end=end, text=text)
+    if words is not None:
+        line["words"] = words
+    return line
+
+
+def _split_words(segment, max_chars, max_seconds):
+    """依詞級時間戳切分段落"""
+    lines = []
+    current = []
+    for word in segment["words"]:
+        if current:
+            text = "".join(w["word"] for w in current + [word]).strip()
+            too_long = max_chars and len(text) > max_chars
+            too_slow = max_seconds and word["end"] - current[0]["start"] > max_seconds
+            if too_long or too_slow:
+                # 盡量在後半段的標點處斷行，讓每行是完整的短句
+                cut = len(current)
+                for i in range(len(current) - 1, len(current) // 2 - 1, -1):
+                    if current[i]["word"].strip()[-1:] in BREAK_PUNCTUATIONS:
+                        cut = i + 1
+                        break
+                lines.append(current[:cut])
+                current = current[cut:]
+        current.append(word)
+    if current:
+        lines.append(current)
+
+    return [
+        _line(words[0]["start"], words[-1]["end"], "".join(w["word"] for w in words).strip(), segment, words)
+        for words in lines
+    ]
+
+
+def _split_text(segment, max_chars, max_seconds):
+    """沒有詞級時間戳時依字數比例內插時間"""
+    text = segment["text"].strip()
+    start, end = segment["start"], segment["end"]
+    duration = max(0.0, end - start)
+
+    # 每行的字數上限：同時滿足字數與秒數限制
+    limit = max_chars or len(text)
+    if max_seconds and duration > max_seconds:
+        limit = min(limit, max(1, int(len(text) * max_seconds / duration)))
+    if len(text) <= limit:
+        return [_line(start, end, text, segment)]
+
+    pieces = []
+    rest = text
+    while len(rest) > limit:
+        cut = limit
+        for i in range(limit, limit // 2, -1):
+            if rest[i - 1] in BREAK_PUNCTUATIONS:
+                cut = i
+                break
+        pieces.append(rest[:cut])
+        rest = rest[cut:]
+    if rest:
+        pieces.append(rest)
+
+    lines = []
+    position = 0
+    for piece in pieces:
+        piece_start = start + duration * position / len(text)
+        position += len(piece)
+        piece_end = start + duration * position / len(text)
+        if piece.strip():
+            lines.append(_line(round(piece_start, 3), round(piece_end, 3), piece.strip(), segment))
+    return lines
+
+
+def resplit_segments(segments, max_chars=0, max_seconds=0.0):
+    """逐一產生字幕行，超過 max_chars 字或 max_seconds 秒的段落切成多行，0 表示不限制"""
+    for segment in segments:
+        if not max_chars and not max_seconds:
+            yield segment
+        elif segment.get("words"):
+            yield from _split_words(segment, max_chars, max_seconds)
+        else:
+            yield from _split_text(segment, max_chars, max_seconds)
+
+
+def postprocess_segments(segments, min_avg_logprob=None, max_no_speech_prob=None,
+                         max_compression_ratio=None, min_word_probability=None,
+                         max_chars=0, max_seconds=0.0, text_pipeline=None):
+    """
+    依序過濾、處理文字與重新切分段落，回傳新的 SegmentStore（不修改原段落）
+
+    段落逐一流過各步驟，不會同時保留整份轉錄的段落 dict。text_pipeline 在切行之前套用，
+    補上的標點可以作為斷行位置。
+    """
+    segments = filter_segments(segments, min_avg_logprob, max_no_speech_prob,
+                               max_compression_ratio, min_word_probability)
+    if text_pipeline is not None:
+        segments = text_pipeline(segments)
+    return SegmentStore.from_segments(resplit_segments(segments, max_chars, max_seconds))
@@ -0,0 +1,139 @@
+"""
+長篇轉錄的精簡段落儲存
+
+數小時的錄音會產生上萬個段落，每個段落若是一個帶有 tokens 列表與多個
+浮點數的 dict，光是 Python 物件的額外開銷就比內容本身大好幾倍，也會增加
+垃圾回收的負擔。SegmentStore 改以欄位陣列保存：
+
+- 文字以 UTF-8 接在同一個緩衝區，另存每段的起始位移
+- 時間與信心分數為 float32 陣列，seek 為 int32 陣列
+- token 與詞級時間戳同樣攤平成陣列加上位移
+- 說話者以編號保存，名稱另存一份對照表
+
+迭代時才暫時組出與 whisper 相同格式的段落 dict，用完即可回收。
+"""
+from array import array
+
+
+class SegmentStore:
+    """以欄位陣列保存轉錄段落，介面上可當作段落 dict 的序列使用"""
+
+    _FLOAT_FIELDS = ('start', 'end', 'temperature', 'avg_logprob', 'compression_ratio', 'no_speech_prob')
+
+    def __init__(self):
+        self._seek = array('i')
+        self._floats = {name: array('f') for name in self._FLOAT_FIELDS}
+        self._text = bytearray()
+        self._text_offsets = array('I', [0])
+        self._tokens = array('I')
+        self._token_offsets = array('I', [0])
+        # 詞級時間戳
+        self._word_offsets = array('I', [0])
+        self._word_text = bytearray()
+        self._word_text_offsets = array('I', [0])
+        self._word_start = array('f')
+        self._word_end = array('f')
+        self._word_probability = array('f')
+        # 說話者編號，-1 表示沒有說話者標籤
+        self._speaker = array('h')
+        self._speaker_names = []
+
+    @classmethod
+    def from_segments(cls, segments):
+        """由段落 dict 的序列建立；已是 SegmentStore 時直接沿用"""
+        if isinstance(segments, cls):
+            return segments
+        store = cls()
+        store.extend(segments)
+        return store
+
+    def append(self, segment):
+        self._seek.append(int(segment.get("seek", 0)))
+        for name in self._FLOAT_FIELDS:
+            self._floats[name].append(segment.get(name, 0.0))
+
+        self._text += segment["text"].encode('utf-8')
+        self._text_offsets.append(len(self._text))
+
+        self._tokens.extend(segment.get("tokens", ()))
+        self._token_offsets.append(len(self._tokens))
+
+        for word in segment.get("words") or ():
+            self._word_text += word["word"].encode('utf-8')
+            self._word_text_offsets.append(len(self._word_text))
+            self._word_start.append(word["start"])
+            self._word_end.append(word["end"])
+            self._word_probability.append(word["probability"])
+        self._word_offsets.append(len(self._word_start))
+
+        speaker = segment.get("speaker")
+        if speaker is None:
+            self._speaker.append(-1)
+        else:
+            if speaker not in self._speaker_names:
+                self._speaker_names.append(speaker)
+            self._speaker.append(self._speaker_names.index(speaker))
+
+    def extend(self, segments):
+        for segment in segments:
+            self.append(segment)
+
+    def __len__(self):
+        return len(self._seek)
+
+    def __bool__(self):
+        return len(self._seek) > 0
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("段落索引超出範圍")
+        return self._segment(index)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self._segment(i)
+
+    def _segment(self, i):
+        floats = self._floats
+        segment = {
+            "id": i,
+            "seek": self._seek[i],
+            "start": round(floats['start'][i], 3),
+            "end": round(floats['end'][i], 3),
+            "text": self._text[self._text_offsets[i]:self._text_offsets[i + 1]].decode('utf-8'),
+            "tokens": self._tokens[self._token_offsets[i]:self._token_offsets[i + 1]].tolist(),
+            "temperature": round(floats['temperature'][i], 2),
+            "avg_logprob": floats['avg_logprob'][i],
+            "compression_ratio": floats['compression_ratio'][i],
+            "no_speech_prob": floats['no_speech_prob'][i],
+        }
+        if self._speaker[i] >= 0:
+            segment["speaker"] = self._speaker_names[self._speaker[i]]
+        first, last = self._word_offsets[i], self._word_offsets[i + 1]
+        if last > first:
+            offsets = self._word_text_offsets
+            segment["words"] = [
+                {
+                    "word": self._word_text[offsets[w]:offsets[w + 1]].decode('utf-8'),
+                    "start": round(self._word_start[w], 3),
+                    "end": round(self._word_end[w], 3),
+                    "probability": self._word_probability[w],
+                }
+                for w in range(first, last)
+            ]
+        return segment
+
+    def text(self):
+        """所有段落文字串接的結果，與 whisper 的 result['text'] 相同"""
+        return self._text.decode('utf-8')
+
+    @property
+    def nbytes(self):
+        """各欄位實際佔用的位元組數"""
+        columns = [self._seek, self._speaker, self._text_offsets, self._tokens, self._token_offsets, self._word_offsets,
+                   self._word_text_offsets, self._word_start, self._word_end, self._word_probability,
+                   *self._floats.values()]
+        return (sum(column.itemsize * len(column) for column in columns)
+                + len(self._text) + len(self._word_text))
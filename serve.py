@@ -0,0 +1,51 @@
+"""
+正式環境的網頁服務入口
+
+以 waitress 取代 Flask 的開發伺服器。連線的讀寫由 waitress 的非同步 I/O 迴圈
+負責：上傳內容在完整接收後才交給請求執行緒，下載檔案也由 I/O 迴圈送出，
+因此慢速的上傳、下載不會佔住請求執行緒，/task/<id> 這類輕量請求不必排在
+後面。轉錄本身在排程器的執行槽（或工作程序）中進行，不佔用請求執行緒。
+
+用法: python serve.py --port 3000 --threads 8
+"""
+import os
+import argparse
+import logging
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="Whisper 語音轉錄網頁服務（正式環境）")
+    parser.add_argument("--host", default=os.environ.get('HOST', '0.0.0.0'), help="監聽位址")
+    parser.add_argument("--port", type=int, default=int(os.environ.get('PORT', 3000)), help="監聽埠號")
+    parser.add_argument("--threads", type=int, default=int(os.environ.get('WHISPER_HTTP_THREADS', 8)),
+                        help="處理請求的執行緒數")
+    parser.add_argument("--connection-limit", type=int, default=200, help="同時連線數上限")
+    parser.add_argument("--channel-timeout", type=int, default=300,
+                        help="閒置連線逾時秒數（大型上傳需要較長時間）")
+    return parser
+
+
+def main(argv=None):
+    args = build_arg_parser().parse_args(argv)
+
+    # 在 main() 內才載入網頁應用：工作程序以 spawn 啟動時會重新匯入此模組，
+    # 不應在子程序中建立 Flask 應用與排程器
+    from waitress import serve
+    from app import app
+
+    logging.info(f"以 waitress 啟動網頁服務: http://{args.host}:{args.port}/，"
+                 f"請求執行緒 {args.threads} 個，轉錄模式 {app.config['WORKER_MODE']}")
+    serve(
+        app,
+        host=args.host,
+        port=args.port,
+        threads=args.threads,
+        connection_limit=args.connection_limit,
+        channel_timeout=args.channel_timeout,
+        max_request_body_size=app.config['MAX_CONTENT_LENGTH'],
+        ident='whisper-web'
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,221 @@
+"""
+推測解碼（assisted decoding）
+
+由常駐的小模型（draft）以貪婪解碼先猜出數個 token，再讓選定的大模型（target）
+一次前向運算同時驗證這些 token：大模型在每個位置的貪婪選擇與草稿相同就接受，
+第一個不同處改用大模型的選擇。輸出與大模型單獨貪婪解碼相同，但大模型的
+解碼器前向次數大幅減少，在 CPU 上特別明顯。
+
+只適用於溫度 0 且未使用 beam search 的解碼；兩個模型必須使用相同的詞彙表與
+梅爾頻帶數（例如 medium/small 搭配 tiny/base；large-v3 使用 128 個頻帶與不同的
+詞彙表，無法搭配其他模型）。
+"""
+import logging
+
+import torch
+import torch.nn.functional as F
+from whisper.decoding import DecodingTask, DecodingResult
+from whisper.utils import compression_ratio
+
+# 每輪由小模型猜測的 token 數
+DEFAULT_DRAFT_TOKENS = 4
+
+
+def is_compatible(model, draft_model):
+    """兩個模型能否搭配推測解碼"""
+    return (draft_model is not None
+            and draft_model is not model
+            and model.dims.n_vocab == draft_model.dims.n_vocab
+            and model.dims.n_mels == draft_model.dims.n_mels
+            and model.device == draft_model.device)
+
+
+def supports_options(options):
+    """推測解碼只對應貪婪解碼"""
+    return options.temperature == 0 and not options.beam_size and not options.best_of
+
+
+class _Decoder:
+    """
+    包裝一個模型的解碼器與 kv-cache
+
+    whisper 的 TextDecoder 在有快取時只能一次處理一個 token（注意力遮罩只取
+    左上角），這裡自行計算自注意力，讓多個 token 可以在已有快取之後一次前向；
+    自注意力快取也可以截斷，丟棄被拒絕的草稿 token。
+    """
+
+    def __init__(self, model, audio_features):
+        self.model = model
+        self.decoder = model.decoder
+        self.audio_features = audio_features
+        self.kv_cache, self.hooks = model.install_kv_cache_hooks()
+        self.self_attn_modules = [m for block in self.decoder.blocks for m in (block.attn.key, block.attn.value)]
+
+    @property
+    def length(self):
+        module = self.self_attn_modules[0]
+        return self.kv_cache[module].shape[1] if module in self.kv_cache else 0
+
+    def truncate(self, length):
+        for module in self.self_attn_modules:
+            if module in self.kv_cache and self.kv_cache[module].shape[1] > length:
+                self.kv_cache[module] = self.kv_cache[module][:, :length]
+
+    def forward(self, tokens):
+        """輸入接在快取之後的 token（形狀 [1, n]），回傳每個位置的 logits [n, n_vocab]"""
+        offset = self.length
+        n = tokens.shape[-1]
+        xa = self.audio_features
+        x = self.decoder.token_embedding(tokens) + self.decoder.positional_embedding[offset:offset + n]
+        x = x.to(xa.dtype)
+
+        # 第 i 個查詢只能看到快取與自己之前（含）的 token
+        mask = torch.full((n, offset + n), float("-inf"), device=x.device).triu_(offset + 1)
+
+        for block in self.decoder.blocks:
+            x = x + self._self_attention(block.attn, block.attn_ln(x), mask)
+            if block.cross_attn:
+                x = x + block.cross_attn(block.cross_attn_ln(x), xa, kv_cache=self.kv_cache)[0]
+            x = x + block.mlp(block.mlp_ln(x))
+
+        x = self.decoder.ln(x)
+        logits = (x @ torch.transpose(self.decoder.token_embedding.weight.to(x.dtype), 0, 1)).float()
+        return logits[0]
+
+    @staticmethod
+    def _self_attention(attn, x, mask):
+        q = attn.query(x)
+        # key/value 的 forward hook 會把新的結果接在快取之後並回傳完整序列
+        k = attn.key(x)
+        v = attn.value(x)
+
+        n_batch, n_ctx, n_state = q.shape
+        scale = (n_state // attn.n_head) ** -0.25
+        q = q.view(*q.shape[:2], attn.n_head, -1).permute(0, 2, 1, 3) * scale
+        k = k.view(*k.shape[:2], attn.n_head, -1).permute(0, 2, 3, 1) * scale
+        v = v.view(*v.shape[:2], attn.n_head, -1).permute(0, 2, 1, 3)
+
+        qk = (q @ k).float() + mask
+        w = F.softmax(qk, dim=-1).to(q.dtype)
+        return attn.out((w @ v).permute(0, 2, 1, 3).flatten(start_dim=2))
+
+    def close(self):
+        for hook in self.hooks:
+            hook.remove()
+        self.kv_cache.clear()
+
+
+@torch.no_grad()
+def decode(model, draft_model, mel, options, draft_tokens=DEFAULT_DRAFT_TOKENS, stats=None,
+           audio_features=None):
+    """
+    以推測解碼取代 model.decode(mel, options)，回傳單一 DecodingResult
+
+    stats 若為 dict，會累加 drafted/accepted/target_forwards 供觀察接受率。
+    audio_features 為已計算好的大模型編碼器輸出時不再重新編碼。
+    """
+    single = mel.ndim == 2
+    if single:
+        mel = mel.unsqueeze(0)
+
+    task = DecodingTask(model, options)
+    tokenizer = task.tokenizer
+    eot = tokenizer.eot
+
+    if audio_features is None:
+        audio_features = task._get_audio_features(mel)
+    draft_features = draft_model.encoder(mel.to(audio_features.dtype))
+
+    tokens = list(task.initial_tokens)
+    initial_length = len(tokens)
+    sum_logprob = 0.0
+    counters = {'drafted': 0, 'accepted': 0, 'target_forwards': 0}
+
+    def pick(row, prefix):
+        # 與 GreedyDecoder 相同：先套用 logit 過濾器，再取最大值與其對數機率
+        logits = row.unsqueeze(0).clone()
+        prefix_tensor = torch.tensor([prefix], device=logits.device)
+        for logit_filter in task.logit_filters:
+            logit_filter.apply(logits, prefix_tensor)
+        token = int(logits.argmax(dim=-1))
+        logprob = float(F.log_softmax(logits.float(), dim=-1)[0, token])
+        return token, logprob
+
+    def finished():
+        return tokens[-1] == eot or len(tokens) > task.n_ctx or len(tokens) - initial_length >= task.sample_len
+
+    target = _Decoder(model, audio_features)
+    draft = _Decoder(draft_model, draft_features)
+    try:
+        logits = target.forward(torch.tensor([tokens], device=mel.device))
+        counters['target_forwards'] += 1
+        no_speech_prob = float('nan')
+        if tokenizer.no_speech is not None:
+            no_speech_prob = float(logits[task.sot_index].softmax(dim=-1)[tokenizer.no_speech])
+        next_token, next_logprob = pick(logits[-1], tokens)
+
+        while True:
+            tokens.append(next_token)
+            sum_logprob += next_logprob
+            if finished():
+                break
+
+            # 小模型補上尚未進入快取的 token 後，貪婪猜測後續 token
+            budget = min(draft_tokens, task.sample_len - (len(tokens) - initial_length), task.n_ctx - len(tokens))
+            proposal = []
+            pending = tokens[draft.length:]
+            while len(proposal) < budget:
+                row = draft.forward(torch.tensor([pending], device=mel.device))[-1]
+                token, _ = pick(row, tokens + proposal)
+                proposal.append(token)
+                if token == eot:
+                    break
+                pending = [token]
+            counters['drafted'] += len(proposal)
+
+            # 大模型一次驗證：最新接受的 token 加上所有草稿
+            rows = target.forward(torch.tensor([[tokens[-1]] + proposal], device=mel.device))
+            counters['target_forwards'] += 1
+            for i, row in enumerate(rows):
+                token, logprob = pick(row, tokens)
+                if i < len(proposal) and token == proposal[i]:
+                    tokens.append(token)
+                    sum_logprob += logprob
+                    counters['accepted'] += 1
+                    if finished():
+                        break
+                    continue
+                next_token, next_logprob = token, logprob
+                break
+
+            # 丟棄被拒絕草稿的自注意力快取
+            target.truncate(len(tokens))
+            draft.truncate(len(tokens))
+            if finished():
+                break
+    finally:
+        target.close()
+        draft.close()
+
+    if stats is not None:
+        for key, value in counters.items():
+            stats[key] = stats.get(key, 0) + value
+
+    # 與 DecodingTask.run() 相同的收尾：截到第一個 EOT 並計算平均對數機率
+    text_tokens = tokens[task.sample_begin:]
+    if eot in text_tokens:
+        text_tokens = text_tokens[:text_tokens.index(eot)]
+    text = tokenizer.decode(text_tokens).strip()
+    result = DecodingResult(
+        audio_features=audio_features[0],
+        language=options.language,
+        tokens=text_tokens,
+        text=text,
+        avg_logprob=sum_logprob / (len(text_tokens) + 1),
+        no_speech_prob=no_speech_prob,
+        temperature=options.temperature,
+        compression_ratio=compression_ratio(text),
+    )
+    logging.debug(f"推測解碼: 草稿 {counters['drafted']} 個 token，接受 {counters['accepted']} 個，"
+                  f"大模型前向 {counters['target_forwards']} 次")
+    return result if single else [result]
@@ -87,7 +87,10 @@ function configureDropzone(dz) {
         formData.append("timestamp", new Date().getTime());
         formData.append("force_model", "true");  // 強制使用選定的模型
         
-        // 驗證當前模型
+        // 驗證當前模型（自動模式由伺服器在處理時決定模型）
+        if (modelName === 'auto') {
+            return;
+        }
         try {
             const verifyResponse = await fetch('/update_model', {
                 method: 'POST',
@@ -148,6 +151,15 @@ function configureDropzone(dz) {
 
 // 設置事件監聽器
 function setupEventListeners() {
+    // 全文檢索
+    const searchForm = document.getElementById('searchForm');
+    if (searchForm) {
+        searchForm.addEventListener('submit', function(event) {
+            event.preventDefault();
+            searchTranscripts(document.getElementById('searchInput').value);
+        });
+    }
+
     // 選擇模型下拉選單
     const modelSelect = document.getElementById('modelSelect');
     if (modelSelect) {
@@ -195,6 +207,17 @@ function setupEventListeners() {
         console.log("按鈕被點擊，但功能已被移除");
     });
     
+    // 任務控制按鈕（取消、暫停、繼續）
+    const tasksContent = document.getElementById('tasksContent');
+    if (tasksContent) {
+        tasksContent.addEventListener('click', function(event) {
+            const button = event.target.closest('[data-task-action]');
+            if (button) {
+                controlTask(button.dataset.taskId, button.dataset.taskAction);
+            }
+        });
+    }
+    
     // 定期更新任務狀態
     if (!taskCheckInterval) {
         taskCheckInterval = setInterval(updateTasksStatus, 2000);
@@ -326,7 +349,7 @@ function updateTasksStatus() {
             
             // 檢查是否所有任務都已完成
             const allCompleted = Object.values(currentTasks).every(task => 
-                task.status === 'completed' || task.status === 'error'
+                task.status === 'completed' || task.status === 'error' || task.status === 'cancelled'
             );
             
             if (allCompleted && Object.keys(currentTasks).length > 0) {
@@ -338,6 +361,22 @@ function updateTasksStatus() {
         });
 }
 
+// 發送任務控制請求
+function controlTask(taskId, action) {
+    fetch(`/task/${encodeURIComponent(taskId)}/${action}`, { method: 'POST' })
+        .then(response => response.json())
+        .then(data => {
+            if (data.error) {
+                showToast("錯誤", data.error, "error");
+            }
+            startTaskStatusChecking();
+            updateTasksStatus();
+        })
+        .catch(error => {
+            console.error("任務控制請求錯誤:", error);
+        });
+}
+
 // 顯示任務容器
 function showTasksContainer() {
     document.getElementById('tasksContainer').style.display = 'block';
@@ -378,6 +417,14 @@ function renderTasks() {
                 statusText = '排隊中';
                 statusBadgeClass = 'bg-warning';
                 break;
+            case 'paused':
+                statusText = '已暫停';
+                statusBadgeClass = 'bg-info';
+                break;
+            case 'cancelled':
+                statusText = '已取消';
+                statusBadgeClass = 'bg-secondary';
+                break;
             default:
                 statusText = task.status;
                 statusBadgeClass = 'bg-secondary';
@@ -396,10 +443,50 @@ function renderTasks() {
                         <div class="progress-bar" role="progressbar" style="width: ${task.progress || 0}%" 
                              aria-valuenow="${task.progress || 0}" aria-valuemin="0" aria-valuemax="100"></div>
                     </div>
+        `;
+        
+        // 顯示解碼進度與預估剩餘時間
+        if (task.status === 'processing' && task.audio_duration) {
+            cardBody += `
+                    <p class="card-text"><small class="text-muted">
+                        已解碼 ${Math.round(task.decoded_seconds || 0)} / ${Math.round(task.audio_duration)} 秒
+                        ${task.eta_seconds != null ? `，預估剩餘 ${formatDuration(task.eta_seconds)}` : ''}
+                    </small></p>
+            `;
+        }
+        
+        cardBody += `
                     <div class="d-flex justify-content-between align-items-center">
-                        <small class="text-muted">模型: ${task.model || 'small'}</small>
+                        <small class="text-muted" title="${task.model_decision ? task.model_decision.reason : ''}">
+                            模型: ${task.model || 'small'}${task.model_decision ? '（自動）' : ''}
+                        </small>
         `;
         
+        // 添加任務控制按鈕
+        if (task.status === 'processing' || task.status === 'queued') {
+            cardBody += `
+                        <div>
+                            <button class="btn btn-sm btn-outline-warning" data-task-action="pause" data-task-id="${task.id}">
+                                <i class="fas fa-pause me-1"></i>暫停
+                            </button>
+                            <button class="btn btn-sm btn-outline-danger" data-task-action="cancel" data-task-id="${task.id}">
+                                <i class="fas fa-times me-1"></i>取消
+                            </button>
+                        </div>
+            `;
+        } else if (task.status === 'paused') {
+            cardBody += `
+                        <div>
+                            <button class="btn btn-sm btn-outline-success" data-task-action="resume" data-task-id="${task.id}">
+                                <i class="fas fa-play me-1"></i>繼續
+                            </button>
+                            <button class="btn btn-sm btn-outline-danger" data-task-action="cancel" data-task-id="${task.id}">
+                                <i class="fas fa-times me-1"></i>取消
+                            </button>
+                        </div>
+            `;
+        }
+        
         // 添加下載按鈕（如果任務已完成）
         if (task.status === 'completed' && task.output_files) {
             cardBody += `
@@ -410,6 +497,9 @@ function renderTasks() {
                             <a href="/download/${task.output_files.srt}" class="btn btn-sm btn-outline-info">
                                 <i class="fas fa-closed-captioning me-1"></i>SRT
                             </a>
+                            ${task.batch_id ? `<a href="/batch/${encodeURIComponent(task.batch_id)}/download" class="btn btn-sm btn-outline-secondary">
+                                <i class="fas fa-file-archive me-1"></i>整批 ZIP
+                            </a>` : ''}
                         </div>
             `;
         }
@@ -430,6 +520,77 @@ function renderTasks() {
     }
 }
 
+// 將秒數格式化為易讀的時間
+function formatDuration(seconds) {
+    seconds = Math.round(seconds);
+    if (seconds >= 3600) {
+        return `${Math.floor(seconds / 3600)} 小時 ${Math.floor((seconds % 3600) / 60)} 分`;
+    }
+    if (seconds >= 60) {
+        return `${Math.floor(seconds / 60)} 分 ${seconds % 60} 秒`;
+    }
+    return `${seconds} 秒`;
+}
+
+// 轉義 HTML 特殊字元
+function escapeHtml(text) {
+    const div = document.createElement('div');
+    div.textContent = text;
+    return div.innerHTML;
+}
+
+// 搜尋所有轉錄結果並列出命中的段落
+async function searchTranscripts(query) {
+    const container = document.getElementById('searchResults');
+    query = query.trim();
+    if (!query) {
+        container.innerHTML = '';
+        return;
+    }
+
+    try {
+        const response = await fetch(`/search?q=${encodeURIComponent(query)}&limit=50`);
+        const data = await response.json();
+        if (!response.ok) {
+            container.innerHTML = `<p class="text-danger">${escapeHtml(data.error || '搜尋失敗')}</p>`;
+            return;
+        }
+        if (data.total === 0) {
+            container.innerHTML = '<p class="text-muted">找不到符合的段落</p>';
+            return;
+        }
+
+        const items = data.results.map(item => {
+            let snippet = escapeHtml(item.snippet);
+            if (item.match) {
+                const [begin, end] = item.match;
+                snippet = escapeHtml(item.snippet.slice(0, begin)) +
+                    `<mark>${escapeHtml(item.snippet.slice(begin, end))}</mark>` +
+                    escapeHtml(item.snippet.slice(end));
+            }
+            return `<a href="${item.download}" class="list-group-item list-group-item-action">
+                <div class="d-flex justify-content-between">
+                    <strong>${escapeHtml(item.file)}</strong>
+                    <small class="text-muted">${formatTimestamp(item.start)} - ${formatTimestamp(item.end)}</small>
+                </div>
+                <div>${snippet}</div>
+            </a>`;
+        }).join('');
+        container.innerHTML = `<p class="text-muted small mb-2">共 ${data.total} 個段落（${data.elapsed_ms} 毫秒）</p>
+            <div class="list-group">${items}</div>`;
+    } catch (error) {
+        console.error('搜尋失敗:', error);
+        container.innerHTML = '<p class="text-danger">搜尋失敗</p>';
+    }
+}
+
+// 將秒數格式化為 時:分:秒
+function formatTimestamp(seconds) {
+    seconds = Math.floor(seconds || 0);
+    const pad = n => String(n).padStart(2, '0');
+    return `${pad(Math.floor(seconds / 3600))}:${pad(Math.floor((seconds % 3600) / 60))}:${pad(seconds % 60)}`;
+}
+
 // 顯示提示消息
 function showToast(title, message, type = "info") {
     // 使用Bootstrap的toast功能，或者可以自行實現
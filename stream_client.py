@@ -0,0 +1,110 @@
+"""
+串流轉錄測試客戶端
+
+以 ffmpeg 把任何音頻檔解碼成 16 kHz 單聲道 PCM，依實際播放速度分塊送到
+/stream/<id>/audio，模擬麥克風即時錄音；過程中顯示暫定文字與定稿段落，
+結束後印出輸出檔案與暫定文字的延遲統計。
+
+用法:
+    python serve.py                # 另開一個終端機啟動服務
+    python stream_client.py 訪談記錄/sample.wav --model base --chunk-seconds 0.5
+"""
+import sys
+import time
+import argparse
+import subprocess
+
+import requests
+
+SAMPLE_RATE = 16000
+BYTES_PER_SECOND = SAMPLE_RATE * 2
+
+
+def pcm_chunks(audio_path, chunk_seconds):
+    """以 ffmpeg 解碼並逐塊產生 s16le PCM"""
+    process = subprocess.Popen(
+        ['ffmpeg', '-nostdin', '-loglevel', 'error', '-i', audio_path,
+         '-f', 's16le', '-ac', '1', '-ar', str(SAMPLE_RATE), '-'],
+        stdout=subprocess.PIPE
+    )
+    chunk_bytes = int(chunk_seconds * BYTES_PER_SECOND)
+    chunk_bytes -= chunk_bytes % 2
+    try:
+        while True:
+            chunk = process.stdout.read(chunk_bytes)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        process.stdout.close()
+        process.wait()
+
+
+def print_segments(segments):
+    for segment in segments:
+        # 先清掉同一行的暫定文字
+        print(f"\r\033[K[{segment['timestamp']}] {segment['text'].strip()}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='以實際播放速度串流音頻檔測試即時轉錄')
+    parser.add_argument('audio', help='音頻檔路徑')
+    parser.add_argument('--url', default='http://127.0.0.1:5000', help='服務網址')
+    parser.add_argument('--model', help='模型（預設使用服務的 WHISPER_STREAM_MODEL）')
+    parser.add_argument('--language', default='zh', help='語言')
+    parser.add_argument('--name', default='live', help='輸出檔名前綴')
+    parser.add_argument('--chunk-seconds', type=float, default=0.5, help='每次送出的音頻秒數')
+    parser.add_argument('--speed', type=float, default=1.0, help='播放速度倍數（1 為即時）')
+    args = parser.parse_args(argv)
+
+    base_url = args.url.rstrip('/')
+    session = requests.Session()
+    options = {'language': args.language, 'name': args.name}
+    if args.model:
+        options['model'] = args.model
+    response = session.post(f"{base_url}/stream", json=options)
+    response.raise_for_status()
+    stream_id = response.json()['stream_id']
+    print(f"串流 {stream_id} 已開始")
+
+    received = 0
+    started = time.perf_counter()
+    sent_seconds = 0.0
+    for chunk in pcm_chunks(args.audio, args.chunk_seconds):
+        # 依播放速度等待，模擬即時錄音
+        sent_seconds += len(chunk) / BYTES_PER_SECOND
+        delay = started + sent_seconds / args.speed - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+
+        response = session.post(f"{base_url}/stream/{stream_id}/audio", params={'since': received}, data=chunk,
+                                headers={'Content-Type': 'application/octet-stream'})
+        response.raise_for_status()
+        status = response.json()
+        print_segments(status['segments'])
+        received = status['segment_count']
+        if status['partial']:
+            print(f"\r\033[K… {status['partial'][-60:]}", end='', flush=True)
+
+    print("\r\033[K錄音結束，等待剩餘音頻轉錄...")
+    stop_started = time.perf_counter()
+    response = session.post(f"{base_url}/stream/{stream_id}/stop", params={'since': received})
+    response.raise_for_status()
+    status = response.json()
+    print_segments(status['segments'])
+
+    print("=" * 50)
+    print(f"音頻長度: {status['received_seconds']:.1f} 秒，結束後等待 {time.perf_counter() - stop_started:.1f} 秒")
+    latency = status['latency']
+    if latency['p50'] is not None:
+        print(f"暫定文字延遲: p50 {latency['p50']:.2f} 秒  p90 {latency['p90']:.2f} 秒  最大 {latency['max']:.2f} 秒")
+    if status['status'] != 'completed':
+        print(f"串流未正常結束: {status['status']} {status.get('error') or ''}")
+        return 1
+    for fmt, filename in (status['output_files'] or {}).items():
+        print(f"{fmt}: {base_url}/download/{filename}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
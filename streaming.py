@@ -0,0 +1,209 @@
+"""
+即時串流轉錄
+
+客戶端持續送入 16 kHz 單聲道 16-bit PCM，每個串流工作階段由一個背景執行緒
+以滾動窗口解碼：
+
+1. 每累積 step_seconds 的新音頻，就對尚未定稿的音頻（最多約 20 秒）重新轉錄一次，
+   結果作為暫定文字（partial）
+2. 除了最後一段（可能在句子中間被截斷）之外，連續兩次轉錄結果相同的段落視為
+   穩定，定稿後從緩衝區移除對應的音頻，之後只需重新轉錄較短的尾段
+3. 緩衝區超過 max_buffer_seconds 時不等待結果一致，直接定稿最後一段之前的段落，
+   讓每次轉錄的長度有上限
+4. 結束時把剩下的音頻全部轉錄並定稿
+
+模型由 ModelPool 提供並常駐，多個工作階段輪流使用同一個實例。
+"""
+import re
+import time
+import logging
+import threading
+from collections import deque
+
+import numpy as np
+
+from segment_store import SegmentStore
+
+SAMPLE_RATE = 16000
+# 傳給下一次轉錄作為提示的已定稿文字長度
+PROMPT_CHARS = 200
+
+
+def _normalize(text):
+    return re.sub(r'\s+', '', text)
+
+
+class StreamSession:
+    """單一串流工作階段"""
+
+    def __init__(self, stream_id, model_pool, model_name, device="cuda", language="zh",
+                 step_seconds=1.0, max_buffer_seconds=20.0, idle_timeout=60.0, on_finish=None):
+        self.id = stream_id
+        self.model_pool = model_pool
+        self.model_name = model_name
+        self.device = device
+        self.language = language
+        self.step_samples = int(step_seconds * SAMPLE_RATE)
+        self.max_buffer_samples = int(max_buffer_seconds * SAMPLE_RATE)
+        self.idle_timeout = idle_timeout
+        self.on_finish = on_finish
+
+        self.status = 'streaming'
+        self.error = None
+        self.output_files = None
+        self.segments = SegmentStore()
+        self.partial = ''
+        self.started_at = time.time()
+
+        self._cond = threading.Condition()
+        self._audio = np.zeros(0, dtype=np.float32)  # 尚未定稿的音頻
+        self._offset = 0.0  # 緩衝區開頭在整段錄音中的秒數
+        self._decoded = 0  # 上次轉錄時緩衝區的樣本數
+        self._received = 0  # 收到的總樣本數
+        self._remainder = b''  # 不足一個樣本的位元組
+        self._last_arrival = time.time()
+        self._stopping = False
+        self._previous = []  # 上一次轉錄的未定稿段落
+        self._latencies = deque(maxlen=500)
+        self._done = threading.Event()
+
+        self._thread = threading.Thread(target=self._run, name=f"stream-{stream_id}", daemon=True)
+        self._thread.start()
+
+    # ---- 由請求執行緒呼叫 ----
+
+    def feed(self, data):
+        """加入一段 s16le PCM 位元組"""
+        with self._cond:
+            if self._stopping:
+                raise RuntimeError("串流已結束")
+            data = self._remainder + data
+            usable = len(data) - len(data) % 2
+            self._remainder = data[usable:]
+            samples = np.frombuffer(data[:usable], dtype=np.int16).astype(np.float32) / 32768.0
+            self._audio = np.concatenate([self._audio, samples])
+            self._received += len(samples)
+            self._last_arrival = time.time()
+            self._cond.notify_all()
+
+    def stop(self, timeout=None):
+        """停止接收音頻，等待剩餘音頻轉錄完成"""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        return self._done.wait(timeout)
+
+    def snapshot(self, since=0):
+        """目前狀態；segments 只包含第 since 個之後的已定稿段落"""
+        with self._cond:
+            latencies = sorted(self._latencies)
+            segments = [self.segments[i] for i in range(max(0, since), len(self.segments))]
+            return {
+                'id': self.id,
+                'status': self.status,
+                'error': self.error,
+                'model': self.model_name,
+                'language': self.language,
+                'received_seconds': round(self._received / SAMPLE_RATE, 2),
+                'finalized_seconds': round(self._offset, 2),
+                'partial': self.partial,
+                'segment_count': len(self.segments),
+                'segments': [{'start': s['start'], 'end': s['end'], 'text': s['text']} for s in segments],
+                'latency': {
+                    'p50': round(latencies[len(latencies) // 2], 3) if latencies else None,
+                    'p90': round(latencies[int(len(latencies) * 0.9)], 3) if latencies else None,
+                    'max': round(latencies[-1], 3) if latencies else None,
+                },
+                'output_files': self.output_files,
+            }
+
+    # ---- 背景解碼 ----
+
+    def _run(self):
+        try:
+            while True:
+                with self._cond:
+                    while not self._stopping and len(self._audio) - self._decoded < self.step_samples:
+                        if time.time() - self._last_arrival > self.idle_timeout:
+                            logging.info(f"串流 {self.id} 超過 {self.idle_timeout:.0f} 秒沒有新音頻，自動結束")
+                            self._stopping = True
+                            break
+                        self._cond.wait(timeout=1.0)
+                    stopping = self._stopping
+                    audio = self._audio
+                    arrived = self._last_arrival
+                    self._decoded = len(audio)
+
+                if stopping:
+                    self.status = 'finalizing'
+                    if len(audio):
+                        self._step(audio, arrived, final=True)
+                    break
+                self._step(audio, arrived)
+
+            self.partial = ''
+            if self.on_finish is not None:
+                self.on_finish(self)
+            self.status = 'completed'
+        except Exception as e:
+            logging.error(f"串流 {self.id} 轉錄失敗: {str(e)}", exc_info=True)
+            self.status = 'error'
+            self.error = str(e)
+        finally:
+            self._done.set()
+
+    def _transcribe(self, audio):
+        prompt = self.segments.text()[-PROMPT_CHARS:] if self.segments else None
+        with self.model_pool.acquire(self.model_name, self.device) as model:
+            result = model.transcribe(
+                audio,
+                language=self.language,
+                temperature=0.0,
+                condition_on_previous_text=False,
+                initial_prompt=prompt,
+                fp16=self.device == "cuda",
+                verbose=None,
+            )
+        segments = [s for s in result["segments"] if s["text"].strip()]
+        if self.language is None and segments:
+            # 未指定語言時沿用第一次偵測到的語言，避免每次重新轉錄時語言跳動
+            self.language = result["language"]
+            logging.info(f"串流 {self.id} 偵測到的語言: {self.language}")
+        return segments
+
+    def _step(self, audio, arrived, final=False):
+        segments = self._transcribe(audio)
+        self._latencies.append(time.time() - arrived)
+
+        if final:
+            commit = len(segments)
+        else:
+            # 最後一段之前、且與上一次結果一致的段落才定稿
+            commit = 0
+            for i, segment in enumerate(segments[:-1]):
+                if i >= len(self._previous) or _normalize(segment["text"]) != _normalize(self._previous[i]["text"]):
+                    break
+                commit = i + 1
+            if len(audio) > self.max_buffer_samples:
+                commit = max(commit, len(segments) - 1)
+            # 一整段說不停時也不能讓緩衝區超過一個 30 秒窗口
+            if len(audio) > self.max_buffer_samples * 1.4:
+                commit = len(segments)
+
+        cut = 0
+        if commit:
+            cut = min(len(audio), int(segments[commit - 1]["end"] * SAMPLE_RATE))
+        elif not segments and len(audio) > self.max_buffer_samples:
+            # 長時間靜音：只保留最後一步的音頻
+            cut = len(audio) - self.step_samples
+
+        with self._cond:
+            for segment in segments[:commit]:
+                self.segments.append(dict(segment, start=self._offset + segment["start"],
+                                          end=self._offset + segment["end"], seek=0))
+            if cut:
+                self._audio = self._audio[cut:]
+                self._decoded = max(0, self._decoded - cut)
+                self._offset += cut / SAMPLE_RATE
+            self._previous = segments[commit:]
+            self.partial = "".join(s["text"] for s in segments[commit:]).strip()
@@ -0,0 +1,133 @@
+"""
+壓力測試用的模型後端
+
+WHISPER_BACKEND=stub 時取代 whisper 模型：不載入權重、不做推論，每個 30 秒窗口
+依音頻長度乘上固定的每秒延遲等待，並以音頻內容決定的固定文字產生段落。
+進度回報、on_window 檢查點、停止請求與 resume_state 都與 decode_engine 相同，
+排程、准入控制、檢查點與後處理照常運作，可以在沒有 GPU 的機器上重現負載。
+"""
+import time
+import wave
+import random
+import hashlib
+
+import ffmpeg
+
+from decode_engine import DecodeInterrupted
+from segment_store import SegmentStore
+
+SAMPLE_RATE = 16000
+FRAMES_PER_SECOND = 100
+WINDOW_FRAMES = 30 * FRAMES_PER_SECOND
+
+# 每秒音頻的模擬解碼秒數，與載入模型的秒數
+SECONDS_PER_AUDIO_SECOND = 0.05
+LOAD_SECONDS = 0.0
+
+WORDS = ['我們', '今天', '討論', '這個', '計畫', '的', '進度', '然後', '下一步', '需要', '確認', '時間']
+
+
+def configure(seconds_per_audio_second=None, load_seconds=None):
+    global SECONDS_PER_AUDIO_SECOND, LOAD_SECONDS
+    if seconds_per_audio_second is not None:
+        SECONDS_PER_AUDIO_SECOND = seconds_per_audio_second
+    if load_seconds is not None:
+        LOAD_SECONDS = load_seconds
+
+
+class StubModel:
+    """只記錄名稱與設備的假模型"""
+
+    is_multilingual = True
+
+    def __init__(self, name, device):
+        self.name = name
+        self.device = device
+
+
+def load_model(model_name, device="cuda"):
+    time.sleep(LOAD_SECONDS)
+    return StubModel(model_name, device)
+
+
+def _describe(audio):
+    """回傳 (音頻秒數, 決定輸出文字的種子)"""
+    if not isinstance(audio, str):
+        return len(audio) / SAMPLE_RATE, hashlib.sha1(audio[:SAMPLE_RATE * 10].tobytes()).hexdigest()
+    with open(audio, 'rb') as f:
+        seed = hashlib.sha1(f.read(1 << 20)).hexdigest()
+    try:
+        with wave.open(audio, 'rb') as w:
+            return w.getnframes() / w.getframerate(), seed
+    except (wave.Error, EOFError):
+        return float(ffmpeg.probe(audio)['format']['duration']), seed
+
+
+def _window_segments(rng, seek, window_seconds):
+    """一個窗口內每 5 秒一段的固定文字"""
+    segments = []
+    offset = 0.0
+    while offset < window_seconds - 0.5:
+        end = min(window_seconds, offset + 5.0)
+        segments.append({
+            "seek": seek,
+            "start": round(seek / FRAMES_PER_SECOND + offset, 3),
+            "end": round(seek / FRAMES_PER_SECOND + end, 3),
+            "text": "".join(rng.choices(WORDS, k=rng.randint(4, 9))),
+            "tokens": [],
+            "temperature": 0.0,
+            "avg_logprob": -0.2,
+            "compression_ratio": 1.2,
+            "no_speech_prob": 0.01,
+        })
+        offset = end
+    return segments
+
+
+def transcribe(model, audio, *, language="zh", on_progress=None, on_window=None, should_stop=None,
+               resume_state=None, **options):
+    """與 decode_engine.transcribe() 相同的介面與回傳格式"""
+    total_seconds, seed = _describe(audio)
+    content_frames = int(total_seconds * FRAMES_PER_SECOND)
+
+    seek = 0
+    segments = SegmentStore()
+    if resume_state is not None:
+        seek = resume_state['seek']
+        segments = SegmentStore.from_segments(resume_state['segments'])
+        language = resume_state.get('language', language)
+    language = language or 'zh'
+
+    def current_state():
+        return {'seek': seek, 'offset': seek / FRAMES_PER_SECOND, 'segments': segments,
+                'prompt_tokens': [], 'language': language}
+
+    windows = 0
+    if on_progress is not None:
+        on_progress(seek / FRAMES_PER_SECOND, total_seconds)
+    while seek < content_frames:
+        if should_stop is not None:
+            reason = should_stop()
+            if reason:
+                raise DecodeInterrupted(reason, current_state())
+
+        size = min(WINDOW_FRAMES, content_frames - seek)
+        time.sleep(size / FRAMES_PER_SECOND * SECONDS_PER_AUDIO_SECOND)
+        # 以內容與窗口位置決定文字，同一檔案每次（包括中斷後繼續）的結果相同
+        new_segments = _window_segments(random.Random(f"{seed}:{seek}"), seek, size / FRAMES_PER_SECOND)
+        segments.extend(new_segments)
+        seek += size
+        windows += 1
+
+        if on_window is not None:
+            on_window(current_state(), new_segments)
+        if on_progress is not None:
+            on_progress(seek / FRAMES_PER_SECOND, total_seconds)
+
+    return {
+        "text": segments.text(),
+        "segments": segments,
+        "language": language,
+        "duration": total_seconds,
+        "decode_stats": {'windows': windows, 'decodes': windows, 'fallbacks': 0},
+    }
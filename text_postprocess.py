@@ -0,0 +1,322 @@
+"""
+轉錄文字後處理
+
+whisper 以 language="zh" 轉錄台灣的訪談時，常輸出簡體字、缺少標點，專有名詞也
+常寫成同音字。這裡在解碼與寫出之間，依序對段落文字套用可插拔的處理步驟：
+
+1. 簡繁轉換：使用 OpenCC 的詞典（opencc-python-reimplemented 套件內附），詞組優先於
+   單字；s2twp 另外換成台灣慣用詞（例如「软件」→「軟體」）
+2. 詞語表：使用者提供的「錯誤寫法=正確寫法」對照，在簡繁轉換之後比對
+3. 標點還原：中文之間的空白改為逗號、半形標點改為全形；段落結尾依與下一段的
+   停頓長短補上句號或逗號，以疑問語氣詞結尾時補問號
+
+詞典與詞語表在第一次使用時編譯成字典樹（trie），由左至右以最長匹配掃過文字一次；
+編譯結果依檔案修改時間快取，重複出現的段落文字也直接重用轉換結果。有詞級時間戳時，
+替換結果依字元位置分配回各個詞，之後依詞切分字幕行仍與段落文字一致。
+"""
+import os
+import re
+import json
+import logging
+import threading
+from functools import lru_cache
+
+# 簡繁轉換依序使用的詞典（每一步內詞組與單字一起以最長匹配）
+CONVERSIONS = {
+    's2t': [('STPhrases', 'STCharacters')],
+    's2tw': [('STPhrases', 'STCharacters'), ('TWVariants',)],
+    's2twp': [('STPhrases', 'STCharacters'), ('TWPhrases',), ('TWVariants',)],
+}
+# 與下一段的間隔達此秒數時視為句子結束
+PAUSE_SECONDS = 0.5
+QUESTION_PARTICLES = "嗎呢麼"
+# 重複段落文字的轉換快取大小
+TEXT_CACHE_SIZE = 65536
+
+_CJK = "㐀-䶿一-鿿豈-﫿"
+_SPACE_BETWEEN_CJK = re.compile(f"(?<=[{_CJK}])\\s+(?=[{_CJK}])")
+_CJK_CHAR = re.compile(f"[{_CJK}]")
+# 中文後面的半形標點（連同後面的空白），小數點除外
+_HALF_WIDTH_AFTER_CJK = re.compile(f"(?<=[{_CJK}])([,?!;:]|\\.(?!\\d))\\s*")
+_FULL_WIDTH = {',': '，', '?': '？', '!': '！', ';': '；', ':': '：', '.': '。'}
+_VALUE = ''  # 字典樹節點中存放替換文字的鍵（不會與任何單一字元衝突）
+
+
+class Trie:
+    """多詞替換用的字典樹，由左至右以最長匹配取代"""
+
+    def __init__(self, mapping):
+        self.root = {}
+        self.size = 0
+        for key, value in mapping.items():
+            if not key:
+                continue
+            node = self.root
+            for char in key:
+                node = node.setdefault(char, {})
+            node[_VALUE] = value
+            self.size += 1
+
+    def spans(self, text):
+        """回傳需要替換的 (起點, 終點, 替換文字)，彼此不重疊"""
+        root = self.root
+        spans = []
+        i = 0
+        n = len(text)
+        while i < n:
+            node = root.get(text[i])
+            if node is None:
+                i += 1
+                continue
+            match = None
+            j = i
+            while node is not None:
+                j += 1
+                if _VALUE in node:
+                    match = (j, node[_VALUE])
+                if j >= n:
+                    break
+                node = node.get(text[j])
+            if match is None:
+                i += 1
+                continue
+            # 對照到自己的詞條仍會擋下較短的匹配，但不需要替換
+            if match[1] != text[i:match[0]]:
+                spans.append((i, match[0], match[1]))
+            i = match[0]
+        return spans
+
+    def replace(self, text):
+        return _apply_spans(text, self.spans(text))
+
+
+def _apply_spans(text, spans):
+    if not spans:
+        return text
+    parts = []
+    last = 0
+    for start, end, value in spans:
+        parts.append(text[last:start])
+        parts.append(value)
+        last = end
+    parts.append(text[last:])
+    return "".join(parts)
+
+
+def _rewrite_words(words, spans):
+    """把對整段文字的替換依字元位置分配回各個詞，替換的內容歸給起點所在的詞（結尾則歸給最後一個詞）"""
+    if not spans or not words:
+        return words
+    joined = "".join(w["word"] for w in words)
+    owner = []
+    for index, word in enumerate(words):
+        owner.extend([index] * len(word["word"]))
+    pieces = [[] for _ in words]
+    last = 0
+    for start, end, value in spans:
+        for k in range(last, start):
+            pieces[owner[k]].append(joined[k])
+        pieces[owner[min(start, len(owner) - 1)]].append(value)
+        last = end
+    for k in range(last, len(joined)):
+        pieces[owner[k]].append(joined[k])
+    return [dict(word, word="".join(piece)) for word, piece in zip(words, pieces)]
+
+
+# ---- 詞典 ----
+
+def opencc_dictionary_dir():
+    """OpenCC 詞典所在的資料夾（opencc-python-reimplemented 套件內附）"""
+    import opencc
+    return os.path.join(os.path.dirname(opencc.__file__), 'dictionary')
+
+
+def read_dictionary(path):
+    """讀取 OpenCC 格式的詞典（每行「詞<Tab>候選1 候選2」），取第一個候選"""
+    mapping = {}
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            key, _, values = line.rstrip('\n').partition('\t')
+            if key and values:
+                mapping[key] = values.split(' ')[0]
+    return mapping
+
+
+@lru_cache(maxsize=None)
+def load_conversion(name):
+    """編譯簡繁轉換的各步驟字典樹，同一個轉換在程序內只編譯一次"""
+    if name not in CONVERSIONS:
+        raise ValueError(f"不支援的簡繁轉換: {name}（可用: {', '.join(CONVERSIONS)}）")
+    folder = opencc_dictionary_dir()
+    stages = []
+    for files in CONVERSIONS[name]:
+        mapping = {}
+        for filename in files:
+            mapping.update(read_dictionary(os.path.join(folder, f"{filename}.txt")))
+        stages.append(Trie(mapping))
+    logging.info(f"簡繁轉換 {name} 已編譯（{sum(stage.size for stage in stages)} 個詞條）")
+    return stages
+
+
+def read_glossary(path):
+    """
+    讀取詞語表：.json 為 {錯誤寫法: 正確寫法}，其他為每行「錯誤寫法=正確寫法」
+    （也可用 Tab 分隔），# 開頭的行為註解
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        if path.lower().endswith('.json'):
+            return {str(key): str(value) for key, value in json.load(f).items()}
+        mapping = {}
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            separator = '\t' if '\t' in line else '='
+            key, found, value = line.partition(separator)
+            if not found or not key.strip():
+                logging.warning(f"詞語表 {os.path.basename(path)} 第 {number} 行格式不正確，已略過")
+                continue
+            mapping[key.strip()] = value.strip()
+        return mapping
+
+
+# ---- 標點 ----
+
+def _punctuation_spans(text, gap, pause):
+    spans = [(m.start(), m.end(), '，') for m in _SPACE_BETWEEN_CJK.finditer(text)]
+    spans += [(m.start(), m.end(), _FULL_WIDTH[m.group(1)]) for m in _HALF_WIDTH_AFTER_CJK.finditer(text)]
+    spans.sort()
+    end = len(text.rstrip())
+    if end and _CJK_CHAR.match(text[end - 1]):
+        if gap is not None and gap < pause:
+            mark = '，'
+        elif text[end - 1] in QUESTION_PARTICLES:
+            mark = '？'
+        else:
+            mark = '。'
+        spans.append((end, end, mark))
+    return spans
+
+
+def restore_punctuation(segments, pause=PAUSE_SECONDS):
+    """
+    逐一產生補上標點的段落
+
+    段落結尾是中文字時：與下一段的間隔小於 pause 秒補逗號，否則補句號
+    （疑問語氣詞結尾補問號）；最後一段一律視為句子結束。
+    """
+    previous = None
+    for segment in segments:
+        if previous is not None:
+            yield _punctuate(previous, segment["start"] - previous["end"], pause)
+        previous = segment
+    if previous is not None:
+        yield _punctuate(previous, None, pause)
+
+
+def _punctuate(segment, gap, pause):
+    text = segment["text"].strip()
+    spans = _punctuation_spans(text, gap, pause)
+    if not spans:
+        return segment
+    result = dict(segment, text=_apply_spans(text, spans))
+    if segment.get("words"):
+        # 詞的文字另外比對（前後可能有空白），結尾補上的標點加在最後一個詞
+        words = segment["words"]
+        result["words"] = _rewrite_words(words, _punctuation_spans("".join(w["word"] for w in words), gap, pause))
+    return result
+
+
+# ---- 流程 ----
+
+class TextPipeline:
+    """
+    依序套用的文字處理步驟
+
+    替換步驟（簡繁轉換、詞語表）為字典樹，逐段轉換文字並快取結果；
+    段落步驟為 fn(段落迭代器) -> 段落迭代器 的生成器函數，例如 restore_punctuation，
+    可用 add_step() 加入自訂的處理。
+    """
+
+    def __init__(self):
+        self.replacers = []
+        self.steps = []
+        self._convert = lru_cache(maxsize=TEXT_CACHE_SIZE)(self._convert_uncached)
+
+    def add_replacer(self, name, trie):
+        self.replacers.append((name, trie))
+        return self
+
+    def add_step(self, step):
+        self.steps.append(step)
+        return self
+
+    def _convert_uncached(self, text):
+        for _, trie in self.replacers:
+            text = trie.replace(text)
+        return text
+
+    def convert_text(self, text):
+        return self._convert(text)
+
+    def _convert_segments(self, segments):
+        for segment in segments:
+            text = self._convert(segment["text"])
+            words = segment.get("words")
+            if words:
+                for _, trie in self.replacers:
+                    words = _rewrite_words(words, trie.spans("".join(w["word"] for w in words)))
+            if text != segment["text"] or words is not segment.get("words"):
+                segment = dict(segment, text=text)
+                if words:
+                    segment["words"] = words
+            yield segment
+
+    def __call__(self, segments):
+        """逐一產生處理後的段落（不修改原段落）"""
+        if self.replacers:
+            segments = self._convert_segments(segments)
+        for step in self.steps:
+            segments = step(segments)
+        return segments
+
+
+_pipelines = {}
+_pipelines_lock = threading.Lock()
+
+
+def build_pipeline(script=None, glossary=None, punctuation=False):
+    """
+    依設定建立後處理流程，都未啟用時回傳 None
+
+    script 為 CONVERSIONS 中的簡繁轉換名稱，glossary 為詞語表路徑。相同設定（且詞語表
+    未修改）時回傳同一個流程，編譯好的字典樹與文字快取在任務之間共用。
+    簡繁轉換需要的 opencc 套件未安裝時記錄警告並略過該步驟。
+    """
+    if not script and not glossary and not punctuation:
+        return None
+    glossary = os.path.abspath(glossary) if glossary else None
+    key = (script, glossary, os.path.getmtime(glossary) if glossary else None, bool(punctuation))
+    with _pipelines_lock:
+        pipeline = _pipelines.get(key)
+        if pipeline is not None:
+            return pipeline
+
+        pipeline = TextPipeline()
+        if script:
+            try:
+                for index, trie in enumerate(load_conversion(script)):
+                    pipeline.add_replacer(f"{script}:{index}", trie)
+            except ImportError:
+                logging.warning(f"未安裝 opencc-python-reimplemented，略過簡繁轉換 {script}")
+        if glossary:
+            terms = read_glossary(glossary)
+            pipeline.add_replacer('glossary', Trie(terms))
+            logging.info(f"已載入詞語表 {os.path.basename(glossary)}（{len(terms)} 個詞）")
+        if punctuation:
+            pipeline.add_step(restore_punctuation)
+        # 詞語表修改後舊的流程不再使用
+        for old_key in [k for k in _pipelines if k[:2] == key[:2] and k[3] == key[3]]:
+            del _pipelines[old_key]
+        _pipelines[key] = pipeline
+        return pipeline
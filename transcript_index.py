@@ -0,0 +1,336 @@
+"""
+轉錄結果全文檢索
+
+以 SQLite 保存倒排索引：中日韓文字切成相鄰兩字的二元組（bigram）並另外索引
+每個單字，英文與數字以整個詞為單位。每寫出一份轉錄就更新該檔案的索引；啟動後第一次搜尋時也會
+掃描輸出資料夾，補上索引建立之前就已存在、或被手動修改過的 SRT 檔。
+
+查詢時先取出現次數最少的詞，再逐一以主鍵查詢其他詞的倒排列表求交集；
+關鍵字由多個詞組成時，再確認段落文字確實包含整個關鍵字。
+"""
+import os
+import re
+import time
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+
+INDEX_FILENAME = '.search_index.sqlite'
+# 轉錄的輸出檔（與 whisper_transcribe.OUTPUT_FORMATS 相同），任一存在時視為轉錄仍在
+OUTPUT_EXTENSIONS = ('.txt', '.srt', '.vtt', '.json')
+# 索引格式版本（PRAGMA user_version），不同時清空後由 sync() 重建
+INDEX_VERSION = 3
+
+# 中日韓統一表意文字、日文假名與韓文音節
+_CJK = '぀-ヿ㐀-䶿一-鿿가-힯豈-﫿'
+_TOKEN_PATTERN = re.compile(f'[{_CJK}]+|[0-9a-z]+')
+_CJK_PATTERN = re.compile(f'[{_CJK}]')
+# 寫出 SRT 時加在段落文字前面的說話者標籤
+_SPEAKER_PREFIX = re.compile(r'^\[(說話者 \d+)\] ')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    name TEXT UNIQUE NOT NULL,
+    model TEXT,
+    mtime REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS segments (
+    id INTEGER PRIMARY KEY,
+    file_id INTEGER NOT NULL,
+    start REAL,
+    end REAL,
+    text TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS segments_file ON segments(file_id);
+CREATE TABLE IF NOT EXISTS postings (
+    term TEXT NOT NULL,
+    segment_id INTEGER NOT NULL,
+    PRIMARY KEY (term, segment_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS postings_segment ON postings(segment_id);
+CREATE TABLE IF NOT EXISTS terms (
+    term TEXT PRIMARY KEY,
+    df INTEGER NOT NULL
+) WITHOUT ROWID;
+"""
+
+
+def tokenize(text):
+    """把查詢切成索引詞：中日韓文字取二元組（單字則取單字），其他取整個詞"""
+    terms = []
+    for run in _TOKEN_PATTERN.findall(text.lower()):
+        if _CJK_PATTERN.match(run):
+            if len(run) == 1:
+                terms.append(run)
+            else:
+                terms.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            terms.append(run)
+    return terms
+
+
+def index_terms(text):
+    """段落的索引詞：tokenize() 的結果再加上每個中日韓單字，讓單字查詢也能命中"""
+    terms = set(tokenize(text))
+    for run in _TOKEN_PATTERN.findall(text.lower()):
+        if len(run) > 1 and _CJK_PATTERN.match(run):
+            terms.update(run)
+    return terms
+
+
+def _normalize(text):
+    return re.sub(r'\s+', '', text.lower())
+
+
+def _snippet(text, query, width=30):
+    """擷取查詢字串前後的文字，回傳 (片段, 命中位置)"""
+    position = text.lower().find(query.lower())
+    if position < 0:
+        return text[:width * 2], None
+    begin = max(0, position - width)
+    end = min(len(text), position + len(query) + width)
+    snippet = ('…' if begin > 0 else '') + text[begin:end] + ('…' if end < len(text) else '')
+    offset = position - begin + (1 if begin > 0 else 0)
+    return snippet, [offset, offset + len(query)]
+
+
+def _parse_timestamp(value):
+    hours, minutes, seconds = value.strip().replace(',', '.').split(':')
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+def parse_srt(path):
+    """
+    讀取 SRT 檔，回傳 (模型名稱, 段落列表)；略過標示使用模型的第一段
+
+    文字前的說話者標籤移到段落的 speaker 欄位，段落文字與寫出時的原始文字相同。
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        blocks = f.read().strip().split('\n\n')
+    model_name = None
+    segments = []
+    for block in blocks:
+        lines = block.strip().split('\n')
+        if len(lines) < 3 or '-->' not in lines[1]:
+            continue
+        text = '\n'.join(lines[2:]).strip()
+        if text.startswith('使用模型:') and not segments:
+            model_name = text.split(':', 1)[1].strip()
+            continue
+        start, end = lines[1].split('-->')
+        segment = {'start': _parse_timestamp(start), 'end': _parse_timestamp(end), 'text': text}
+        match = _SPEAKER_PREFIX.match(text)
+        if match:
+            segment['speaker'] = match.group(1)
+            segment['text'] = text[match.end():]
+        segments.append(segment)
+    return model_name, segments
+
+
+class TranscriptIndex:
+    """單一輸出資料夾的全文檢索索引"""
+
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, folder, path=None):
+        self.folder = folder
+        self.path = path or os.path.join(folder, INDEX_FILENAME)
+        self._write_lock = threading.Lock()
+        self._synced = False
+        with self._connection() as conn:
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
+            if version == 2:
+                # 第 2 版從 SRT 建立的段落含有說話者標籤，讓 sync() 重新讀取
+                # （沒有 SRT 的轉錄只能在寫出時建立索引，不清空）
+                conn.execute('UPDATE files SET mtime = 0')
+            elif version != INDEX_VERSION:
+                # 舊格式的索引缺少單字，清空後重建
+                conn.executescript('DROP TABLE IF EXISTS postings; DROP TABLE IF EXISTS terms; '
+                                   'DROP TABLE IF EXISTS segments; DROP TABLE IF EXISTS files;')
+            conn.execute(f'PRAGMA user_version = {INDEX_VERSION}')
+            conn.executescript(_SCHEMA)
+
+    @classmethod
+    def for_folder(cls, folder):
+        """每個資料夾共用一個實例，讓同一行程內的寫入依序進行"""
+        folder = os.path.abspath(folder)
+        with cls._instances_lock:
+            if folder not in cls._instances:
+                cls._instances[folder] = cls(folder)
+            return cls._instances[folder]
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    @contextmanager
+    def _connection(self):
+        """在一個交易內使用連線，結束後提交並關閉"""
+        conn = self._connect()
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    # ---- 寫入 ----
+
+    def add_transcript(self, name, segments, model_name=None, mtime=None):
+        """加入或取代一份轉錄的索引，segments 為段落 dict 的序列"""
+        with self._write_lock, self._connection() as conn:
+            self._remove(conn, name)
+            cursor = conn.execute('INSERT INTO files (name, model, mtime) VALUES (?, ?, ?)',
+                                  (name, model_name, mtime or time.time()))
+            file_id = cursor.lastrowid
+            for segment in segments:
+                text = segment["text"].strip()
+                if not text:
+                    continue
+                cursor = conn.execute('INSERT INTO segments (file_id, start, end, text) VALUES (?, ?, ?, ?)',
+                                      (file_id, segment.get("start"), segment.get("end"), text))
+                terms = index_terms(text)
+                conn.executemany('INSERT INTO postings (term, segment_id) VALUES (?, ?)',
+                                 ((term, cursor.lastrowid) for term in terms))
+                conn.executemany('INSERT INTO terms (term, df) VALUES (?, 1) '
+                                 'ON CONFLICT(term) DO UPDATE SET df = df + 1',
+                                 ((term,) for term in terms))
+
+    def remove_transcript(self, name):
+        with self._write_lock, self._connection() as conn:
+            self._remove(conn, name)
+
+    @staticmethod
+    def _remove(conn, name):
+        row = conn.execute('SELECT id FROM files WHERE name = ?', (name,)).fetchone()
+        if row is None:
+            return
+        file_id = row[0]
+        # df 是包含該詞的段落數，扣除這份轉錄中包含該詞的段落
+        removed = conn.execute('SELECT p.term, COUNT(*) FROM postings p JOIN segments s ON s.id = p.segment_id '
+                               'WHERE s.file_id = ? GROUP BY p.term', (file_id,)).fetchall()
+        conn.executemany('UPDATE terms SET df = df - ? WHERE term = ?', ((count, term) for term, count in removed))
+        conn.execute('DELETE FROM postings WHERE segment_id IN (SELECT id FROM segments WHERE file_id = ?)',
+                     (file_id,))
+        conn.execute('DELETE FROM segments WHERE file_id = ?', (file_id,))
+        conn.execute('DELETE FROM files WHERE id = ?', (file_id,))
+        conn.execute('DELETE FROM terms WHERE df <= 0')
+
+    def sync(self):
+        """
+        比對資料夾中的輸出檔與索引，補上新增或修改過的 SRT 檔並移除已刪除的轉錄
+
+        沒有 SRT 的轉錄（例如只輸出 TXT、JSON）在寫出時已加入索引，仍有任一輸出檔時保留。
+        """
+        started = time.time()
+        with self._connection() as conn:
+            indexed = dict(conn.execute('SELECT name, mtime FROM files'))
+
+        present = set()
+        srt_files = {}
+        if os.path.isdir(self.folder):
+            for filename in os.listdir(self.folder):
+                name, ext = os.path.splitext(filename)
+                if ext in OUTPUT_EXTENSIONS:
+                    present.add(name)
+                if ext == '.srt':
+                    srt_files[name] = os.path.getmtime(os.path.join(self.folder, filename))
+
+        added = 0
+        for name, mtime in srt_files.items():
+            if name in indexed and indexed[name] >= mtime:
+                continue
+            try:
+                model_name, segments = parse_srt(os.path.join(self.folder, f"{name}.srt"))
+            except (OSError, ValueError) as e:
+                logging.warning(f"無法讀取字幕檔 {name}.srt: {str(e)}")
+                continue
+            self.add_transcript(name, segments, model_name, mtime)
+            added += 1
+
+        removed = [name for name in indexed if name not in present]
+        for name in removed:
+            self.remove_transcript(name)
+
+        self._synced = True
+        if added or removed:
+            logging.info(f"更新搜尋索引：新增/更新 {added} 份、移除 {len(removed)} 份，"
+                         f"耗時 {time.time() - started:.1f} 秒")
+
+    # ---- 查詢 ----
+
+    def search(self, query, limit=50, offset=0):
+        """
+        搜尋包含查詢字串的段落
+
+        查詢以空白分隔多個關鍵字時，段落必須包含全部關鍵字。
+        回傳 {'total', 'results': [{'file', 'model', 'start', 'end', 'text', 'snippet', 'match'}]}。
+        """
+        if not self._synced:
+            self.sync()
+
+        keywords = [k for k in query.split() if k]
+        terms = sorted(set(term for k in keywords for term in tokenize(k)))
+        if not terms:
+            return {'total': 0, 'results': []}
+
+        with self._connection() as conn:
+            df = dict(conn.execute(f'SELECT term, df FROM terms WHERE term IN ({",".join("?" * len(terms))})',
+                                   terms))
+            if len(df) < len(terms):
+                return {'total': 0, 'results': []}
+
+            # 從最少出現的詞開始，其他詞以主鍵逐一確認；較新的段落 id 較大，依 id 倒序即為新到舊
+            ordered = sorted(terms, key=lambda t: df[t])
+            joins = ''.join(f' JOIN postings p{i} ON p{i}.term = ? AND p{i}.segment_id = p0.segment_id'
+                            for i in range(1, len(ordered)))
+            candidates = ' FROM postings p0' + joins + ' WHERE p0.term = ?'
+            params = ordered[1:] + ordered[:1]
+
+            if all(len(tokenize(k)) == 1 for k in keywords):
+                # 每個關鍵字都恰好是一個索引詞時，倒排列表即為答案，不需要逐段確認
+                total = conn.execute('SELECT COUNT(*)' + candidates, params).fetchone()[0]
+                ids = [row[0] for row in conn.execute(
+                    'SELECT p0.segment_id' + candidates + ' ORDER BY p0.segment_id DESC LIMIT ? OFFSET ?',
+                    params + [limit, offset])]
+            else:
+                # 二元組都出現不代表字串相連，逐段確認
+                normalized = [_normalize(k) for k in keywords]
+                matched = [segment_id for segment_id, text in conn.execute(
+                    'SELECT s.id, s.text' + candidates.replace(' WHERE', ' JOIN segments s ON s.id = p0.segment_id WHERE') +
+                    ' ORDER BY p0.segment_id DESC', params)
+                    if all(k in _normalize(text) for k in normalized)]
+                total = len(matched)
+                ids = matched[offset:offset + limit]
+
+            rows = conn.execute(
+                'SELECT s.id, f.name, f.model, s.start, s.end, s.text FROM segments s JOIN files f ON f.id = s.file_id '
+                f'WHERE s.id IN ({",".join("?" * len(ids))}) ORDER BY s.id DESC', ids
+            ).fetchall() if ids else []
+
+        results = []
+        for _, name, model_name, start, end, text in rows:
+            snippet, match = _snippet(text, keywords[0])
+            results.append({
+                'file': name,
+                'model': model_name,
+                'start': start,
+                'end': end,
+                'text': text,
+                'snippet': snippet,
+                'match': match,
+            })
+        return {'total': total, 'results': results}
+
+    def stats(self):
+        with self._connection() as conn:
+            return {
+                'files': conn.execute('SELECT COUNT(*) FROM files').fetchone()[0],
+                'segments': conn.execute('SELECT COUNT(*) FROM segments').fetchone()[0],
+                'terms': conn.execute('SELECT COUNT(*) FROM terms').fetchone()[0],
+                'size_bytes': os.path.getsize(self.path) if os.path.exists(self.path) else 0,
+            }
@@ -1,14 +1,32 @@
 import whisper
 import torch
 import os
-from pathlib import Path
 import logging
-import traceback
-from contextlib import nullcontext
+from contextlib import nullcontext, redirect_stdout
 import sys
 from datetime import datetime
 import psutil
 import platform
+import ffmpeg
+import hashlib
+import threading
+import argparse
+import glob
+import json
+import time
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+import decode_engine
+from checkpoint import TranscriptCheckpoint, CHECKPOINT_FOLDER
+from model_loader import ModelPool
+from execution_profiles import PROFILES, prepare_model, execution_context, uses_fp16
+from language_id import identify_language, group_by_language
+from diarization import diarize, assign_speakers
+from progress import RTFStats
+from segment_postprocess import postprocess_segments
+from text_postprocess import CONVERSIONS, build_pipeline
+from transcript_index import TranscriptIndex
 
 # 設置日誌
 logging.basicConfig(
@@ -17,18 +35,19 @@ logging.basicConfig(
     datefmt='%Y-%m-%d %H:%M:%S'
 )
 
-# 設置 ffmpeg 路徑
-FFMPEG_PATH = r"C:\Program Files\ffmpeg\bin\ffmpeg.exe"
-if not os.path.exists(FFMPEG_PATH):
+# 設置 ffmpeg 路徑（可用環境變數 FFMPEG_PATH 指定，找不到時使用系統 PATH 中的 ffmpeg）
+FFMPEG_PATH = os.environ.get("FFMPEG_PATH", r"C:\Program Files\ffmpeg\bin\ffmpeg.exe")
+if os.path.exists(FFMPEG_PATH):
+    os.environ["PATH"] = os.path.dirname(FFMPEG_PATH) + os.pathsep + os.environ["PATH"]
+    logging.info(f"設置 ffmpeg 路徑: {FFMPEG_PATH}")
+elif shutil.which("ffmpeg"):
+    logging.info(f"使用系統 PATH 中的 ffmpeg: {shutil.which('ffmpeg')}")
+else:
     logging.error(f"找不到 ffmpeg: {FFMPEG_PATH}")
     print(f"錯誤：找不到 ffmpeg: {FFMPEG_PATH}")
-    print("請確保 ffmpeg 已正確安裝在指定路徑")
+    print("請確保 ffmpeg 已正確安裝在指定路徑，或設定 FFMPEG_PATH 環境變數")
     sys.exit(1)
 
-os.environ["PATH"] = os.path.dirname(FFMPEG_PATH) + os.pathsep + os.environ["PATH"]
-print(f"設置 ffmpeg 路徑: {FFMPEG_PATH}")
-logging.info(f"設置 ffmpeg 路徑: {FFMPEG_PATH}")
-
 def get_system_memory():
     """獲取系統記憶體信息"""
     memory = psutil.virtual_memory()
@@ -124,339 +143,414 @@ def format_timestamp(seconds):
     seconds = seconds % 60
     return f"{hours:02d}:{minutes:02d}:{seconds:06.3f}"
 
-def transcribe_audio(model, audio_path, output_dir, use_gpu=True):
-    """轉錄單個音頻文件"""
+def get_audio_duration(audio_path):
+    """取得音頻長度（秒），優先以 ffprobe 讀取檔頭，失敗時解碼整個檔案計算"""
     try:
-        print(f"\n處理檔案: {audio_path}")
-        logging.info(f"處理檔案: {audio_path}")
-        
-        # 獲取檔案的絕對路徑
-        audio_path = os.path.abspath(audio_path)
-        print(f"檔案絕對路徑: {audio_path}")
-        logging.info(f"檔案絕對路徑: {audio_path}")
-        
-        # 檢查檔案是否存在
-        if not os.path.exists(audio_path):
-            print(f"錯誤：找不到檔案 {audio_path}")
-            logging.error(f"找不到檔案: {audio_path}")
-            return False
-            
-        # 檢查檔案大小
-        file_size = os.path.getsize(audio_path) / (1024 * 1024)  # 轉換為 MB
-        print(f"檔案大小: {file_size:.2f} MB")
-        logging.info(f"檔案大小: {file_size:.2f} MB")
-        
-        # 檢查 GPU 狀態
-        check_gpu()
-        
-        # 設置設備
-        device = "cuda" if use_gpu and torch.cuda.is_available() else "cpu"
-        print(f"使用設備: {device}")
-        logging.info(f"使用設備: {device}")
-        
-        # 選擇模型大小
-        model_name = select_model_size(get_system_memory())
-        print(f"選擇的模型: {model_name}")
-        logging.info(f"選擇的模型: {model_name}")
-        
-        # 檢查模型文件
-        model_path = os.path.expanduser(f"~/.cache/whisper/{model_name}.pt")
-        if os.path.exists(model_path):
-            print(f"找到模型文件: {model_path}")
-            logging.info(f"找到模型文件: {model_path}")
-            model_size = os.path.getsize(model_path) / (1024 * 1024 * 1024)  # 轉換為 GB
-            print(f"模型文件大小: {model_size:.2f} GB")
-            logging.info(f"模型文件大小: {model_size:.2f} GB")
-        else:
-            print(f"警告：找不到模型文件 {model_path}")
-            logging.warning(f"找不到模型文件: {model_path}")
-        
-        print(f"正在載入 {model_name} 模型...")
-        logging.info(f"正在載入 {model_name} 模型...")
-        
-        # 清理 GPU 記憶體
-        if use_gpu and torch.cuda.is_available():
-            torch.cuda.empty_cache()
-            print("已清理 GPU 記憶體")
-            logging.info("已清理 GPU 記憶體")
-        
-        # 載入模型
-        model = whisper.load_model(model_name, device=device)
-        print("模型載入成功")
-        logging.info("模型載入成功")
-        
-        # 將模型移動到 GPU
-        if use_gpu and torch.cuda.is_available():
-            model = model.to(device)
-            print("模型已成功移動到 GPU")
-            logging.info("模型已成功移動到 GPU")
-        
-        # 檢查模型大小
-        model_size = sum(p.numel() * p.element_size() for p in model.parameters()) / (1024 * 1024 * 1024)
-        print(f"模型大小: {model_size:.2f} GB")
-        logging.info(f"模型大小: {model_size:.2f} GB")
-        
-        # 檢查 GPU 記憶體
-        if use_gpu and torch.cuda.is_available():
-            free_memory = torch.cuda.get_device_properties(0).total_memory - torch.cuda.memory_allocated(0)
-            free_memory_gb = free_memory / (1024 * 1024 * 1024)
-            print(f"當前可用 GPU 記憶體: {free_memory_gb:.2f} GB")
-            logging.info(f"當前可用 GPU 記憶體: {free_memory_gb:.2f} GB")
-        
-        print(f"開始轉錄 {os.path.basename(audio_path)}...")
-        logging.info(f"開始轉錄 {os.path.basename(audio_path)}...")
-        
-        # 設置轉錄選項
-        transcribe_options = {
-            "language": "zh",
-            "task": "transcribe",
-            "fp16": use_gpu and torch.cuda.is_available()
-        }
-        
-        # 使用 autocast 進行混合精度計算
-        with torch.cuda.amp.autocast() if use_gpu else nullcontext():
-            print(f"使用路徑: {audio_path}")
-            logging.info(f"使用路徑: {audio_path}")
-            
-            # 檢查檔案是否可讀
-            if not os.access(audio_path, os.R_OK):
-                print(f"錯誤：無法讀取檔案 {audio_path}")
-                logging.error(f"無法讀取檔案: {audio_path}")
-                return False
-            
-            print("檔案檢查通過，開始轉錄...")
-            logging.info("檔案檢查通過，開始轉錄...")
-            
-            # 嘗試使用 POSIX 格式路徑
-            audio_path_posix = str(Path(audio_path).as_posix())
-            print(f"使用 POSIX 格式路徑: {audio_path_posix}")
-            logging.info(f"使用 POSIX 格式路徑: {audio_path_posix}")
-            
-            print("嘗試使用 POSIX 格式路徑進行轉錄...")
-            logging.info("嘗試使用 POSIX 格式路徑進行轉錄...")
-            
-            try:
-                result = model.transcribe(audio_path_posix, **transcribe_options)
-            except Exception as e:
-                print(f"使用 POSIX 格式路徑失敗，嘗試使用原始路徑: {str(e)}")
-                logging.warning(f"使用 POSIX 格式路徑失敗，嘗試使用原始路徑: {str(e)}")
-                
-                print("嘗試使用原始路徑進行轉錄...")
-                logging.info("嘗試使用原始路徑進行轉錄...")
-                
-                audio_path_str = str(audio_path)
-                result = model.transcribe(audio_path_str, **transcribe_options)
-        
-        # 清理 GPU 記憶體
-        if use_gpu and torch.cuda.is_available():
-            torch.cuda.empty_cache()
-            print("已清理 GPU 記憶體")
-            logging.info("已清理 GPU 記憶體")
-        
-        # 生成輸出文件名
-        base_name = os.path.splitext(os.path.basename(audio_path))[0]
-        output_file = os.path.join(output_dir, f"{base_name}.txt")
-        
-        # 保存轉錄結果
-        with open(output_file, "w", encoding="utf-8") as f:
-            for segment in result["segments"]:
-                start_time = format_timestamp(segment["start"])
-                end_time = format_timestamp(segment["end"])
-                text = segment["text"].strip()
-                f.write(f"[{start_time} --> {end_time}] {text}\n")
-        
-        print(f"轉錄完成：{output_file}")
-        logging.info(f"轉錄完成：{output_file}")
-        return True
-        
+        probe = ffmpeg.probe(str(audio_path))
+        return float(probe['format']['duration'])
     except Exception as e:
-        print(f"轉錄音頻時發生錯誤: {str(e)}")
-        logging.error(f"轉錄音頻時發生錯誤: {str(e)}")
-        logging.error("錯誤追蹤:", exc_info=True)
-        print("錯誤追蹤:")
-        traceback.print_exc()
-        return False
-
-def process_interview_files(input_dir, output_dir, model_name="base"):
-    """
-    處理訪談記錄資料夾中的所有音頻文件
+        logging.warning(f"無法以 ffprobe 讀取音頻長度，改為解碼計算: {str(e)}")
+        audio = whisper.load_audio(str(audio_path))
+        return len(audio) / whisper.audio.SAMPLE_RATE
+
+_file_hash_cache = {}
+_file_hash_lock = threading.Lock()
+
+def compute_file_hash(file_path):
+    """計算檔案內容的 SHA-256，依路徑、大小與修改時間快取結果"""
+    file_path = os.path.abspath(str(file_path))
+    stat = os.stat(file_path)
+    cache_key = (file_path, stat.st_size, stat.st_mtime_ns)
+    with _file_hash_lock:
+        if cache_key in _file_hash_cache:
+            return _file_hash_cache[cache_key]
+    
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha256.update(chunk)
+    digest = sha256.hexdigest()
     
-    參數:
-        input_dir (str/Path): 輸入資料夾路徑
-        output_dir (str/Path): 輸出資料夾路徑
-        model_name (str): Whisper 模型名稱
+    with _file_hash_lock:
+        _file_hash_cache[cache_key] = digest
+    return digest
+
+# 支援的輸出格式
+OUTPUT_FORMATS = ('txt', 'srt', 'vtt', 'json')
+DEFAULT_OUTPUT_FORMATS = ('txt', 'srt')
+
+def _segment_text(segment):
+    """段落文字，有說話者標籤時加在前面"""
+    text = segment["text"].strip()
+    if segment.get("speaker"):
+        return f"[{segment['speaker']}] {text}"
+    return text
+
+def _write_txt(f, segments, model_name):
+    f.write(f"# 使用模型: {model_name}\n\n")
+    for segment in segments:
+        f.write(_segment_text(segment) + "\n")
+
+def _write_srt(f, segments, model_name):
+    # 第一段字幕標示使用的模型
+    f.write(f"1\n00:00:00,000 --> 00:00:01,000\n使用模型: {model_name}\n\n")
+    for i, segment in enumerate(segments, 2):
+        start_time = format_timestamp(segment["start"]).replace(".", ",")
+        end_time = format_timestamp(segment["end"]).replace(".", ",")
+        f.write(f"{i}\n{start_time} --> {end_time}\n{_segment_text(segment)}\n\n")
+
+def _write_vtt(f, segments, model_name):
+    f.write(f"WEBVTT\n\nNOTE 使用模型: {model_name}\n\n")
+    for segment in segments:
+        start_time = format_timestamp(segment["start"])
+        end_time = format_timestamp(segment["end"])
+        f.write(f"{start_time} --> {end_time}\n{_segment_text(segment)}\n\n")
+
+def _write_json(f, segments, model_name):
+    items = []
+    for s in segments:
+        item = {'start': round(s["start"], 3), 'end': round(s["end"], 3), 'text': s["text"].strip()}
+        if s.get("speaker"):
+            item['speaker'] = s["speaker"]
+        if s.get("words"):
+            item['words'] = [
+                {'word': w["word"], 'start': round(w["start"], 3), 'end': round(w["end"], 3),
+                 'probability': round(w["probability"], 3)}
+                for w in s["words"]
+            ]
+        items.append(item)
+    json.dump({'model': model_name, 'segments': items}, f, ensure_ascii=False, indent=2)
+
+_WRITERS = {'txt': _write_txt, 'srt': _write_srt, 'vtt': _write_vtt, 'json': _write_json}
+
+def write_transcripts(segments, output_dir, base_name, model_name, formats=DEFAULT_OUTPUT_FORMATS):
     """
+    將轉錄段落寫成指定的輸出格式，回傳 {格式: 檔案路徑}
+
+    segments 可以是段落 dict 的列表或 SegmentStore，每個格式逐段寫出。
+    """
+    output_files = {}
+    for fmt in formats:
+        if fmt not in _WRITERS:
+            raise ValueError(f"不支援的輸出格式: {fmt}")
+        path = os.path.join(str(output_dir), f"{base_name}.{fmt}")
+        with open(path, "w", encoding="utf-8") as f:
+            _WRITERS[fmt](f, segments, model_name)
+        output_files[fmt] = path
+
+    # 更新輸出資料夾的全文檢索索引；索引失敗不影響轉錄結果
     try:
-        # 轉換為 Path 對象
-        input_dir = Path(input_dir).resolve()
-        output_dir = Path(output_dir).resolve()
-        
-        logging.info(f"輸入資料夾: {input_dir}")
-        logging.info(f"輸出資料夾: {output_dir}")
-        
-        # 檢查輸入資料夾是否存在
-        if not input_dir.exists():
-            raise FileNotFoundError(f"找不到輸入資料夾: {input_dir}")
-        
-        # 創建輸出資料夾
-        output_dir.mkdir(exist_ok=True)
-        
-        # 獲取所有 WAV 文件
-        audio_files = []
-        for file in input_dir.iterdir():
-            if file.suffix.lower() == '.wav':
-                # 檢查檔案是否可讀
-                if not os.access(file, os.R_OK):
-                    logging.warning(f"無法讀取檔案: {file}")
-                    continue
-                # 檢查檔案大小
-                if file.stat().st_size == 0:
-                    logging.warning(f"檔案大小為 0: {file}")
-                    continue
-                audio_files.append(file)
-        
-        if not audio_files:
-            logging.warning("警告：沒有找到任何有效的 WAV 檔案")
-            return
-        
-        # 按照檔案名稱排序
-        audio_files.sort(key=lambda x: x.name)
-        
-        logging.info(f"找到 {len(audio_files)} 個音頻文件")
-        
-        # 顯示所有找到的檔案
-        for audio_file in audio_files:
-            size_mb = audio_file.stat().st_size / (1024*1024)
-            logging.info(f"發現檔案: {audio_file.name} ({size_mb:.2f} MB)")
-        
-        # 處理每個音頻檔案
-        success_count = 0
-        for i, audio_path in enumerate(audio_files, 1):
-            try:
-                logging.info(f"\n開始處理第 {i}/{len(audio_files)} 個檔案: {audio_path.name}")
-                
-                # 再次確認檔案存在且可讀
-                if not audio_path.exists():
-                    logging.error(f"檔案不存在: {audio_path}")
-                    continue
-                
-                if not os.access(audio_path, os.R_OK):
-                    logging.error(f"無法讀取檔案: {audio_path}")
-                    continue
-                
-                # 設定輸出檔案路徑
-                txt_output_path = output_dir / f"{audio_path.stem}.txt"
-                srt_output_path = output_dir / f"{audio_path.stem}.srt"
-                
-                # 檢查是否已經處理過
-                if txt_output_path.exists() and srt_output_path.exists():
-                    logging.info(f"檔案 {audio_path.name} 已經處理過，跳過")
-                    success_count += 1
-                    continue
-                
-                # 進行轉錄
-                full_text, srt_content = transcribe_audio(None, audio_path, output_dir)
-                
-                if full_text and srt_content:
-                    # 保存純文字版本
-                    txt_output_path.write_text(full_text, encoding='utf-8')
-                    logging.info(f"純文字轉錄結果已保存至: {txt_output_path}")
-                    
-                    # 保存 SRT 格式版本
-                    srt_output_path.write_text(srt_content, encoding='utf-8')
-                    logging.info(f"SRT 格式轉錄結果已保存至: {srt_output_path}")
-                    
-                    success_count += 1
-                else:
-                    logging.error(f"處理 {audio_path.name} 失敗")
-                
-                logging.info(f"完成處理: {audio_path.name}\n")
-                
-            except Exception as e:
-                logging.error(f"處理檔案 {audio_path.name} 時發生錯誤: {str(e)}")
-                logging.error(f"錯誤追蹤:\n{traceback.format_exc()}")
-                continue
-        
-        # 顯示處理結果統計
-        logging.info("\n" + "="*50)
-        logging.info(f"轉錄完成！成功處理 {success_count}/{len(audio_files)} 個檔案")
-        logging.info(f"轉錄結果已保存至: {output_dir}")
-        logging.info("="*50 + "\n")
-    
+        TranscriptIndex.for_folder(str(output_dir)).add_transcript(base_name, segments, model_name)
     except Exception as e:
-        logging.error(f"處理過程中發生錯誤: {str(e)}")
-        logging.error(f"錯誤追蹤:\n{traceback.format_exc()}")
-        raise
-
-def main():
-    """主函數"""
-    print("開始執行語音轉錄程式...")
-    print("=" * 50)
-    
-    # 設置目錄
-    current_dir = os.path.dirname(os.path.abspath(__file__))
-    input_dir = os.path.join(current_dir, "訪談記錄")
-    output_dir = os.path.join(current_dir, "轉錄結果")
-    
-    print(f"當前目錄: {current_dir}")
-    print(f"輸入目錄: {input_dir}")
-    print(f"輸出目錄: {output_dir}")
-    print("=" * 50)
-    
-    # 創建輸出目錄
-    os.makedirs(output_dir, exist_ok=True)
-    print(f"已創建輸出目錄: {output_dir}")
-    
-    # 檢查系統資源
-    system_info = check_gpu()
-    
-    # 選擇模型大小
-    model_size = select_model_size(system_info)
-    print(f"\n選擇使用模型: {model_size}")
-    
-    # 獲取所有音頻文件
+        logging.warning(f"更新搜尋索引失敗 {base_name}: {str(e)}")
+    return output_files
+
+# 命令列預設值
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_INPUT_DIR = os.path.join(BASE_DIR, "訪談記錄")
+DEFAULT_OUTPUT_DIR = os.path.join(BASE_DIR, "轉錄結果")
+AUDIO_EXTENSIONS = ('.wav', '.mp3', '.m4a')
+MODEL_CHOICES = ["tiny", "base", "small", "medium", "large-v3", "auto"]
+
+def build_arg_parser():
+    """建立命令列參數解析器"""
+    parser = argparse.ArgumentParser(
+        description="Whisper 批次語音轉錄",
+        epilog="範例: python whisper_transcribe.py \"錄音/**/*.wav\" -o 結果 -m small -w 2 -f txt,srt,json --summary -"
+    )
+    parser.add_argument("inputs", nargs="*",
+                        help=f"音頻檔案、資料夾或 glob 樣式（支援 **），預設為 {DEFAULT_INPUT_DIR}")
+    parser.add_argument("-o", "--output-dir", default=DEFAULT_OUTPUT_DIR, help="輸出資料夾")
+    parser.add_argument("-m", "--model", default="auto", choices=MODEL_CHOICES,
+                        help="Whisper 模型，auto 依可用記憶體選擇")
+    parser.add_argument("-d", "--device", default="auto", choices=["auto", "cuda", "cpu"], help="運算設備")
+    parser.add_argument("-p", "--profile", default="auto", choices=["auto"] + list(PROFILES),
+                        help="執行設定檔，auto 依模型清單的設定或設備預設（GPU fp16、CPU fp32）")
+    parser.add_argument("-l", "--language", default="auto", help="轉錄語言，auto 為轉錄前逐檔偵測一次")
+    parser.add_argument("-w", "--workers", type=int, default=1,
+                        help="同時轉錄的檔案數；每個工作執行緒各自佔用一個模型實例")
+    parser.add_argument("-f", "--formats", default=",".join(DEFAULT_OUTPUT_FORMATS),
+                        help=f"輸出格式，以逗號分隔（可用: {', '.join(OUTPUT_FORMATS)}）")
+    parser.add_argument("--word-timestamps", action="store_true", help="產生詞級時間戳（json 輸出含每個詞的時間）")
+    parser.add_argument("--max-line-chars", type=int, default=0, help="字幕每行字數上限，0 表示不重新切分")
+    parser.add_argument("--max-line-seconds", type=float, default=0.0, help="字幕每行秒數上限，0 表示不限制")
+    parser.add_argument("--min-avg-logprob", type=float, help="丟棄 avg_logprob 低於此值的段落")
+    parser.add_argument("--max-no-speech-prob", type=float, help="丟棄 no_speech_prob 高於此值的段落")
+    parser.add_argument("--script", choices=list(CONVERSIONS),
+                        help="簡繁轉換（需要 opencc-python-reimplemented），s2twp 另外換成台灣慣用詞")
+    parser.add_argument("--punctuate", action="store_true", help="補上句中與句尾的全形標點")
+    parser.add_argument("--glossary", metavar="PATH", help="詞語表（每行「錯誤寫法=正確寫法」或 JSON 對照表）")
+    parser.add_argument("--draft-model", choices=MODEL_CHOICES[:-1],
+                        help="推測解碼用的小模型（例如 tiny），輸出與 --model 相同但解碼更快")
+    parser.add_argument("--draft-tokens", type=int, default=4, help="推測解碼每輪由小模型猜測的 token 數")
+    parser.add_argument("--diarize", action="store_true", help="說話者分離（CPU，與轉錄同時進行），輸出加上說話者標籤")
+    parser.add_argument("--num-speakers", type=int, help="說話者人數，未指定時自動判斷")
+    parser.add_argument("--max-speakers", type=int, default=6, help="自動判斷時的說話者人數上限")
+    parser.add_argument("--checkpoint-dir", default=CHECKPOINT_FOLDER, help="檢查點資料夾")
+    parser.add_argument("--no-checkpoint", dest="checkpoint", action="store_false",
+                        help="不讀取也不保存檢查點")
+    parser.add_argument("--skip-existing", action="store_true", help="所有輸出格式都已存在的檔案直接跳過")
+    parser.add_argument("--summary", metavar="PATH", help="將 JSON 執行摘要寫入檔案，- 表示標準輸出")
+    parser.add_argument("--log-level", default="INFO", choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+                        help="日誌等級（日誌輸出到標準錯誤）")
+    return parser
+
+def expand_inputs(patterns):
+    """展開輸入的檔案、資料夾與 glob 樣式，依名稱排序並去除重複"""
     audio_files = []
-    for ext in ['.wav', '.mp3', '.m4a']:
-        audio_files.extend(list(Path(input_dir).glob(f'*{ext}')))
-    
+    seen = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            matches = [os.path.join(pattern, name) for name in os.listdir(pattern)
+                       if os.path.splitext(name)[1].lower() in AUDIO_EXTENSIONS]
+        else:
+            matches = glob.glob(pattern, recursive=True)
+            if not matches:
+                logging.warning(f"沒有符合的檔案: {pattern}")
+        for path in sorted(matches):
+            path = os.path.abspath(path)
+            if os.path.isfile(path) and path not in seen:
+                seen.add(path)
+                audio_files.append(path)
+    return audio_files
+
+def transcribe_one(audio_path, model_name, device, language, formats, output_dir,
+                   model_pool, rtf_stats, checkpoint_dir=None, skip_existing=False,
+                   word_timestamps=False, postprocess_options=None, draft_model_name=None, draft_tokens=4,
+                   diarize_options=None, execution_profile=None):
+    """
+    轉錄單一檔案並回傳該檔案的摘要
+
+    有 diarize_options（num_speakers、max_speakers）時，說話者分離在另一個執行緒
+    以 CPU 處理同一份 PCM，與解碼同時進行。
+    """
+    base_name = os.path.splitext(os.path.basename(audio_path))[0]
+    entry = {
+        'file': audio_path,
+        'status': 'error',
+        'model': model_name,
+        'device': device,
+        'duration': None,
+        'decode_seconds': None,
+        'wall_seconds': None,
+        'rtf': None,
+        'resumed_from': None,
+        'outputs': {},
+        'error': None
+    }
+    started = time.time()
+    try:
+        expected = {fmt: os.path.join(output_dir, f"{base_name}.{fmt}") for fmt in formats}
+        if skip_existing and all(os.path.exists(path) for path in expected.values()):
+            logging.info(f"檔案 {os.path.basename(audio_path)} 已經處理過，跳過")
+            entry.update(status='skipped', outputs=expected)
+            return entry
+
+        checkpoint = None
+        resume_state = None
+        if checkpoint_dir:
+            checkpoint = TranscriptCheckpoint(compute_file_hash(audio_path), model_name, language,
+                                              folder=checkpoint_dir)
+            resume_state = checkpoint.load()
+        resumed_from = resume_state['offset'] if resume_state else 0.0
+
+        audio = audio_path
+        diarization = None
+        diarizer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="diarize") if diarize_options is not None else None
+        if diarizer is not None:
+            audio = whisper.load_audio(audio_path)
+            diarization = diarizer.submit(diarize, audio, **diarize_options)
+            diarizer.shutdown(wait=False)
+
+        with model_pool.acquire(model_name, device) as model, \
+                (model_pool.acquire(draft_model_name, device) if draft_model_name else nullcontext()) as draft_model:
+            # 模型池中的實例只在第一次使用該設定檔時編譯與暖機
+            profile = prepare_model(model, model_name, device, execution_profile)
+            entry['execution_profile'] = profile
+            logging.info(f"開始轉錄 {os.path.basename(audio_path)}（{model_name}@{device}，{profile}）")
+            decode_started = time.time()
+            with execution_context(profile, device, model):
+                result = decode_engine.transcribe(
+                    model, audio,
+                    language=language,
+                    fp16=uses_fp16(profile, device),
+                    word_timestamps=word_timestamps,
+                    draft_model=draft_model,
+                    draft_tokens=draft_tokens,
+                    on_window=checkpoint.save_window if checkpoint else None,
+                    resume_state=resume_state
+                )
+            decode_seconds = time.time() - decode_started
+
+        segments = result["segments"]
+        if diarization is not None:
+            turns = diarization.result()
+            entry['speakers'] = len({turn['speaker'] for turn in turns})
+            segments = assign_speakers(segments, turns)
+
+        segments = postprocess_segments(segments, **(postprocess_options or {}))
+        entry['outputs'] = write_transcripts(segments, output_dir, base_name, model_name, formats)
+        if checkpoint is not None:
+            checkpoint.remove()
+
+        decoded = result["duration"] - resumed_from
+        rtf_stats.record(model_name, device, decoded, decode_seconds)
+        entry.update(
+            status='completed',
+            duration=round(result["duration"], 2),
+            decode_seconds=round(decode_seconds, 2),
+            rtf=round(decode_seconds / decoded, 4) if decoded > 0 else None,
+            resumed_from=round(resumed_from, 2) if resume_state else None,
+            language=result["language"],
+            segments=len(segments),
+            decode_stats=result.get("decode_stats")
+        )
+        logging.info(f"完成處理: {os.path.basename(audio_path)}，"
+                     f"音頻 {format_timestamp(result['duration'])}，耗時 {decode_seconds:.1f} 秒")
+    except Exception as e:
+        logging.error(f"處理檔案 {os.path.basename(audio_path)} 時發生錯誤: {str(e)}", exc_info=True)
+        entry['error'] = str(e)
+    finally:
+        entry['wall_seconds'] = round(time.time() - started, 2)
+    return entry
+
+def write_summary(summary, path):
+    """輸出 JSON 執行摘要"""
+    content = json.dumps(summary, ensure_ascii=False, indent=2)
+    if path == "-":
+        sys.stdout.write(content + "\n")
+        sys.stdout.flush()
+    else:
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(content + "\n")
+        logging.info(f"執行摘要已保存至: {path}")
+
+def main(argv=None):
+    """命令列入口：批次轉錄並輸出 JSON 執行摘要，有檔案失敗時回傳 1"""
+    parser = build_arg_parser()
+    args = parser.parse_args(argv)
+    logging.getLogger().setLevel(args.log_level)
+
+    formats = [fmt.strip().lower() for fmt in args.formats.split(",") if fmt.strip()]
+    unknown = [fmt for fmt in formats if fmt not in OUTPUT_FORMATS]
+    if not formats or unknown:
+        parser.error(f"不支援的輸出格式: {', '.join(unknown) or args.formats}")
+    if args.workers < 1:
+        parser.error("--workers 必須大於 0")
+    language = None if args.language == "auto" else args.language
+
+    audio_files = expand_inputs(args.inputs or [DEFAULT_INPUT_DIR])
+    output_dir = os.path.abspath(args.output_dir)
+    os.makedirs(output_dir, exist_ok=True)
+
+    if args.device == "auto":
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+    else:
+        device = args.device
+        if device == "cuda" and not torch.cuda.is_available():
+            parser.error("指定了 --device cuda，但 CUDA 不可用")
+
+    model_name = args.model
+    if model_name == "auto":
+        # check_gpu() 會印出資源資訊，導到標準錯誤以免混入標準輸出的 JSON 摘要
+        with redirect_stdout(sys.stderr):
+            system_info = check_gpu()
+        if device == "cpu":
+            system_info = dict(system_info, cuda_available=False)
+        model_name = select_model_size(system_info)
+        logging.info(f"依可用記憶體選擇模型: {model_name}")
+
+    logging.info(f"找到 {len(audio_files)} 個音頻文件，輸出至 {output_dir}，"
+                 f"模型 {model_name}@{device}，同時處理 {args.workers} 個")
+
+    draft_model_name = args.draft_model if args.draft_model != model_name else None
+
+    postprocess_options = {
+        'min_avg_logprob': args.min_avg_logprob,
+        'max_no_speech_prob': args.max_no_speech_prob,
+        'max_chars': args.max_line_chars,
+        'max_seconds': args.max_line_seconds
+    }
+    try:
+        postprocess_options['text_pipeline'] = build_pipeline(args.script, args.glossary, args.punctuate)
+    except (OSError, ValueError) as e:
+        parser.error(f"無法讀取詞語表: {str(e)}")
+
+    diarize_options = None
+    if args.diarize:
+        diarize_options = {'num_speakers': args.num_speakers, 'max_speakers': args.max_speakers}
+
+    started = time.time()
+    model_pool = ModelPool(max_instances=args.workers)
+    rtf_stats = RTFStats()
+
+    # 未指定語言時先逐檔偵測（依音頻雜湊快取），再依語言分組依序轉錄
+    languages = {path: language for path in audio_files}
+    if language is None:
+        for path in audio_files:
+            try:
+                languages[path] = identify_language(path, compute_file_hash(path), model_pool,
+                                                    model_name, device)['language']
+            except Exception as e:
+                logging.warning(f"語言偵測失敗，改由解碼器偵測 {os.path.basename(path)}: {str(e)}")
+        groups = group_by_language(audio_files, lambda path: languages[path] or 'auto')
+        audio_files = [path for group in groups.values() for path in group]
+        logging.info("語言分組: " + ", ".join(f"{lang} {len(group)} 個" for lang, group in groups.items()))
+
+    with ThreadPoolExecutor(max_workers=args.workers, thread_name_prefix="transcribe") as executor:
+        futures = [
+            executor.submit(transcribe_one, path, model_name, device, languages[path], formats, output_dir,
+                            model_pool, rtf_stats,
+                            checkpoint_dir=args.checkpoint_dir if args.checkpoint else None,
+                            skip_existing=args.skip_existing,
+                            word_timestamps=args.word_timestamps,
+                            postprocess_options=postprocess_options,
+                            draft_model_name=draft_model_name,
+                            draft_tokens=args.draft_tokens,
+                            diarize_options=diarize_options,
+                            execution_profile=args.profile)
+            for path in audio_files
+        ]
+        results = [future.result() for future in futures]
+    wall_seconds = time.time() - started
+
+    counts = {status: sum(1 for r in results if r['status'] == status)
+              for status in ('completed', 'skipped', 'error')}
+    audio_seconds = sum(r['duration'] or 0.0 for r in results)
+    decode_stats = {}
+    for r in results:
+        for key, value in (r.get('decode_stats') or {}).items():
+            decode_stats[key] = decode_stats.get(key, 0) + value
+    summary = {
+        'started_at': datetime.fromtimestamp(started).isoformat(timespec='seconds'),
+        'wall_seconds': round(wall_seconds, 2),
+        'model': model_name,
+        'device': device,
+        'language': language or 'auto',
+        'languages': {lang: sum(1 for r in results if r.get('language') == lang)
+                      for lang in sorted({r['language'] for r in results if r.get('language')})},
+        'workers': args.workers,
+        'formats': formats,
+        'output_dir': output_dir,
+        'total': len(results),
+        'completed': counts['completed'],
+        'skipped': counts['skipped'],
+        'failed': counts['error'],
+        'audio_seconds': round(audio_seconds, 2),
+        'throughput_rtf': round(wall_seconds / audio_seconds, 4) if audio_seconds > 0 else None,
+        'decode_stats': decode_stats,
+        'files': results
+    }
+
+    logging.info(f"轉錄完成！成功 {counts['completed']}、跳過 {counts['skipped']}、"
+                 f"失敗 {counts['error']}，共 {len(results)} 個檔案，總耗時 {wall_seconds:.1f} 秒")
+    if args.summary:
+        write_summary(summary, args.summary)
+
     if not audio_files:
-        print("未找到任何音頻文件")
-        return
-    
-    print(f"\n找到 {len(audio_files)} 個音頻文件")
-    
-    # 處理每個音頻文件
-    success_count = 0
-    for i, audio_file in enumerate(audio_files, 1):
-        print("\n" + "-" * 50)
-        print(f"處理第 {i}/{len(audio_files)} 個檔案: {audio_file.name}")
-        print("-" * 50)
-        
-        print("開始轉錄...")
-        audio_path = os.path.join(input_dir, audio_file)
-        
-        try:
-            if transcribe_audio(None, audio_path, output_dir):
-                success_count += 1
-                print(f"處理 {audio_file.name} 成功")
-            else:
-                print(f"處理 {audio_file.name} 失敗")
-        except Exception as e:
-            print(f"轉錄過程中發生錯誤: {str(e)}")
-            logging.error(f"轉錄過程中發生錯誤: {str(e)}")
-            logging.error("錯誤追蹤:", exc_info=True)
-            print("錯誤追蹤:")
-            traceback.print_exc()
-        
-        print(f"完成處理: {audio_file.name}")
-        print("-" * 50)
-    
-    # 輸出總結
-    print("\n" + "=" * 50)
-    print(f"轉錄完成！成功處理 {success_count}/{len(audio_files)} 個檔案")
-    print(f"轉錄結果已保存至: {output_dir}")
-    print("=" * 50)
-    print("\n程式執行完成！")
+        logging.warning("未找到任何音頻文件")
+        return 1
+    return 1 if counts['error'] else 0
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    sys.exit(main())
@@ -0,0 +1,483 @@
+"""
+背景轉錄工作程序池
+
+以獨立子程序執行 Whisper 解碼，避免與 Flask 行程爭奪 GIL，
+並把 OOM 或原生程式庫崩潰隔離在子程序內，不會拖垮網頁服務與任務狀態。
+"""
+import time
+import logging
+import threading
+import itertools
+import collections
+import multiprocessing as mp
+from multiprocessing import connection, shared_memory
+from concurrent.futures import Future
+
+import numpy as np
+import torch
+import whisper
+
+import decode_engine
+from decode_engine import DecodeInterrupted
+from execution_profiles import prepare_model, execution_context, uses_fp16
+from segment_store import SegmentStore
+
+# 父程序透過共享整數通知工作程序停止，索引對應停止原因
+_STOP_REASONS = (None, 'cancel', 'pause', 'preempt')
+
+
+class WorkerCrashedError(RuntimeError):
+    """工作程序在處理任務時異常終止"""
+
+
+def _worker_main(worker_id, conn, heartbeat, control, heartbeat_interval, model_name, device):
+    """工作程序主迴圈：預先載入模型，然後逐一處理父程序派發的任務"""
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - [worker-%(process)d] - %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S'
+    )
+
+    # 心跳執行緒：即使主執行緒正在長時間解碼也會持續更新時間戳
+    stop_event = threading.Event()
+
+    def beat():
+        while not stop_event.is_set():
+            heartbeat.value = time.time()
+            stop_event.wait(heartbeat_interval)
+
+    threading.Thread(target=beat, daemon=True).start()
+
+    from model_loader import load_whisper_model
+
+    model = None
+    loaded_key = None
+    draft_models = {}
+
+    def ensure_model(name, dev):
+        nonlocal model, loaded_key
+        if loaded_key == (name, dev):
+            return model
+        logging.info(f"工作程序 {worker_id} 載入 {name} 模型 ({dev})")
+        model = None
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+        model = load_whisper_model(name, device=dev)
+        loaded_key = (name, dev)
+        return model
+
+    def ensure_draft(name, dev):
+        # 推測解碼用的小模型常駐在工作程序內
+        if not name:
+            return None
+        if (name, dev) not in draft_models:
+            logging.info(f"工作程序 {worker_id} 載入草稿模型 {name} ({dev})")
+            draft_models[(name, dev)] = load_whisper_model(name, device=dev)
+        return draft_models[(name, dev)]
+
+    try:
+        if model_name:
+            ensure_model(model_name, device)
+        conn.send(('ready', None, {'model': model_name, 'device': device}))
+
+        while True:
+            message = conn.recv()
+            if message is None:
+                break
+
+            if message['type'] == 'preload':
+                try:
+                    ensure_model(message['model_name'], message['device'])
+                except Exception as e:
+                    logging.error(f"工作程序 {worker_id} 預載模型失敗: {str(e)}")
+                conn.send(('ready', None, {'model': message['model_name'], 'device': message['device']}))
+                continue
+
+            job_id = message['job_id']
+            try:
+                current_model = ensure_model(message['model_name'], message['device'])
+                draft_model = ensure_draft(message['options'].get('draft_model'), message['device'])
+                result = _run_job(current_model, message, conn, control, draft_model)
+                conn.send(('result', job_id, result))
+            except DecodeInterrupted as e:
+                logging.info(f"工作程序 {worker_id} 的任務 {job_id} 在窗口邊界停止: {e.reason}")
+                conn.send(('interrupted', job_id, (e.reason, e.state)))
+            except Exception as e:
+                logging.error(f"工作程序 {worker_id} 處理任務 {job_id} 失敗: {str(e)}", exc_info=True)
+                conn.send(('error', job_id, str(e)))
+    except (EOFError, KeyboardInterrupt):
+        pass
+    finally:
+        stop_event.set()
+
+
+def _run_job(model, job, conn, control, draft_model=None):
+    """從共享記憶體讀取 PCM 並執行轉錄，解碼進度回傳給父程序"""
+    job_id = job['job_id']
+
+    def on_progress(decoded_seconds, total_seconds):
+        conn.send(('progress', job_id, (decoded_seconds, total_seconds)))
+
+    def on_window(state, new_segments):
+        # 只傳送新增的段落，完整段落清單由父程序累積
+        slim_state = {key: value for key, value in state.items() if key != 'segments'}
+        conn.send(('window', job_id, (slim_state, new_segments)))
+
+    def should_stop():
+        return _STOP_REASONS[control.value] if control.value < len(_STOP_REASONS) else 'cancel'
+
+    shm = shared_memory.SharedMemory(name=job['shm_name'])
+    try:
+        audio = np.ndarray(job['shape'], dtype=np.float32, buffer=shm.buf)
+        profile = prepare_model(model, job['model_name'], job['device'], job['options'].get('execution_profile'))
+        options = {key: value for key, value in job['options'].items()
+                   if key not in ('draft_model', 'execution_profile')}
+        options['fp16'] = uses_fp16(profile, job['device'])
+        with execution_context(profile, job['device'], model):
+            result = decode_engine.transcribe(model, audio, draft_model=draft_model,
+                                              on_progress=on_progress, on_window=on_window,
+                                              should_stop=should_stop, **options)
+        del audio
+        return {
+            'text': result['text'],
+            'segments': result['segments'],
+            'language': result.get('language'),
+            'decode_stats': result.get('decode_stats'),
+            'execution_profile': profile
+        }
+    finally:
+        try:
+            shm.close()
+        except BufferError:
+            # 仍有張量引用共享緩衝區時，交由程序結束時回收
+            pass
+
+
+class TranscriptionWorkerPool:
+    """以子程序執行轉錄的工作池，負責派工、心跳監控與自動重啟"""
+
+    def __init__(self, num_workers=2, model_name=None, device="cpu",
+                 heartbeat_interval=5.0, heartbeat_timeout=120.0, max_retries=1):
+        self.num_workers = max(1, int(num_workers))
+        self.model_name = model_name
+        self.device = device
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat_timeout = heartbeat_timeout
+        self.max_retries = max_retries
+
+        self._ctx = mp.get_context('spawn')
+        self._lock = threading.Lock()
+        self._workers = {}
+        self._jobs = {}
+        self._pending = collections.deque()
+        self._job_ids = itertools.count(1)
+        self._closed = False
+        self._restarts = 0
+        self._wake_reader, self._wake_writer = self._ctx.Pipe(duplex=False)
+
+        for worker_id in range(self.num_workers):
+            self._spawn_worker(worker_id, model_name, device)
+
+        self._supervisor = threading.Thread(target=self._supervise, name='worker-pool-supervisor', daemon=True)
+        self._supervisor.start()
+        logging.info(f"已啟動 {self.num_workers} 個轉錄工作程序 (預載模型: {model_name}, 設備: {device})")
+
+    # ---- 公開介面 ----
+
+    def submit(self, audio_path, model_name, device, options, on_progress=None, on_window=None,
+               should_stop=None):
+        """
+        載入音頻到共享記憶體並排入任務，回傳 Future
+
+        on_progress(decoded_seconds, total_seconds)、on_window(state, new_segments) 與
+        should_stop() 會在監控執行緒中被呼叫；should_stop() 回傳停止原因時，
+        工作程序會在下一個窗口邊界停止，Future 以 DecodeInterrupted 結束。
+        工作程序崩潰後重試時，會從最後一個完成的窗口繼續。
+        """
+        audio = whisper.load_audio(audio_path)
+        shm = shared_memory.SharedMemory(create=True, size=max(1, audio.nbytes))
+        np.ndarray(audio.shape, dtype=np.float32, buffer=shm.buf)[:] = audio
+        shape = audio.shape
+        del audio
+
+        future = Future()
+        job_id = next(self._job_ids)
+        job = {
+            'type': 'job',
+            'job_id': job_id,
+            'shm_name': shm.name,
+            'shape': shape,
+            'model_name': model_name,
+            'device': device,
+            'options': dict(options)
+        }
+        with self._lock:
+            if self._closed:
+                shm.close()
+                shm.unlink()
+                raise RuntimeError("工作程序池已關閉")
+            self._jobs[job_id] = {
+                'future': future,
+                'shm': shm,
+                'payload': job,
+                'retries': 0,
+                'on_progress': on_progress,
+                'on_window': on_window,
+                'should_stop': should_stop,
+                'last_state': options.get('resume_state')
+            }
+            self._pending.append(job_id)
+        self._wake()
+        return future
+
+    def preload(self, model_name, device):
+        """讓閒置的工作程序預先切換到指定模型"""
+        with self._lock:
+            self.model_name = model_name
+            self.device = device
+            for worker in self._workers.values():
+                if worker['state'] == 'idle':
+                    self._send(worker, {'type': 'preload', 'model_name': model_name, 'device': device})
+                    worker['state'] = 'loading'
+
+    def status(self):
+        """回傳工作程序狀態摘要"""
+        with self._lock:
+            now = time.time()
+            return {
+                'workers': [
+                    {
+                        'id': worker_id,
+                        'pid': worker['process'].pid,
+                        'state': worker['state'],
+                        'job_id': worker['job_id'],
+                        'heartbeat_age': round(now - worker['heartbeat'].value, 1)
+                    }
+                    for worker_id, worker in sorted(self._workers.items())
+                ],
+                'pending': len(self._pending),
+                'restarts': self._restarts
+            }
+
+    def close(self, timeout=10):
+        """停止所有工作程序並釋放尚未完成任務的共享記憶體"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            workers = list(self._workers.values())
+            for worker in workers:
+                self._send(worker, None)
+        self._wake()
+
+        deadline = time.time() + timeout
+        for worker in workers:
+            worker['process'].join(max(0, deadline - time.time()))
+            if worker['process'].is_alive():
+                worker['process'].kill()
+                worker['process'].join()
+
+        with self._lock:
+            for job_id in list(self._jobs):
+                self._finish_job(job_id, error=RuntimeError("工作程序池已關閉"))
+
+    # ---- 內部實作 ----
+
+    def _spawn_worker(self, worker_id, model_name, device):
+        parent_conn, child_conn = self._ctx.Pipe()
+        heartbeat = self._ctx.Value('d', time.time(), lock=False)
+        control = self._ctx.Value('i', 0, lock=False)
+        process = self._ctx.Process(
+            target=_worker_main,
+            args=(worker_id, child_conn, heartbeat, control, self.heartbeat_interval, model_name, device),
+            name=f'whisper-worker-{worker_id}',
+            daemon=True
+        )
+        process.start()
+        child_conn.close()
+        self._workers[worker_id] = {
+            'process': process,
+            'conn': parent_conn,
+            'heartbeat': heartbeat,
+            'control': control,
+            'state': 'loading',
+            'job_id': None
+        }
+
+    def _wake(self):
+        try:
+            self._wake_writer.send_bytes(b'1')
+        except OSError:
+            pass
+
+    def _send(self, worker, message):
+        try:
+            worker['conn'].send(message)
+            return True
+        except (OSError, EOFError, BrokenPipeError):
+            return False
+
+    def _supervise(self):
+        while True:
+            with self._lock:
+                if self._closed and not any(w['process'].is_alive() for w in self._workers.values()):
+                    return
+                self._dispatch()
+                conn_map = {w['conn']: worker_id for worker_id, w in self._workers.items()}
+                sentinel_map = {w['process'].sentinel: worker_id for worker_id, w in self._workers.items()}
+
+            ready = connection.wait(list(conn_map) + list(sentinel_map) + [self._wake_reader],
+                                    timeout=self.heartbeat_interval)
+
+            with self._lock:
+                for obj in ready:
+                    if obj is self._wake_reader:
+                        while self._wake_reader.poll():
+                            self._wake_reader.recv_bytes()
+                    elif obj in conn_map:
+                        self._receive(conn_map[obj])
+                for obj in ready:
+                    if obj in sentinel_map:
+                        self._handle_dead_worker(sentinel_map[obj], "工作程序異常結束")
+                self._check_stop_requests()
+                self._check_heartbeats()
+
+    def _dispatch(self):
+        for worker in self._workers.values():
+            if not self._pending or self._closed:
+                return
+            if worker['state'] != 'idle':
+                continue
+            job_id = self._pending.popleft()
+            job = self._jobs.get(job_id)
+            if job is None:
+                continue
+            worker['control'].value = 0
+            if self._send(worker, job['payload']):
+                worker['state'] = 'busy'
+                worker['job_id'] = job_id
+            else:
+                self._pending.appendleft(job_id)
+
+    def _receive(self, worker_id):
+        worker = self._workers.get(worker_id)
+        try:
+            kind, job_id, payload = worker['conn'].recv()
+        except (EOFError, OSError):
+            # 連線中斷時交由 sentinel 處理
+            return
+
+        if kind == 'ready':
+            worker['state'] = 'idle'
+        elif kind == 'progress':
+            job = self._jobs.get(job_id)
+            if job is not None and job['on_progress'] is not None:
+                try:
+                    job['on_progress'](*payload)
+                except Exception as e:
+                    logging.warning(f"更新任務 {job_id} 進度時發生錯誤: {str(e)}")
+        elif kind == 'window':
+            job = self._jobs.get(job_id)
+            if job is not None:
+                self._record_window(job_id, job, *payload)
+        elif kind in ('result', 'error', 'interrupted'):
+            worker['state'] = 'idle'
+            worker['job_id'] = None
+            if kind == 'result':
+                self._finish_job(job_id, result=payload)
+            elif kind == 'interrupted':
+                self._finish_job(job_id, error=DecodeInterrupted(*payload))
+            else:
+                self._finish_job(job_id, error=RuntimeError(payload))
+
+    def _record_window(self, job_id, job, slim_state, new_segments):
+        if 'segments' not in job:
+            last_state = job['last_state']
+            job['segments'] = SegmentStore()
+            if last_state:
+                job['segments'].extend(last_state['segments'])
+        job['segments'].extend(new_segments)
+        job['last_state'] = dict(slim_state, segments=job['segments'])
+        if job['on_window'] is not None:
+            try:
+                job['on_window'](job['last_state'], new_segments)
+            except Exception as e:
+                logging.warning(f"保存任務 {job_id} 檢查點時發生錯誤: {str(e)}")
+
+    def _finish_job(self, job_id, result=None, error=None):
+        job = self._jobs.pop(job_id, None)
+        if job is None:
+            return
+        try:
+            job['shm'].close()
+            job['shm'].unlink()
+        except FileNotFoundError:
+            pass
+        if error is not None:
+            job['future'].set_exception(error)
+        else:
+            job['future'].set_result(result)
+
+    def _handle_dead_worker(self, worker_id, reason):
+        worker = self._workers.get(worker_id)
+        if worker is None:
+            return
+        process = worker['process']
+        process.join(1)
+        exitcode = process.exitcode
+        worker['conn'].close()
+
+        job_id = worker['job_id']
+        if job_id is not None and job_id in self._jobs:
+            job = self._jobs[job_id]
+            job['retries'] += 1
+            if job['retries'] <= self.max_retries and not self._closed:
+                # 從最後一個完成的窗口繼續，不重新解碼已完成的部分
+                job['payload']['options']['resume_state'] = job['last_state']
+                logging.warning(f"{reason} (exitcode={exitcode})，任務 {job_id} 重新排隊 (第 {job['retries']} 次重試)")
+                self._pending.appendleft(job_id)
+            else:
+                logging.error(f"{reason} (exitcode={exitcode})，任務 {job_id} 已達重試上限")
+                self._finish_job(job_id, error=WorkerCrashedError(f"{reason} (exitcode={exitcode})"))
+
+        del self._workers[worker_id]
+        if not self._closed:
+            self._restarts += 1
+            logging.warning(f"重新啟動工作程序 {worker_id}")
+            self._spawn_worker(worker_id, self.model_name, self.device)
+
+    def _check_stop_requests(self):
+        # 尚未派出的任務直接結束，執行中的任務通知工作程序在窗口邊界停止
+        for job_id in list(self._pending):
+            job = self._jobs.get(job_id)
+            reason = self._stop_reason(job)
+            if reason:
+                self._pending.remove(job_id)
+                state = job['payload']['options'].get('resume_state')
+                self._finish_job(job_id, error=DecodeInterrupted(reason, state))
+
+        for worker in self._workers.values():
+            if worker['state'] != 'busy' or worker['control'].value:
+                continue
+            reason = self._stop_reason(self._jobs.get(worker['job_id']))
+            if reason:
+                worker['control'].value = _STOP_REASONS.index(reason) if reason in _STOP_REASONS else 1
+
+    def _stop_reason(self, job):
+        if job is None or job['should_stop'] is None:
+            return None
+        try:
+            return job['should_stop']()
+        except Exception as e:
+            logging.warning(f"檢查任務停止請求時發生錯誤: {str(e)}")
+            return None
+
+    def _check_heartbeats(self):
+        now = time.time()
+        for worker_id, worker in list(self._workers.items()):
+            if not worker['process'].is_alive():
+                continue
+            if now - worker['heartbeat'].value > self.heartbeat_timeout:
+                logging.error(f"工作程序 {worker_id} 心跳逾時，強制終止")
+                worker['process'].kill()
+                self._handle_dead_worker(worker_id, "工作程序心跳逾時")
@@ -0,0 +1,80 @@
+"""
+邊壓縮邊輸出的 ZIP 串流
+
+zipfile 寫入不可 seek 的串流時會在每個檔案後附上資料描述（data descriptor），
+不需要回頭改寫檔頭。這裡讓 ZipFile 寫進一個只暫存最近輸出的緩衝區，
+每讀入一塊原始檔案就把已壓縮的位元組交給回應，整個過程不建立暫存檔，
+記憶體用量只與區塊大小有關，與檔案數量與總大小無關。
+"""
+import os
+import time
+import zipfile
+
+CHUNK_SIZE = 64 * 1024
+
+
+class _StreamBuffer:
+    """ZipFile 的輸出目標：只累積尚未送出的位元組，並記錄目前位置供 ZipFile 計算位移"""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_zip(entries, compresslevel=6, chunk_size=CHUNK_SIZE):
+    """
+    逐塊產生 ZIP 檔的位元組
+
+    entries 為 (壓縮檔內名稱, 檔案路徑) 的序列；compresslevel 為 0 時只封裝不壓縮，
+    1-9 為 deflate 壓縮等級。找不到的檔案會略過。
+    """
+    if compresslevel:
+        compression = zipfile.ZIP_DEFLATED
+    else:
+        compression, compresslevel = zipfile.ZIP_STORED, None
+
+    buffer = _StreamBuffer()
+    with zipfile.ZipFile(buffer, 'w', compression=compression, compresslevel=compresslevel) as archive:
+        for arcname, path in entries:
+            try:
+                stat = os.stat(path)
+                source = open(path, 'rb')
+            except OSError:
+                continue
+            info = zipfile.ZipInfo(arcname, date_time=time.localtime(stat.st_mtime)[:6])
+            info.compress_type = compression
+            # archive.open(info) 依 ZipInfo 的壓縮等級壓縮，不會套用 ZipFile 的預設值
+            if hasattr(zipfile.ZipInfo, 'compress_level'):
+                info.compress_level = compresslevel
+            else:
+                info._compresslevel = compresslevel
+            info.file_size = stat.st_size
+            with source, archive.open(info, 'w', force_zip64=stat.st_size > zipfile.ZIP64_LIMIT) as target:
+                while True:
+                    chunk = source.read(chunk_size)
+                    if not chunk:
+                        break
+                    target.write(chunk)
+                    data = buffer.drain()
+                    if data:
+                        yield data
+            # 壓縮器剩餘的資料與資料描述
+            yield buffer.drain()
+    # 關閉時寫入的中央目錄
+    yield buffer.drain()